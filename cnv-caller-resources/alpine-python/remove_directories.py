@@ -17,9 +17,12 @@ if __name__ == "__main__":
     parser.add_argument("cohort")
     parser.add_argument("run_type")
     parser.add_argument("gene")
+    parser.add_argument("--keep", help="start time of a run to keep, so that its completed steps can be resumed")
     args = parser.parse_args()
 
     for gene_folder in glob.glob(f"/mnt/output/{args.cohort}/*/{args.run_type}/{args.gene}/"):
+        if args.keep and gene_folder == f"/mnt/output/{args.cohort}/{args.keep}/{args.run_type}/{args.gene}/":
+            continue
         shutil.rmtree(gene_folder)
     for run_type_folder in glob.glob(f"/mnt/output/{args.cohort}/*/{args.run_type}"):
         remove_empty_folder(run_type_folder)
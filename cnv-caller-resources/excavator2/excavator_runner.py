@@ -1,6 +1,8 @@
 """
 Excavator2 alters its directory with the target files, so need to be run in one session
 
+Data preparation is the slowest step, so if it completed in a previous session with the same inputs it is skipped.
+Samples restored from the step cache aren't in ExperimentalFilePrepare.txt, so it is also skipped if that is empty
 """
 import argparse
 import os
@@ -27,20 +29,41 @@ subprocess.run(
 )
 
 
-subprocess.run(
-    [
-        "perl",
-        "EXCAVATORDataPrepare.pl",
-        f"{args.output_base}/ExperimentalFilePrepare.txt",
-        "--processors",
-        args.max_cpu,
-        "--target",
-        "target",
-        "--assembly",
-        "hg19",
-    ],
-    check=True,
-)
+prepare_inputs = ""
+for input_file in ["SourceTarget.txt", "capture.bed", "ExperimentalFilePrepare.txt"]:
+    with open(f"{args.output_base}/{input_file}") as handle:
+        prepare_inputs += handle.read()
+prepare_checkpoint = f"{args.output_base}/DataPrep/prepare-inputs.txt"
+previous_inputs = None
+if os.path.exists(prepare_checkpoint):
+    with open(prepare_checkpoint) as handle:
+        previous_inputs = handle.read()
+
+with open(f"{args.output_base}/ExperimentalFilePrepare.txt") as handle:
+    samples_to_prepare = handle.read().strip()
+
+if not samples_to_prepare:
+    print("Skipping EXCAVATORDataPrepare, all samples were restored from the step cache")
+elif previous_inputs == prepare_inputs:
+    print("Skipping EXCAVATORDataPrepare, already completed with the same inputs")
+else:
+    subprocess.run(
+        [
+            "perl",
+            "EXCAVATORDataPrepare.pl",
+            f"{args.output_base}/ExperimentalFilePrepare.txt",
+            "--processors",
+            args.max_cpu,
+            "--target",
+            "target",
+            "--assembly",
+            "hg19",
+        ],
+        check=True,
+    )
+    os.makedirs(os.path.dirname(prepare_checkpoint), exist_ok=True)
+    with open(prepare_checkpoint, "w") as handle:
+        handle.write(prepare_inputs)
 
 subprocess.run(
     [
@@ -1,6 +1,9 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 import datetime
-import pathlib
+import os
+import sys
+
+import toml
 
 from scripts.db_session import DbSession
 from scripts import (
@@ -8,60 +11,186 @@ from scripts import (
     copywriter,
     codex2,
     cnv_kit,
+    containers,
     decon,
     excavator2,
+    executors,
     exome_depth,
     gatk,
+    leases,
+    migrate,
     panelcn_mops,
+    planner,
     savvy_cnv,
+    scheduler,
     xhmm,
 )
+from settings import cnv_pat_settings
+
+# cnv_kit.CNVKit not currently run
+callers = [
+    codex2.CODEX2,
+    copywriter.Copywriter,
+    decon.DECoN,
+    excavator2.Excavator2,
+    exome_depth.ExomeDepthCohort,
+    exome_depth.ExomeDepthCase,
+    gatk.GATKCohort,
+    gatk.GATKCase,
+    panelcn_mops.panelcnMOPS,
+    savvy_cnv.SavvyCNV,
+    xhmm.XHMM,
+]
+
+# case callers use the normal panel model from the cohort caller for the same gene
+caller_dependencies = {exome_depth.ExomeDepthCase: exome_depth.ExomeDepthCohort, gatk.GATKCase: gatk.GATKCohort}
+
+
+def get_db_path(capture_name):
+    return f"{utils.get_cnv_patissier_dir()}/output/{capture_name}.sqlite"
 
 
 def init_db(capture_name):
-    db_path = f"{utils.get_cnv_patissier_dir()}/output/{capture_name}.sqlite"
+    db_path = get_db_path(capture_name)
+    if migrate.needs_migration(db_path):
+        raise Exception(f"Database {db_path} uses an older schema, please upgrade it by running with --migrate-db")
     DbSession.global_init(db_path)
+    migrate.set_schema_version(db_path)
+
+
+def preflight_images(capture_name):
+    """Pulls any missing docker images for the callers before any are started, recording the digests of the images"""
+    docker_images = [docker_image for caller_class in callers for docker_image in caller_class.required_images()]
+    digests = executors.executor.preflight(docker_images)
+    digest_path = f"{utils.get_cnv_patissier_dir()}/output/{capture_name}/image-digests.toml"
+    os.makedirs(os.path.dirname(digest_path), exist_ok=True)
+    with open(digest_path, "w") as handle:
+        toml.dump(digests, handle)
+
+
+def run_caller(caller_class, capture_name, gene, start_time, max_cpu, max_mem):
+    cnv_caller = caller_class(capture_name, gene, start_time)
+    cnv_caller.max_cpu = str(max_cpu)
+    cnv_caller.max_mem = str(max_mem)
+    try:
+        cnv_caller.main()
+    except leases.LeaseHeld as e:
+        raise scheduler.Deferred(f"{e}")
+
+
+def plan_run(capture_name, genes, start_time, max_jobs):
+    """Prints the estimated duration and suggested order for the callers and genes which need to be run"""
+    units = {}
+    for gene in genes:
+        for caller_class in callers:
+            parent = units.get((caller_dependencies.get(caller_class), gene))
+            if not parent and caller_class.is_complete(capture_name, gene):
+                continue
+            cnv_caller = caller_class(capture_name, gene, start_time)
+            run_settings_path = cnv_caller.get_run_settings_path()
+            if not parent and not cnv_caller.settings_changed(run_settings_path):
+                continue
+            unknown_bams = None if parent else cnv_caller.get_added_unknowns(run_settings_path)
+            if unknown_bams is None:
+                unknown_bams = cnv_caller.settings["unknown_bams"]
+            units[(caller_class, gene)] = planner.Unit(
+                cnv_caller.run_type, gene, len(unknown_bams), parents=[parent] if parent else []
+            )
+    history = planner.get_history(DbSession.factory(), f"{utils.get_cnv_patissier_dir()}/successful-run-settings")
+    print(planner.report(list(units.values()), history, max_jobs))
+
+
+def build_scheduler(capture_name, genes, start_time):
+    """
+    Returns scheduler with a job for every caller and gene which hasn't completed,
+    splitting the cpu and memory between max_jobs
+    """
+    max_jobs = int(cnv_pat_settings.get("max_jobs", 1))
+    max_cpu, max_mem = int(cnv_pat_settings["max_cpu"]), int(cnv_pat_settings["max_mem"])
+    job_cpu, job_mem = max(max_cpu // max_jobs, 1), max(max_mem // max_jobs, 1)
+
+    job_scheduler = scheduler.Scheduler(max_cpu, max_mem)
+    for gene in genes:
+        gene_jobs = {}
+        for caller_class in callers:
+            parent_class = caller_dependencies.get(caller_class)
+            # checked before building the caller, which reads the sample sheet and settings files.
+            # a case is never skipped here if its cohort is run, as the cohort may change the normal panel
+            if parent_class not in gene_jobs and caller_class.is_complete(capture_name, gene):
+                continue
+            parents = [gene_jobs[parent_class]] if parent_class in gene_jobs else []
+            gene_jobs[caller_class] = job_scheduler.add_job(
+                f"{caller_class.__name__} {gene}",
+                lambda caller_class=caller_class, gene=gene: run_caller(
+                    caller_class, capture_name, gene, start_time, job_cpu, job_mem
+                ),
+                cpu=job_cpu,
+                mem=job_mem,
+                parents=parents,
+            )
+    return job_scheduler
+
+
+def positive_int(value):
+    if not value.isdigit() or int(value) < 1:
+        raise ArgumentTypeError(f"must be a whole number of at least 1, not '{value}'")
+    return int(value)
 
 
 if __name__ == "__main__":
     parser = ArgumentParser(description="Ochrestrating your CNV-caller bakeoff")
     parser.add_argument("capture_name", help="After following the setup in the README.md, please give the capture name")
+    parser.add_argument(
+        "--capture-wide",
+        action="store_true",
+        help="Run each caller once on the samples from all sample sheets, then split the calls by gene",
+    )
+    parser.add_argument(
+        "--migrate-db",
+        action="store_true",
+        help="Upgrade the capture's existing database to the current schema and exit",
+    )
+    parser.add_argument(
+        "--plan",
+        nargs="?",
+        const=max(int(cnv_pat_settings.get("max_jobs", 1)), 1),
+        type=positive_int,
+        metavar="JOBS",
+        help="Estimate how long the callers which need to be run will take with JOBS (default max_jobs) at once, "
+        "using the durations of previous runs, and exit without running anything",
+    )
     args = parser.parse_args()
 
+    if args.migrate_db:
+        migrate.migrate(get_db_path(args.capture_name))
+        sys.exit(0)
+
     start_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%m-%S")
 
     capture_name = args.capture_name
     init_db(capture_name)
-    cnv_pat_dir = utils.get_cnv_patissier_dir()
-    sample_sheet_path = pathlib.Path(cnv_pat_dir, "input", capture_name, "sample-sheets")
 
-    genes = [path.stem for path in list(sample_sheet_path.glob("*.txt"))]
+    genes = utils.get_capture_genes(capture_name)
     assert genes, "No genes found in path!"
 
-    for gene in sorted(genes):
-        # cnv_caller = cnv_kit.CNVKit(capture_name, gene, start_time)
-        # cnv_caller.main()
-        cnv_caller = codex2.CODEX2(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = copywriter.Copywriter(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = decon.DECoN(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = excavator2.Excavator2(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = exome_depth.ExomeDepthCohort(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = exome_depth.ExomeDepthCase(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = gatk.GATKCohort(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = gatk.GATKCase(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = panelcn_mops.panelcnMOPS(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = savvy_cnv.SavvyCNV(capture_name, gene, start_time)
-        cnv_caller.main()
-        cnv_caller = xhmm.XHMM(capture_name, gene, start_time)
-        cnv_caller.main()
+    if args.capture_wide:
+        utils.SampleUtils.merge_sample_sheets(
+            [utils.get_sample_sheet_path(capture_name, gene) for gene in genes],
+            utils.get_sample_sheet_path(capture_name, utils.CAPTURE_WIDE),
+        )
+        genes = [utils.CAPTURE_WIDE]
+
+    if args.plan is not None:
+        plan_run(capture_name, genes, start_time, args.plan)
+        sys.exit(0)
+
+    preflight_images(capture_name)
+    try:
+        unsuccessful_jobs = build_scheduler(capture_name, genes, start_time).run()
+    finally:
+        containers.container_pool.close()
+    if unsuccessful_jobs:
+        print("The following jobs did not complete:\n {}".format("\n ".join(f"{job}" for job in unsuccessful_jobs)))
+        sys.exit(1)
 
     print("Congrats, you're all done")
@@ -2,6 +2,15 @@ cnv_pat_settings = {
     "genome_fasta_path": "/var/reference_sequences/hg19/genome.fa",
     "max_cpu": "30",
     "max_mem": "50",
+    "max_jobs": 1,  # number of callers run at the same time, max_cpu and max_mem are split between them
+    "executor": "local",  # "local" docker, "batch" to submit each command with sbatch or "mock" to run nothing
+    "step_cache": True,  # reuse outputs of gene-independent steps (e.g. read counting) from output/step-cache
+    "resume_steps": True,  # skip steps which completed in a previous failed run of a caller with the same settings
+    "incremental_runs": True,  # only run case callers for unknown samples added to a sample sheet since their last run
+    "warm_containers": False,  # run commands in one long-lived container per docker image with docker exec
+    "docker_api": False,  # start containers through /var/run/docker.sock instead of the docker command line
+    "max_containers": 8,  # containers running at the same time, reduced automatically if the docker daemon is slow
+    "lease_timeout": 600,  # seconds without a heartbeat before another worker can take over a caller and gene
     "http_proxy": None, # None or following pattern "http://192.168.1.1:8080/"
     "genome_build_name": "hg19",
     "chromosome_prefix": "chr",  # "" or "chr"
@@ -2,20 +2,26 @@
 Base class for running of a CNV tool - each tool inherits from this class
 """
 
+import concurrent.futures
+import contextlib
+import copy
 import csv
 import datetime
+import hashlib
+import inspect
 import json
 import os
 import pathlib
 import subprocess
 import sys
-import time
+import threading
 
 from sqlalchemy import sql
 import toml
 from loguru import logger
 
-from scripts import utils, models
+from scripts import checkpoints, containers, executors, intervals, leases, models, records, utils, vcf
+from scripts.step_cache import StepCache
 from settings import cnv_pat_settings
 from scripts.db_session import DbSession
 
@@ -31,6 +37,12 @@ logger.add(
 docker_level = logger.level("DOCKER", no=15, color="<yellow>")
 logger.add(f"{cnv_pat_dir}/logs/cnv-patissier.log")
 logger.add(f"{cnv_pat_dir}/logs/error.log", level="ERROR", mode="w")
+# callers can be run concurrently, only allow one of them to write to the database at a time
+db_lock = threading.Lock()
+# BAM headers are validated by every caller for every gene, so only read them again if the BAM changes
+bam_header_cache = utils.BamHeaderCache(f"{utils.get_local_cache_dir()}/bam-header-cache.sqlite")
+# callers and genes which have completed, checked before any caller is built
+completion_manifest = utils.CompletionManifest(f"{utils.get_local_cache_dir()}/completion-manifest.sqlite")
 
 
 class BaseCNVTool:
@@ -39,6 +51,15 @@ class BaseCNVTool:
 
     .main method will cause the subclass to run fully
     """
+
+    # overwritten by each caller, all images are pulled before any caller is run
+    docker_image = None
+    helper_images = ["frolvlad/alpine-python3"]
+    # case callers which process each unknown sample independently, so only added unknowns need to be run
+    incremental_unknowns = False
+    # run type of the cohort caller whose normal panel a case caller uses
+    normal_panel_run_type = None
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.session = DbSession.factory()
         self.start_time = start_time
@@ -46,6 +67,12 @@ class BaseCNVTool:
         # to be overwritten, any extra fields will be added to a json representation in the database just in case
         self.extra_db_fields = []
         self.gene = gene
+        # set when the workflow is run, steps are skipped if they completed in a previous run with the same settings
+        self.step_journal = None
+        # set while main is running, the job is stopped if the lease is lost
+        self.lease = None
+        # unknown bams to run when only these have been added or changed since the last run, None to run all
+        self.added_unknowns = None
         self.script_dirs = [f"{cnv_pat_dir}/{folder}" for folder in ["scripts", "cnv-caller-resources"]]
 
         if "PYTEST_CURRENT_TEST" in os.environ.keys():
@@ -56,7 +83,7 @@ class BaseCNVTool:
             self.max_mem = cnv_pat_settings["max_mem"]
 
             # Get paths for different variables
-            self.sample_sheet = f"{cnv_pat_dir}/input/{capture}/sample-sheets/{gene}.txt"
+            self.sample_sheet = utils.get_sample_sheet_path(capture, gene)
             self.output_base, self.docker_output_base = self.base_output_dirs()
 
             # Get ids and paths for samples split by those as reference (normal) and to be tested (unknown)
@@ -91,8 +118,43 @@ class BaseCNVTool:
                 "sample_sheet_md5sum": self.get_md5sum(self.sample_sheet)[0],
                 "capture_path": f"/mnt/input/{capture}/bed/{capture}.bed",
                 "unknown_bams": unknown_docker_bams,
+                # used to find unknowns with a changed bam, not compared to the previous run's settings
+                "unknown_samples": dict(zip(unknown_sample_ids, unknown_docker_bams)),
             }
 
+    @classmethod
+    def required_images(cls):
+        """Returns every docker image the caller uses"""
+        return [cls.docker_image, *cls.helper_images]
+
+    @classmethod
+    def get_completion_fingerprint(cls, capture, gene):
+        """
+        Returns fingerprint of what the caller's settings are built from, without reading the sample sheet:
+        the size and modification time of the sample sheet and caller code, the successful run settings of the
+        normal panel for case callers, and the local settings used
+        """
+        input_paths = [utils.get_sample_sheet_path(capture, gene), inspect.getsourcefile(cls), __file__]
+        input_stats = [(os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in input_paths]
+        if cls.normal_panel_run_type:
+            # rewritten when the cohort is rerun, so the case isn't skipped with an old normal panel
+            normal_path = f"{cnv_pat_dir}/successful-run-settings/{capture}/{cls.normal_panel_run_type}/{gene}.toml"
+            try:
+                input_stats.append((os.stat(normal_path).st_size, os.stat(normal_path).st_mtime_ns))
+            except FileNotFoundError:
+                input_stats.append(None)
+        local_settings = [
+            cnv_pat_settings[key] for key in ["genome_fasta_path", "genome_build_name", "chromosome_prefix"]
+        ]
+        fingerprint_data = json.dumps([cls.__name__, capture, gene, input_stats, local_settings])
+        return hashlib.sha256(fingerprint_data.encode()).hexdigest()
+
+    @classmethod
+    def is_complete(cls, capture, gene):
+        """Returns True if the caller has completed for the gene and nothing it depends on has changed since"""
+        fingerprint = cls.get_completion_fingerprint(capture, gene)
+        return completion_manifest.is_complete(capture, cls.__name__, gene, fingerprint)
+
     def base_output_dirs(self):
         """Returns base directory for output: (system_base, docker_base)"""
         output_base = f"{cnv_pat_dir}/output/{self.capture}/{self.start_time}/{self.run_type}/{self.gene}"
@@ -102,80 +164,88 @@ class BaseCNVTool:
 
     def check_chrom_prefix(self, bed_file):
         """Raises exception if chromosome prefix doesn't match chromsome in bed file"""
-        chromosome_names = [x for x in range(1, 23)] + ["X", "Y", "M", "mt"]
-        chromosomes = [f"{self.settings['chromosome_prefix']}{chromsome}\t" for chromsome in chromosome_names]
-        with open(bed_file, "r") as handle:
-            for line_number, line in enumerate(handle, start=1):
-                if not any([line.startswith(chrom) for chrom in chromosomes]):
-                    raise Exception(
-                        "BED file contains line which has an invalid chromosome:\n"
-                        f"Line number: {line_number}\n"
-                        "Line: '{}'\n".format(line.replace("\t", "<tab>").rstrip())
-                        + "Expected format: '{}'\n".format(chromosomes[0].replace("\t", "<tab>start<tab>end<tab>gene"))
-                        + "Please update 'chromosome_prefix' in local settings file, or alter the BED file."
-                    )
+        invalid_line = intervals.CaptureIndex.get(bed_file).invalid_line(self.settings["chromosome_prefix"])
+        if invalid_line:
+            line_number, line = invalid_line
+            raise Exception(
+                "BED file contains line which has an invalid chromosome:\n"
+                f"Line number: {line_number}\n"
+                "Line: '{}'\n".format(line.replace("\t", "<tab>").rstrip())
+                + "Expected format: '{}1<tab>start<tab>end<tab>gene'\n".format(self.settings["chromosome_prefix"])
+                + "Please update 'chromosome_prefix' in local settings file, or alter the BED file."
+            )
 
     def delete_unused_runs(self):
         """
         Delete runs using docker so that the rooy created (ugh docker for GATK forces you to be root)
-        directories are deleted
+        directories are deleted, except for the current run's directory
         """
         logger.info(f"Removing any old or unsuccessful runs for {self.capture}, {self.run_type}, {self.gene}")
-        subprocess.run(
-            [
-                "docker",
-                "run",
-                "--rm",
-                "-v",
-                f"{cnv_pat_dir}/output/:/mnt/output/:rw",
-                "-v",
-                f"{cnv_pat_dir}/cnv-caller-resources/:/mnt/cnv-caller-resources/:ro",
+        mounts = {
+            "/mnt/output/": (f"{cnv_pat_dir}/output/", "rw"),
+            "/mnt/cnv-caller-resources/": (f"{cnv_pat_dir}/cnv-caller-resources/", "ro"),
+        }
+        try:
+            executors.executor.run(
                 "frolvlad/alpine-python3",
-                "python3.6",
-                "/mnt/cnv-caller-resources/alpine-python/remove_directories.py",
-                self.capture,
-                self.run_type,
-                self.gene,
-            ]
-        )
+                [
+                    "python3.6",
+                    "/mnt/cnv-caller-resources/alpine-python/remove_directories.py",
+                    self.capture,
+                    self.run_type,
+                    self.gene,
+                    "--keep",
+                    self.start_time,
+                ],
+                mounts,
+                resources=containers.ResourceProfile(cpu=1, mem=1),
+            )
+        except subprocess.CalledProcessError as e:
+            logger.warning(f"Removing old runs failed: {e}")
+
+    def docker_mounts(self, docker_genome="/mnt/ref_genome/"):
+        """Returns dictionary of docker path: (host path, mode) for the volumes mounted into each container"""
+        ref_genome_dir = os.path.dirname(cnv_pat_settings["genome_fasta_path"])
+        return {
+            docker_genome: (f"{ref_genome_dir}/", "ro"),
+            "/mnt/input/": (f"{cnv_pat_dir}/input", "ro"),
+            "/mnt/bam-input/": (self.bam_mount, "ro"),
+            "/mnt/cnv-caller-resources/": (f"{cnv_pat_dir}/cnv-caller-resources/", "ro"),
+            "/mnt/output/": (f"{cnv_pat_dir}/output/", "rw"),
+            "/mnt/test_files/": (f"{cnv_pat_dir}/tests/test_files/", "rw"),
+        }
 
     def filter_capture(self):
-        capture_path = f"{cnv_pat_dir}/{self.settings['capture_path'][5:]}"
-        gene_bed = []
-        with open(capture_path, "r") as capture:
-            for line in capture:
-                name = line.split()[3]
-                if name == self.gene:
-                    gene_bed.append(line)
-        return gene_bed
-
-    def filter_cnvs(self, cnvs, gene_bed):
+        return self.get_capture_index().gene_bed(self.gene)
+
+    def filter_cnvs(self, cnvs, gene_bed=None):
+        """
+        Returns CalledCNVRecords for the CNVs which are within or span a region of the gene,
+        keeping the extra_db_fields. Uses the gene's targets in the capture unless BED lines are given
+        """
+        if gene_bed is None:
+            gene_index = self.get_capture_index().gene_index(self.gene)
+        else:
+            gene_index = intervals.IntervalIndex.from_bed_lines(gene_bed)
         filtered_cnvs = []
         for cnv in cnvs:
-            for line in gene_bed:
-                chrom, start, end, *_ = line.split()
-                start, end = int(start), int(end)
-                cnv_start, cnv_end = int(cnv["start"]), int(cnv["end"])
-                if cnv["chrom"] == chrom:
-                    within_region = (start <= cnv_start <= end) or (start <= cnv_end <= end)
-                    spanning_region = (cnv_start <= start) and (cnv_end >= end)
-                    if within_region or spanning_region:
-                        cnv["json_data"] = {field: cnv.pop(field) for field in self.extra_db_fields}
-                        filtered_cnvs.append(cnv)
-                        break
+            record = records.CalledCNVRecord.from_call(cnv, self.extra_db_fields)
+            if gene_index.overlaps(record.chrom, record.start, record.end):
+                filtered_cnvs.append(record)
         return filtered_cnvs
 
+    def demultiplex_output_file(self, file_path, sample_ids):
+        """
+        Returns dictionary of sample_id: CNVs for the samples from an output file.
+        By default the file is parsed once for each sample, callers which write all samples to one file
+        override this to group the rows by sample in a single pass
+        """
+        return {sample_id: self.parse_output_file(file_path, sample_id) for sample_id in sample_ids}
+
     def get_bam_header(self, sample_id):
+        """Returns the header of the sample's BAM, raising an exception if the SM tag doesn't match the sample_id"""
         docker_bam = self.sample_to_bam[sample_id]
-        samtools = self.run_docker_subprocess(
-            ["samtools", "view", "-H", docker_bam], docker_image="stefpiatek/samtools:1.9", stdout=subprocess.PIPE
-        )
-        header = str(samtools.stdout, "utf-8")
-
-        for line in header.split("\n"):
-            for field_value in line.split():
-                if field_value.startswith("SM:"):
-                    sample_name = field_value.strip("SM:")
+        header, sample_name = bam_header_cache.get_header(self.get_host_path(docker_bam))
         if not sample_name:
             raise Exception(f"No SM tag found in file {docker_bam}")
         assert (
@@ -184,6 +254,17 @@ class BaseCNVTool:
 
         return header
 
+    def get_capture_index(self):
+        """Returns the parsed capture BED, shared with all other callers"""
+        return intervals.CaptureIndex.get(self.settings["capture_path"].replace("/mnt", cnv_pat_dir, 1))
+
+    def get_host_path(self, docker_path):
+        """Returns the path on the host for a path within docker, unchanged if it isn't in a mounted volume"""
+        for mount_path, (host_path, _) in self.docker_mounts().items():
+            if docker_path.startswith(mount_path):
+                return f"{host_path.rstrip('/')}/{docker_path[len(mount_path):]}"
+        return docker_path
+
     def get_md5sum(self, file_path):
         md5sum_proc = subprocess.run(["md5sum", file_path], check=True, stdout=subprocess.PIPE)
         md5sum, path = str(md5sum_proc.stdout, "utf-8").split()
@@ -208,55 +289,23 @@ class BaseCNVTool:
         duration = normal_config["end_datetime"] - normal_config["start_datetime"]
         return duration
 
-    def parse_output_file(file_path, sample_id=None):
-        """Dummy method to be overwritten by each CNV-caller class
-        This will parse the output data into a common format, with the extra_db_fields still in
+    def get_run_duration(self):
+        duration = self.settings["end_datetime"] - self.settings["start_datetime"]
+        if self.run_type.endswith("case"):
+            duration += self.get_normal_panel_duration()
+        return duration
+
+    def parse_output_file(self, file_path, sample_id):
         """
-        pass
+        Parses the output data for a sample into a common format, with the extra_db_fields still in.
+        Each CNV-caller class overwrites this or demultiplex_output_file, which by default parses each sample
+        """
+        return self.demultiplex_output_file(file_path, [sample_id])[sample_id]
 
     @staticmethod
     def parse_vcf(input_vcf, sample_id):
         """Parses VCF v4.0 - v4.2, if positive cnv, returns dicts of information within a list"""
-        cnvs = []
-        for line in input_vcf:
-            if line.startswith("#") or not line:
-                continue
-            fields = ["chrom", "pos", "id", "ref", "alt", "qual", "filter", "info", "format", "data"]
-            row = {field: data for (field, data) in zip(fields, line.split())}
-            format_data = {key: value for (key, value) in zip(row.pop("format").split(":"), row.pop("data").split(":"))}
-            info_data = {}
-            for info_field in row.pop("info").split(";"):
-                try:
-                    field, value = info_field.split("=")
-                except ValueError as e:
-                    if info_field and info_field != "IMPRECISE":
-                        raise e
-                    elif info_field:
-                        field, value = ["calling", "IMPRECISE"]
-                    else:
-                        # empty value so just skip field
-                        continue
-                info_data[field] = value
-            if "CN" in format_data.keys():  # copy number is copy info
-                copy_info = int(format_data["CN"])
-            else:  # genotype gives copy number info as a string
-                copy_info = format_data["GT"]
-            if copy_info != "0" and copy_info != 2:
-                row["start"] = row.pop("pos")
-                end = info_data["END"]
-                if isinstance(copy_info, int):
-                    if copy_info < 2:
-                        row["alt"] = "DEL"
-                    elif copy_info > 2:
-                        row["alt"] = "DUP"
-                else:
-                    if copy_info == "1":
-                        row["alt"] = "DEL"
-                    elif copy_info == "2":
-                        row["alt"] = "DUP"
-                cnv = {**row, "end": end, "sample_id": sample_id, "format_data": format_data, "info_data": info_data}
-                cnvs.append(cnv)
-        return cnvs
+        return list(vcf.iter_cnvs(input_vcf, sample_id))
 
     def prerun_steps(self, sample_sheet_path, ref_genome_path):
         """
@@ -267,11 +316,11 @@ class BaseCNVTool:
           - file paths are unique (check_files)
           - sample_ids are unique (check_unique)
           - reference genome files exist
+          - BAM index exists and is newer than the BAM
           - SN tag in bam header (from get_bam_header)
           - sample id matches the sample ID given (from get_bam_header)
 
         """
-        bam_headers = {}
         sample_paths = []
         sample_ids = []
         with open(sample_sheet_path, "r") as handle:
@@ -290,82 +339,248 @@ class BaseCNVTool:
                 ref_genome.exists()
             ), f"{ref_genome} does not exist\nPlease edit your settings file or create the file"
 
-        for sample_id, sample_path in zip(sample_ids, sample_paths):
-            bam_header = self.get_bam_header(sample_id)
-            bam_headers[sample_id] = bam_header
-            #  to avoid `docker: Error response from daemon: container did not start before the specified timeout.`
-            time.sleep(5)
+        def check_bam(sample_id, sample_path):
+            utils.BamUtils.check_index(sample_path)
+            return self.get_bam_header(sample_id)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            headers = executor.map(check_bam, sample_ids, sample_paths)
+            bam_headers = dict(zip(sample_ids, headers))
 
         return bam_headers
 
-    def process_caller_output(self, sample_path, sample_id=None):
+    def process_caller_output(self, output_path, sample_ids):
+        """Returns the filtered CNVs for the samples in an output file, in the order of the sample_ids"""
         try:
-            cnvs = self.parse_output_file(sample_path, sample_id)
+            sample_cnvs = self.demultiplex_output_file(output_path, sample_ids)
         except FileNotFoundError as e:
             if self.run_type == "excavator2":
                 # excavator2 sometimes doesn't produce vcf file
-                cnvs = []
+                sample_cnvs = {}
             else:
                 raise e
-        gene_bed = self.filter_capture()
-        filtered_cnvs = self.filter_cnvs(cnvs, gene_bed)
+        cnvs = [cnv for sample_id in sample_ids for cnv in sample_cnvs.get(sample_id, [])]
+        filtered_cnvs = self.filter_cnvs(cnvs)
         return filtered_cnvs
 
-    def run_docker_subprocess(self, args, stdout=None, docker_image=None, docker_genome="/mnt/ref_genome/"):
-        """Run docker subprocess as root user, mounting input and reference genome dir"""
-        ref_genome_dir = os.path.dirname(cnv_pat_settings["genome_fasta_path"])
+    def resource_profile(self):
+        """Returns default ResourceProfile for the caller's steps, the cpu and memory given to the caller's job"""
+        return containers.ResourceProfile(cpu=int(self.max_cpu), mem=int(self.max_mem))
+
+    def get_step_cache(self):
+        """Returns the step cache for the run's output directory, or None if it is turned off in the settings"""
+        if not cnv_pat_settings.get("step_cache", True):
+            return None
+        return StepCache(
+            f"{cnv_pat_dir}/output/step-cache", self.output_base, self.docker_output_base, self.get_host_path
+        )
+
+    def java_args(self):
+        """Returns java command using the caller's cpus, the heap leaves a quarter of the memory limit for the JVM"""
+        heap_mb = int(self.max_mem) * 1024 * 3 // 4
+        return ["java", f"-Xmx{heap_mb}m", f"-XX:ConcGCThreads={self.max_cpu}"]
+
+    def run_docker_subprocess(
+        self,
+        args,
+        stdout=None,
+        docker_image=None,
+        docker_genome="/mnt/ref_genome/",
+        cache_outputs=None,
+        resources=None,
+    ):
+        """
+        Run docker subprocess as root user, mounting input and reference genome dir
+
+        If cache_outputs (docker paths within the output directory) are given, the step only depends on its inputs
+        so the outputs are reused from a previous run of the step with the same inputs, image and arguments
+
+        The container is limited to the resources (a containers.ResourceProfile) given, or the caller's cpu and memory
+
+        Steps which completed in a previous run with the same settings are skipped, see checkpoints.py
+        """
         if not docker_image:
             docker_image = self.settings["docker_image"]
-        docker_command = [
-            "docker",
-            "run",
-            "--rm",
-            "-v",
-            f"{ref_genome_dir}/:{docker_genome}:ro",
-            "-v",
-            f"{cnv_pat_dir}/input:/mnt/input/:ro",
-            "-v",
-            f"{self.bam_mount}:/mnt/bam-input/:ro",
-            "-v",
-            f"{cnv_pat_dir}/cnv-caller-resources/:/mnt/cnv-caller-resources/:ro",
-            "-v",
-            f"{cnv_pat_dir}/output/:/mnt/output/:rw",
-            "-v",
-            f"{cnv_pat_dir}/tests/test_files/:/mnt/test_files/:rw",
-            docker_image,
-            *args,
-        ]
-        logger.log("DOCKER", " ".join(docker_command))
-        process = subprocess.run(docker_command, check=True, stdout=stdout)
+        if not resources:
+            resources = self.resource_profile()
+        self.check_lease()
+
+        # steps writing to stdout are always run, the caller has already opened their output file
+        journal = self.step_journal if stdout is None else None
+        if journal and journal.is_complete(docker_image, args):
+            logger.info(f"Skipped {args[0]}, completed in a previous run")
+            return subprocess.CompletedProcess(args, 0)
+
+        # an empty ExitStack does nothing, contextlib.nullcontext isn't available in python 3.6
+        with journal.record(docker_image, args) if journal else contextlib.ExitStack():
+            step_cache = self.get_step_cache() if cache_outputs and stdout is None else None
+            if step_cache:
+                cache_key = step_cache.get_key(docker_image, args, cache_outputs)
+                if step_cache.restore(cache_key, cache_outputs):
+                    logger.info(f"Reused cached output for {args[0]}: {cache_key}")
+                    return subprocess.CompletedProcess(args, 0)
+
+            process = executors.executor.run(
+                docker_image, args, self.docker_mounts(docker_genome), stdout=stdout, resources=resources
+            )
+            # raised before the step is recorded, as another worker may be writing to the same output
+            self.check_lease()
+
+            if step_cache:
+                step_cache.store(cache_key, cache_outputs)
         return process
 
-    def run_required(self, previous_run_settings_path):
-        """Returns True if workflow hasn't been run before or settings have changed since then"""
+    def stream_docker_subprocess(
+        self, args, docker_image=None, docker_genome="/mnt/ref_genome/", resources=None, env=None
+    ):
+        """
+        Context manager running docker subprocess with the same mounts and limits as run_docker_subprocess, giving the
+        decoded stdout lines while the container runs so that large outputs don't need to be written to disk first
+        """
+        if not docker_image:
+            docker_image = self.settings["docker_image"]
+        self.check_lease()
+        return executors.executor.stream(
+            docker_image,
+            args,
+            self.docker_mounts(docker_genome),
+            env=env,
+            resources=resources or self.resource_profile(),
+        )
+
+    def get_run_settings_path(self):
+        return f"{cnv_pat_dir}/successful-run-settings/{self.capture}/{self.run_type}/{self.gene}.toml"
+
+    def settings_changed(self, previous_run_settings_path):
+        """Returns True if workflow hasn't been run before or settings have changed since then, without any cleanup"""
         if not os.path.exists(previous_run_settings_path):
-            logger.info(f"Run required for {self.capture} {self.run_type} {self.gene}")
-            self.delete_unused_runs()
             return True
         with open(previous_run_settings_path) as handle:
             previous_settings = toml.load(handle)
-            for field in ["start_time", "start_datetime", "end_datetime"]:
-                previous_settings.pop(field)
-            current_settings = dict(self.settings)
-            current_settings.pop("start_time")
-            if current_settings != previous_settings:
-                logger.info(f"Run required for {self.capture} {self.run_type} {self.gene}")
-                self.delete_unused_runs()
+        for field in ["start_time", "start_datetime", "end_datetime", "unknown_samples"]:
+            previous_settings.pop(field, None)
+        current_settings = dict(self.settings)
+        current_settings.pop("start_time")
+        current_settings.pop("unknown_samples", None)
+        return current_settings != previous_settings
+
+    def get_added_unknowns(self, previous_run_settings_path):
+        """
+        Returns the unknown bams which have been added or changed since the previous successful run, if only the
+        unknowns have changed for a caller with incremental_unknowns. Otherwise returns None, all samples must be run
+        """
+        if not self.incremental_unknowns or self.gene == utils.CAPTURE_WIDE:
+            return None
+        if not cnv_pat_settings.get("incremental_runs", True) or not os.path.exists(previous_run_settings_path):
+            return None
+        with open(previous_run_settings_path) as handle:
+            previous_settings = toml.load(handle)
+        unknown_fields = ["start_time", "start_datetime", "end_datetime", "sample_sheet_md5sum", "unknown_bams"]
+        for field in (set(previous_settings) | set(self.settings)) - set(unknown_fields + ["unknown_samples"]):
+            if previous_settings.get(field) != self.settings.get(field):
+                return None
+
+        # unknowns which have been removed would keep their calls in the database, so everything is run again
+        previous_samples = previous_settings.get("unknown_samples", {})
+        current_samples = self.settings.get("unknown_samples", {})
+        for previous_bam in set(previous_settings["unknown_bams"]) - set(self.settings["unknown_bams"]):
+            bam_sample = [sample_id for sample_id, bam in previous_samples.items() if bam == previous_bam]
+            if not bam_sample or bam_sample[0] not in current_samples:
+                return None
+        return [bam for bam in self.settings["unknown_bams"] if bam not in previous_settings["unknown_bams"]]
+
+    def run_required(self, previous_run_settings_path):
+        """Returns True if workflow hasn't been run before or settings have changed since then"""
+        if self.settings_changed(previous_run_settings_path):
+            self.added_unknowns = self.get_added_unknowns(previous_run_settings_path)
+            if self.added_unknowns is not None:
+                # previous runs are kept, they have the output for the other unknowns
+                logger.info(
+                    f"Run required for {len(self.added_unknowns)} added or changed unknowns "
+                    f"in {self.capture} {self.run_type} {self.gene}"
+                )
+                self.resume_previous_run()
                 return True
+            logger.info(f"Run required for {self.capture} {self.run_type} {self.gene}")
+            self.resume_previous_run()
+            self.delete_unused_runs()
+            return True
         logger.info(f"Re-run not required for {self.capture} {self.run_type} {self.gene}")
 
+    def resume_previous_run(self):
+        """Switches to the output directory of an incomplete run with the same settings, so its steps can be skipped"""
+        if not cnv_pat_settings.get("resume_steps", True):
+            return
+        start_time = checkpoints.find_resumable_start_time(
+            f"{cnv_pat_dir}/output/{self.capture}", self.run_type, self.gene, self.settings
+        )
+        if start_time and start_time != self.start_time:
+            logger.info(f"Resuming {self.capture} {self.run_type} {self.gene} from the run started at {start_time}")
+            self.start_time = start_time
+            self.settings["start_time"] = start_time
+            self.output_base, self.docker_output_base = self.base_output_dirs()
+
     def run_workflow(self):
         """Placeholder for individual tool running"""
         pass
 
+    def run_added_unknowns(self):
+        """Runs the workflow for the added unknowns only, returning their output paths and sample ids"""
+        if not self.added_unknowns:
+            return [], []
+        all_unknown_bams = self.settings["unknown_bams"]
+        self.settings["unknown_bams"] = self.added_unknowns
+        try:
+            return self.run_workflow()
+        finally:
+            self.settings["unknown_bams"] = all_unknown_bams
+
+    def get_incremental_duration(self):
+        """Returns the duration of the previous run for the gene, with the time taken to run the added unknowns"""
+        previous_duration = (
+            self.session.query(models.Run.duration)
+            .join(models.Gene, models.Run.gene_id == models.Gene.id)
+            .join(models.Caller, models.Run.caller_id == models.Caller.id)
+            .filter(
+                models.Gene.name == self.gene,
+                models.Gene.capture == self.capture,
+                models.Gene.genome_build == self.settings["genome_build_name"],
+                models.Caller.name == self.run_type,
+            )
+            .scalar()
+        )
+        if previous_duration is None:
+            return self.get_run_duration()
+        return previous_duration + (self.settings["end_datetime"] - self.settings["start_datetime"])
+
+    def delete_called_cnvs(self, sample_names):
+        """Deletes the caller's calls for the samples in the gene"""
+        if not sample_names:
+            return
+        caller_id = self.session.query(models.Caller.id).filter_by(name=self.run_type).scalar()
+        gene_id = (
+            self.session.query(models.Gene.id)
+            .filter_by(name=self.gene, capture=self.capture, genome_build=self.settings["genome_build_name"])
+            .scalar()
+        )
+        sample_ids = self.session.query(models.Sample.id).filter(
+            models.Sample.gene_id == gene_id, models.Sample.name.in_(sample_names)
+        )
+        self.session.query(models.CalledCNV).filter(
+            models.CalledCNV.caller_id == caller_id, models.CalledCNV.sample_id.in_(sample_ids.subquery())
+        ).delete(synchronize_session=False)
+        self.session.commit()
+
     def upload_all_called_cnvs(self, output_paths, sample_ids):
-        for path_and_id in zip(output_paths, sample_ids):
-            cnv_calls = self.process_caller_output(path_and_id[0], path_and_id[1])
-            for cnv in cnv_calls:
-                self.upload_called_cnv(cnv)
+        # shared output files are only parsed once for all of their samples
+        output_to_samples = {}
+        for output_path, sample_id in zip(output_paths, sample_ids):
+            output_to_samples.setdefault(output_path, []).append(sample_id)
+
+        cnv_calls = []
+        for output_path, output_sample_ids in output_to_samples.items():
+            cnv_calls.extend(self.process_caller_output(output_path, output_sample_ids))
+        self.upload_called_cnvs(cnv_calls)
 
     def upload_all_known_data(self):
         self.upload_cnv_caller()
@@ -387,9 +602,9 @@ class BaseCNVTool:
         Queries.get_or_create(models.Caller, self.session, defaults=dict(name=self.run_type))
 
     def upload_gene(self):
-        bed = self.filter_capture()
+        chrom, start, end = self.get_capture_index().gene_bounds(self.gene)
         defaults = {"name": self.gene, "genome_build": self.settings["genome_build_name"], "capture": self.capture}
-        upload_data = {"chrom": bed[0].split()[0], "start": int(bed[0].split()[1]), "end": int(bed[-1].split()[2])}
+        upload_data = {"chrom": chrom, "start": start, "end": end}
 
         Queries.update_or_create(models.Gene, self.session, defaults=defaults, **upload_data)
         self.session.commit()
@@ -414,9 +629,17 @@ class BaseCNVTool:
 
             sample_sheet = csv.DictReader(handle, dialect="excel", delimiter="\t")
             for line in sample_sheet:
+                # skipped as when merging sample sheets, so capture-wide runs don't have a header for them
+                if line["result_type"] not in utils.SampleUtils.result_types:
+                    continue
                 bam_header = self.bam_headers[line["sample_id"]]
-                sample_defaults = {"name": line["sample_id"], "path": line["sample_path"], "gene_id": gene_instance.id}
-                sample_data = {"bam_header": bam_header, "result_type": line["result_type"]}
+                # samples are unique by name and gene, so a moved or re-sequenced BAM updates the existing sample
+                sample_defaults = {"name": line["sample_id"], "gene_id": gene_instance.id}
+                sample_data = {
+                    "path": line["sample_path"],
+                    "bam_header": bam_header,
+                    "result_type": line["result_type"],
+                }
 
                 Queries.update_or_create(models.Sample, self.session, defaults=sample_defaults, **sample_data)
 
@@ -434,27 +657,137 @@ class BaseCNVTool:
         return known_cnv_table
 
     def upload_called_cnv(self, cnv_call):
-        json_data = json.dumps(cnv_call.pop("json_data"))
-        sample_name = cnv_call.pop("sample_id")
-        cnv_call.update({"genome_build": self.settings["genome_build_name"]})
-
-        Queries.get_or_create(models.CNV, self.session, defaults=cnv_call)
-        caller_instance = self.session.query(models.Caller).filter_by(name=self.run_type).first()
-        cnv_instance = self.session.query(models.CNV).filter_by(**cnv_call).first()
-        gene_instance = (
-            self.session.query(models.Gene)
-            .filter_by(name=self.gene, capture=self.capture, genome_build=self.settings["genome_build_name"])
-            .first()
+        """Uploads a single call, given as a dictionary with the extra fields in json_data"""
+        record = records.CalledCNVRecord(
+            cnv_call["chrom"],
+            cnv_call["start"],
+            cnv_call["end"],
+            cnv_call["alt"],
+            cnv_call["sample_id"],
+            extra=cnv_call["json_data"],
         )
-        sample_instance = (
-            self.session.query(models.Sample).filter_by(name=sample_name, gene_id=gene_instance.id).first()
+        self.upload_called_cnvs([record])
+
+    def get_cnv_ids(self, genome_build, cnv_keys):
+        """
+        Returns dictionary of (chrom, start, end, alt): id for the CNVs which are in the database,
+        only querying the chromosomes and start positions of the CNVs
+        """
+        starts_by_chrom = {}
+        for chrom, start, _, _ in cnv_keys:
+            starts_by_chrom.setdefault(chrom, set()).add(start)
+        cnv_ids = {}
+        for chrom, starts in starts_by_chrom.items():
+            starts = sorted(starts)
+            # chunked to stay below sqlite's limit on the number of query parameters
+            for index in range(0, len(starts), 500):
+                query = self.session.query(
+                    models.CNV.id, models.CNV.chrom, models.CNV.start, models.CNV.end, models.CNV.alt
+                ).filter(
+                    models.CNV.genome_build == genome_build,
+                    models.CNV.chrom == chrom,
+                    models.CNV.start.in_(starts[index : index + 500]),
+                )
+                for (cnv_id, *cnv_key) in query:
+                    if tuple(cnv_key) in cnv_keys:
+                        cnv_ids[tuple(cnv_key)] = cnv_id
+        return cnv_ids
+
+    def upload_called_cnvs(self, cnv_calls):
+        """
+        Uploads called CNVs in a single transaction, looking up the caller, gene and sample ids once.
+        CNVs are inserted if they don't exist, and existing calls for the same caller, CNV and sample are updated.
+        Only the CNVs and calls for the uploaded samples are queried, uploads are serialised by the database lease
+        """
+        if not cnv_calls:
+            return
+        genome_build = self.settings["genome_build_name"]
+        caller_id = self.session.query(models.Caller.id).filter_by(name=self.run_type).scalar()
+        gene_id = (
+            self.session.query(models.Gene.id)
+            .filter_by(name=self.gene, capture=self.capture, genome_build=genome_build)
+            .scalar()
         )
+        sample_ids = dict(self.session.query(models.Sample.name, models.Sample.id).filter_by(gene_id=gene_id))
+
+        cnv_keys = {cnv_call.cnv_key for cnv_call in cnv_calls}
+        cnv_ids = self.get_cnv_ids(genome_build, cnv_keys)
+        new_cnvs = cnv_keys - set(cnv_ids)
+        if new_cnvs:
+            self.session.execute(
+                sql.text(
+                    'INSERT INTO cnvs (genome_build, chrom, start, "end", alt) '
+                    "VALUES (:genome_build, :chrom, :start, :end, :alt)"
+                ),
+                [
+                    dict(genome_build=genome_build, chrom=chrom, start=start, end=end, alt=alt)
+                    for (chrom, start, end, alt) in sorted(new_cnvs)
+                ],
+            )
+            cnv_ids.update(self.get_cnv_ids(genome_build, new_cnvs))
+
+        # the last call for the same CNV and sample is kept
+        called_cnvs = {
+            (cnv_ids[cnv_call.cnv_key], sample_ids[cnv_call.sample_id]): cnv_call.json_data() for cnv_call in cnv_calls
+        }
+        called_sample_ids = sorted({sample_id for (_, sample_id) in called_cnvs})
+        existing_calls = {}
+        for index in range(0, len(called_sample_ids), 500):
+            query = self.session.query(
+                models.CalledCNV.id, models.CalledCNV.cnv_id, models.CalledCNV.sample_id
+            ).filter(
+                models.CalledCNV.caller_id == caller_id,
+                models.CalledCNV.sample_id.in_(called_sample_ids[index : index + 500]),
+            )
+            existing_calls.update({(cnv_id, sample_id): called_id for (called_id, cnv_id, sample_id) in query})
 
-        called_cnv_defaults = dict(caller_id=caller_instance.id, cnv_id=cnv_instance.id, sample_id=sample_instance.id)
-        Queries.update_or_create(models.CalledCNV, self.session, defaults=called_cnv_defaults, json_data=json_data)
+        updated_calls = [
+            dict(id=existing_calls[call_key], json_data=json_data)
+            for call_key, json_data in called_cnvs.items()
+            if call_key in existing_calls
+        ]
+        new_calls = [
+            dict(caller_id=caller_id, cnv_id=cnv_id, sample_id=sample_id, json_data=json_data)
+            for (cnv_id, sample_id), json_data in called_cnvs.items()
+            if (cnv_id, sample_id) not in existing_calls
+        ]
+        if updated_calls:
+            self.session.execute(
+                sql.text("UPDATE called_cnvs SET json_data = :json_data WHERE id = :id"), updated_calls
+            )
+        if new_calls:
+            self.session.execute(
+                sql.text(
+                    "INSERT INTO called_cnvs (caller_id, cnv_id, sample_id, json_data) "
+                    "VALUES (:caller_id, :cnv_id, :sample_id, :json_data)"
+                ),
+                new_calls,
+            )
         self.session.commit()
 
-    def upload_run_data(self, sample_names):
+    def upload_capture_wide_data(self, output_paths, sample_ids):
+        """
+        Uploads the output from a capture-wide run separately for each gene, using the unknown samples
+        from each gene's sample sheet. The run duration is split evenly between the genes
+        """
+        sample_to_output = dict(zip(sample_ids, output_paths))
+        genes = utils.get_capture_genes(self.capture)
+        duration = self.get_run_duration() / len(genes)
+        for gene in genes:
+            gene_caller = copy.copy(self)
+            gene_caller.gene = gene
+            gene_caller.sample_sheet = utils.get_sample_sheet_path(self.capture, gene)
+            _, gene_unknowns = utils.SampleUtils.select_samples(gene_caller.sample_sheet, normal_panel=False)
+            gene_sample_ids = [sample_id for sample_id in gene_unknowns if sample_id in sample_to_output]
+
+            logger.info(f"Uploading capture-wide {self.run_type} calls for {gene}")
+            gene_caller.upload_all_known_data()
+            gene_caller.upload_all_called_cnvs(
+                [sample_to_output[sample_id] for sample_id in gene_sample_ids], gene_sample_ids
+            )
+            gene_caller.upload_run_data(gene_sample_ids, duration=duration)
+
+    def upload_run_data(self, sample_names, duration=None):
         gene_instance = (
             self.session.query(models.Gene)
             .filter_by(name=self.gene, capture=self.capture, genome_build=self.settings["genome_build_name"])
@@ -468,9 +801,8 @@ class BaseCNVTool:
             )
             sample_ids.append(sample_instance.id)
 
-        duration = self.settings["end_datetime"] - self.settings["start_datetime"]
-        if self.run_type.endswith("case"):
-            duration += self.get_normal_panel_duration()
+        if duration is None:
+            duration = self.get_run_duration()
 
         run_defaults = {"gene_id": gene_instance.id, "caller_id": caller_instance.id}
         upload_data = {"samples": json.dumps(sample_ids), "duration": duration}
@@ -479,7 +811,6 @@ class BaseCNVTool:
         self.upload_all_md5sums(run_instance.id)
         self.session.commit()
 
-    @logger.catch(reraise=True)
     def main(self):
         """
         Looks for a run settings file, if it doesn't exist or has different values to the current settings - run
@@ -487,11 +818,43 @@ class BaseCNVTool:
 
         Run the workflows and then write to database, finally writting settings toml file so you know that
         everything has actually completed properly.
+
+        The capture, caller and gene is leased so that workers sharing the output directory don't run it at the
+        same time, leases.LeaseHeld is raised if another worker is running it. If the lease is lost while running,
+        leases.LeaseLost is raised at the next docker step or before the results are recorded.
 =        """
-        previous_run_settings_path = (
-            f"{cnv_pat_dir}/successful-run-settings/{self.capture}/{self.run_type}/{self.gene}.toml"
-        )
-        if self.run_required(previous_run_settings_path):
+        lease = leases.Lease(f"{cnv_pat_dir}/output/leases/{self.capture}/{self.run_type}/{self.gene}.lease")
+        if not lease.acquire():
+            # expected when workers share the output directory, so not logged as an error
+            message = f"{self.capture} {self.run_type} {self.gene} is being run by another worker"
+            logger.info(f"{message}, deferring")
+            raise leases.LeaseHeld(message)
+        self.run_leased(lease)
+
+    @logger.catch(reraise=True)
+    def run_leased(self, lease):
+        """Runs the caller and records its completion while holding the lease, releasing it afterwards"""
+        self.lease = lease
+        try:
+            # taken before running so that inputs which change during the run aren't recorded as complete
+            fingerprint = self.get_completion_fingerprint(self.capture, self.gene)
+            self.run_if_required()
+            self.check_lease()
+            completion_manifest.record(
+                self.capture, type(self).__name__, self.gene, fingerprint, self.get_run_settings_path()
+            )
+        finally:
+            self.lease = None
+            lease.release()
+
+    def check_lease(self):
+        if self.lease:
+            self.lease.check()
+
+    def run_if_required(self):
+        if self.run_required(self.get_run_settings_path()):
+            if cnv_pat_settings.get("resume_steps", True):
+                self.step_journal = checkpoints.StepJournal(self.output_base, self.get_host_path, self.settings)
             # cohort is specifically for the normal panel running
             if self.run_type.endswith("cohort"):
                 self.bam_headers = self.prerun_steps(self.sample_sheet, cnv_pat_settings["genome_fasta_path"])
@@ -502,11 +865,29 @@ class BaseCNVTool:
                 # if output will be the final run for this caller, then record the results into the database
                 self.bam_headers = self.prerun_steps(self.sample_sheet, cnv_pat_settings["genome_fasta_path"])
                 self.settings["start_datetime"] = datetime.datetime.now()
-                output_paths, sample_ids = self.run_workflow()
+                if self.added_unknowns is None:
+                    output_paths, sample_ids = self.run_workflow()
+                else:
+                    output_paths, sample_ids = self.run_added_unknowns()
                 self.settings["end_datetime"] = datetime.datetime.now()
-                self.upload_all_known_data()
-                self.upload_all_called_cnvs(output_paths, sample_ids)
-                self.upload_run_data(sample_ids)
+                self.check_lease()
+                database_lease = leases.Lease(f"{cnv_pat_dir}/output/leases/{self.capture}/database.lease")
+                with db_lock, database_lease:
+                    if self.gene == utils.CAPTURE_WIDE:
+                        self.upload_capture_wide_data(output_paths, sample_ids)
+                    else:
+                        self.upload_all_known_data()
+                        if self.added_unknowns is not None:
+                            # unknowns with a changed BAM would otherwise keep the calls from their previous BAM
+                            self.delete_called_cnvs(sample_ids)
+                        self.upload_all_called_cnvs(output_paths, sample_ids)
+                        if self.added_unknowns is None:
+                            self.upload_run_data(sample_ids)
+                        else:
+                            # calls for the other unknowns are already in the database from previous runs
+                            all_sample_ids = [self.bam_to_sample[bam] for bam in self.settings["unknown_bams"]]
+                            self.upload_run_data(all_sample_ids, duration=self.get_incremental_duration())
+            self.check_lease()
             self.write_settings_toml()
 
     def write_settings_toml(self):
@@ -18,16 +18,19 @@ Have not implemented "chr" prefixed chromosomes at this point as not used
 import subprocess
 import os
 
-from . import utils, base_classes
+from . import containers, utils, base_classes
 from settings import cnv_pat_settings
 
 
 class Canvas(base_classes.BaseCNVTool):
+    docker_image = "stefpiatek/canvas:1.11.0"
+    helper_images = [*base_classes.BaseCNVTool.helper_images, "lethalfang/tabix:1.7"]
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.run_type = "canvas"
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
 
-        self.settings = {**self.settings, "docker_image": "stefpiatek/canvas:1.11.0"}
+        self.settings = {**self.settings, "docker_image": self.docker_image}
 
     def run_canvas_command(self, args):
         """Creates dir for output and runs a GATK command in docker"""
@@ -54,6 +57,7 @@ class Canvas(base_classes.BaseCNVTool):
         docker_parsed_bed_out = f"{self.docker_output_base}/sorted-capture.bed".replace(f"/{self.gene}/", "/")
         capture_vcf_out = f"{self.output_base}/pop_af.vcf".replace(f"/{self.gene}/", "/")
         docker_capture_vcf_out = f"{self.docker_output_base}/pop_af.vcf".replace(f"/{self.gene}/", "/")
+        capture_index = self.get_capture_index()
 
         with open(nextera_manifest_out, "w") as output_handle:
             header = [
@@ -67,22 +71,16 @@ class Canvas(base_classes.BaseCNVTool):
             ]
             for line in header:
                 output_handle.write(f"{line}\n")
-            with open(f"{base_classes.cnv_pat_dir}/{self.settings['capture_path'][5:]}", "r") as input_handle:
-                for line in input_handle:
-                    chrom, start, end, name = line.split()
-                    output_handle.write("\t".join([name, chrom, start, end, "0", f"0\n"]))
+            for chrom, start, end, name in capture_index.targets:
+                output_handle.write("\t".join([name, chrom, f"{start}", f"{end}", "0", f"0\n"]))
 
+        # remove 'chr' from bed file chromosome column
+        unprefixed_bed = "".join(
+            f"{chrom}\t{start}\t{end}\t{name}\n" for chrom, start, end, name in capture_index.unprefixed_targets("chr")
+        )
         with open(parsed_bed_out, "w") as handle:
             subprocess.run(
-                [
-                    # remove 'chr' from bed file chromosome column
-                    f"sed -e 's/chr//' {base_classes.cnv_pat_dir}/{self.settings['capture_path'][5:]} | "
-                    # sort bed file
-                    "sort -k1,1n -k2,2n"
-                ],
-                check=True,
-                shell=True,
-                stdout=handle,
+                ["sort", "-k1,1n", "-k2,2n"], input=unprefixed_bed, universal_newlines=True, check=True, stdout=handle
             )
 
         with open(ploidy_bed_out, "w") as ploidy_bed:
@@ -95,18 +93,11 @@ class Canvas(base_classes.BaseCNVTool):
 
             with open(capture_vcf_out, "w") as handle:
                 base_classes.logger.info("Started downloading population frequencies for canvas")
-                proxy = []
+                proxy = {}
                 if cnv_pat_settings["http_proxy"]:
-                    proxy += ["-e", f"http_proxy={cnv_pat_settings['http_proxy']}"]
-                subprocess.run(
+                    proxy["http_proxy"] = cnv_pat_settings["http_proxy"]
+                with self.stream_docker_subprocess(
                     [
-                        "docker",
-                        "run",
-                        "--rm",
-                        "-v",
-                        f"{base_classes.cnv_pat_dir}/output/:/mnt/output/:rw",
-                        *proxy,
-                        "lethalfang/tabix:1.7",
                         "tabix",
                         "http://storage.googleapis.com/gnomad-public/release/2.1/vcf/"
                         "genomes/gnomad.genomes.r2.1.sites.vcf.bgz",
@@ -114,12 +105,13 @@ class Canvas(base_classes.BaseCNVTool):
                         "-R",
                         docker_parsed_bed_out,
                     ],
-                    check=True,
-                    stdout=handle,
-                )
-
-            # add chr back on to chromosomes: if line doesn't start with #, add chr to start of line
-            subprocess.run(["sed", "-i", "'/^#/! s/^/chr/'", capture_vcf_out])
+                    docker_image="lethalfang/tabix:1.7",
+                    resources=containers.ResourceProfile(cpu=1, mem=1),
+                    env=proxy,
+                ) as vcf_lines:
+                    for line in vcf_lines:
+                        # add chr back on to chromosomes for all lines apart from the header
+                        handle.write(line if line.startswith("#") else f"chr{line}")
 
             # subprocess.run(["gzip", capture_vcf_out], check=True)
             base_classes.logger.info("Finished downloading population frequencies for canvas")
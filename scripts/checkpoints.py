@@ -0,0 +1,145 @@
+"""
+Journal of the completed docker steps of a caller's run, so that a failed run resumes from its first incomplete step
+
+Each step is recorded in checkpoints.json in the run's output directory, with a hash of its input files and the size and
+modification time of the files it wrote. When a caller is run again with the same settings as a run which didn't
+complete, it reuses that run's output directory. Steps whose inputs are unchanged and whose outputs are still present
+are skipped, and once a step is rerun the files it writes change, so every later step which reads them is rerun too.
+"""
+
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import pathlib
+
+from scripts.step_cache import MAX_HASHED_SIZE
+
+JOURNAL_NAME = "checkpoints.json"
+
+
+def comparable_settings(settings):
+    """Returns the run settings without their times, as they would be read back from the journal"""
+    run_settings = {
+        key: value for key, value in settings.items() if key not in ["start_time", "start_datetime", "end_datetime"]
+    }
+    return json.loads(json.dumps(run_settings, default=str))
+
+
+def file_fingerprint(path):
+    """Returns hash of file contents, or size and mtime for large files (e.g. BAMs and the reference genome)"""
+    stat = path.stat()
+    if stat.st_size > MAX_HASHED_SIZE:
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def find_resumable_start_time(capture_output_dir, run_type, gene, settings):
+    """Returns the start time of the latest run with a journal for the same settings, or None"""
+    resumable = []
+    for journal_path in glob.glob(f"{capture_output_dir}/*/{run_type}/{gene}/{JOURNAL_NAME}"):
+        with open(journal_path) as handle:
+            journal = json.load(handle)
+        if journal["settings"] == comparable_settings(settings):
+            resumable.append((os.path.getmtime(journal_path), pathlib.Path(journal_path).parents[2].name))
+    if resumable:
+        return max(resumable)[1]
+    return None
+
+
+class StepJournal:
+    def __init__(self, output_base, get_host_path, settings):
+        """
+        :param output_base: output directory for the run on the host
+        :param get_host_path: function which converts a docker path to the path on the host
+        :param settings: run settings, steps from a journal with different settings are ignored
+        """
+        self.output_base = output_base
+        self.get_host_path = get_host_path
+        self.path = f"{output_base}/{JOURNAL_NAME}"
+        self.settings = comparable_settings(settings)
+        self.steps = {}
+        if os.path.exists(self.path):
+            with open(self.path) as handle:
+                journal = json.load(handle)
+            if journal["settings"] == self.settings:
+                self.steps = journal["steps"]
+
+    @staticmethod
+    def get_step_id(docker_image, args):
+        return hashlib.sha256(json.dumps([docker_image, *[f"{arg}" for arg in args]]).encode()).hexdigest()
+
+    def snapshot(self):
+        """Returns dictionary of relative path: [size, mtime_ns] for the files in the output directory"""
+        files = {}
+        for directory, _, file_names in os.walk(self.output_base):
+            for file_name in file_names:
+                if file_name.startswith(JOURNAL_NAME):
+                    continue
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # broken link to a removed file
+                    continue
+                files[os.path.relpath(path, self.output_base)] = [stat.st_size, stat.st_mtime_ns]
+        return files
+
+    def path_fingerprint(self, docker_path, outputs):
+        """Returns fingerprint of a file or directory without the step's own outputs, None if it doesn't exist"""
+        host_path = pathlib.Path(self.get_host_path(docker_path))
+        if host_path.is_file():
+            files = [host_path]
+        elif host_path.is_dir():
+            files = sorted(path for path in host_path.rglob("*") if path.is_file())
+        else:
+            return None
+        return [
+            (f"{path.relative_to(host_path)}", file_fingerprint(path))
+            for path in files
+            if not path.name.startswith(JOURNAL_NAME) and os.path.relpath(path, self.output_base) not in outputs
+        ]
+
+    def get_inputs_hash(self, args, outputs):
+        inputs = hashlib.sha256()
+        for arg in args:
+            # handle flags with values such as --bam=/mnt/bam-input/sample.bam
+            value = f"{arg}".split("=", 1)[-1]
+            if value.startswith("/"):
+                inputs.update(json.dumps([value, self.path_fingerprint(value, outputs)]).encode())
+        return inputs.hexdigest()
+
+    def is_complete(self, docker_image, args):
+        """Returns True if the step has been run with the same inputs and its outputs haven't changed since"""
+        step = self.steps.get(self.get_step_id(docker_image, args))
+        if not step:
+            return False
+        for relative_path, output_stat in step["outputs"].items():
+            try:
+                stat = os.stat(f"{self.output_base}/{relative_path}")
+            except FileNotFoundError:
+                return False
+            if [stat.st_size, stat.st_mtime_ns] != output_stat:
+                return False
+        return step["inputs"] == self.get_inputs_hash(args, step["outputs"])
+
+    @contextlib.contextmanager
+    def record(self, docker_image, args):
+        """Context manager around running a step, records it as complete with the files it wrote if it succeeds"""
+        before = self.snapshot()
+        yield
+        outputs = {path: stat for path, stat in self.snapshot().items() if before.get(path) != stat}
+        self.steps[self.get_step_id(docker_image, args)] = {
+            "inputs": self.get_inputs_hash(args, outputs),
+            "outputs": outputs,
+        }
+        self.write()
+
+    def write(self):
+        # written to a temporary file first so that a crash never leaves a partial journal
+        os.makedirs(self.output_base, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as handle:
+            json.dump({"settings": self.settings, "steps": self.steps}, handle, indent=2)
+        os.replace(temp_path, self.path)
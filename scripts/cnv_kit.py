@@ -12,11 +12,13 @@ from . import base_classes
 
 
 class CNVKit(base_classes.BaseCNVTool):
+    docker_image = "etal/cnvkit:0.9.5"
+
     def __init__(self, capture, gene, start_time):
         self.run_type = "cnvkit"
         super().__init__(capture, gene, start_time, normal_panel=True)
         self.extra_db_fields = ["probes", "cn", "log2", "depth", "weight"]
-        self.settings = {**self.settings, "docker_image": "etal/cnvkit:0.9.5"}
+        self.settings = {**self.settings, "docker_image": self.docker_image}
 
     def parse_output_file(self, file_path, sample_id):
         cnvs = []
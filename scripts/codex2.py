@@ -12,18 +12,20 @@ from scripts import base_classes
 
 
 class CODEX2(base_classes.BaseCNVTool):
+    docker_image = "stefpiatek/codex2:26e796c"
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.run_type = "codex2"
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
         self.extra_db_fields = ["gene", "length_kb", "length_exon", "raw_cov", "norm_cov", "copy_no", "lratio", "mBIC"]
-        self.settings = {**self.settings, "docker_image": "stefpiatek/codex2:26e796c"}
+        self.settings = {**self.settings, "docker_image": self.docker_image}
 
-    def parse_output_file(self, file_path, sample_id):
-        cnvs = []
+    def demultiplex_output_file(self, file_path, sample_ids):
+        sample_cnvs = {sample_id: [] for sample_id in sample_ids}
         with open(file_path, "r") as handle:
             output = csv.DictReader(handle, delimiter="\t")
             for row in output:
-                if row["sample_name"] == sample_id:
+                if row["sample_name"] in sample_cnvs:
                     cnv = dict(row)
                     cnv["chrom"] = f"{self.settings['chromosome_prefix']}{cnv.pop('chr').replace('chr', '')}"
                     cnv["start"] = cnv.pop("st_bp")
@@ -31,8 +33,8 @@ class CODEX2(base_classes.BaseCNVTool):
                     cnv["sample_id"] = cnv.pop("sample_name")
                     cnv["alt"] = cnv.pop("cnv").upper()
 
-                    cnvs.append(cnv)
-        return cnvs
+                    sample_cnvs[cnv["sample_id"]].append(cnv)
+        return sample_cnvs
 
     def run_command(self, args):
         """Runs CODEX2 script in docker"""
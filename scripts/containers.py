@@ -0,0 +1,758 @@
+"""
+Runs commands in docker containers
+
+By default each command gets a new container with `docker run --rm`. With the "warm_containers" setting, long-lived
+containers are started for each docker image, set of volumes and amount of cpu and memory, and commands are run within
+them using `docker exec`, one command at a time in each container. This avoids creating and removing a container for
+every step. The pool is torn down at the end of the run.
+
+With the "docker_api" setting, containers are run by talking to the docker daemon's unix socket directly instead of
+starting the docker CLI for each one. Each thread keeps one persistent connection to the daemon.
+
+All containers are started through a LaunchGovernor, which limits how many run at once and retries launches which
+fail because the daemon didn't start the container in time. The time the daemon takes to start each container is
+fed back to it, with the docker API from the create and start requests, and with the CLI from when `docker run`
+writes the container id to its cidfile.
+
+stream_container gives the decoded stdout lines of a command while it is still running, so output can be processed
+as it is written instead of being held in memory until the container exits.
+
+Containers are given CPU and memory limits from the ResourceProfile of each step, with the CPUs pinned to a set of
+cores from the shared CpuPool so that containers running at the same time don't compete for the same cores.
+
+preflight_images is run before any caller starts, pulling missing images concurrently so that a missing image fails
+the run straight away instead of part way through it.
+"""
+
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import http.client
+import io
+import itertools
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from loguru import logger
+from settings import cnv_pat_settings
+
+
+# cpu cores and memory in GB for a step
+ResourceProfile = collections.namedtuple("ResourceProfile", ["cpu", "mem"])
+# cpu ids allocated from the CpuPool and memory in GB for a container
+Limits = collections.namedtuple("Limits", ["cpus", "mem"])
+
+
+def get_cpuset(cpus):
+    return ",".join(f"{cpu}" for cpu in cpus)
+
+
+def limit_args(limits):
+    """Returns docker run arguments for the container's Limits, or no arguments if there are no limits"""
+    if limits is None:
+        return []
+    return ["--cpus", f"{len(limits.cpus)}", "--cpuset-cpus", get_cpuset(limits.cpus), "--memory", f"{limits.mem}g"]
+
+
+def get_host_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def volume_args(mounts):
+    """Returns docker volume arguments for a dictionary of docker path: (host path, mode)"""
+    volumes = []
+    for docker_path, (host_path, mode) in mounts.items():
+        volumes.extend(["-v", f"{host_path}:{docker_path}:{mode}"])
+    return volumes
+
+
+class CpuPool:
+    """Gives out disjoint sets of CPU ids, waiting until enough are free"""
+
+    def __init__(self, cpus):
+        self.free_cpus = sorted(cpus)
+        self.size = len(self.free_cpus)
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def allocate(self, resources):
+        """
+        Context manager giving the Limits for a ResourceProfile, the CPUs are returned to the pool on exit.
+        Requests for more CPUs than the host has are given all of them, and None gives no limits
+        """
+        if resources is None:
+            yield None
+            return
+        count = max(1, min(int(resources.cpu), self.size))
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.free_cpus) >= count)
+            cpus, self.free_cpus = self.free_cpus[:count], self.free_cpus[count:]
+        try:
+            yield Limits(tuple(cpus), int(resources.mem))
+        finally:
+            with self.condition:
+                self.free_cpus = sorted(self.free_cpus + cpus)
+                self.condition.notify_all()
+
+
+class WarmContainer:
+    def __init__(self, container_id, entrypoint, cpus):
+        self.container_id = container_id
+        self.entrypoint = entrypoint
+        self.cpus = cpus
+
+
+class ContainerPool:
+    def __init__(self):
+        # key: containers which aren't running a command
+        self.idle = {}
+        self.containers = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_entrypoint(docker_image):
+        """Returns the image's entrypoint, which docker exec doesn't use so has to be added to each command"""
+        process = subprocess.run(
+            ["docker", "image", "inspect", "--format", "{{json .Config.Entrypoint}}", docker_image],
+            check=True,
+            stdout=subprocess.PIPE,
+        )
+        return json.loads(process.stdout) or []
+
+    def start_container(self, docker_image, mounts, limits):
+        entrypoint = self.get_entrypoint(docker_image)
+        docker_command = [
+            "docker",
+            "run",
+            "--detach",
+            "--rm",
+            *volume_args(mounts),
+            *limit_args(limits),
+            "--entrypoint",
+            "sleep",
+            docker_image,
+            "infinity",
+        ]
+        logger.log("DOCKER", " ".join(docker_command))
+        process = run_cli(docker_command, stdout=subprocess.PIPE)
+        return WarmContainer(process.stdout.decode().strip(), entrypoint, limits.cpus if limits else None)
+
+    @contextlib.contextmanager
+    def checkout(self, docker_image, mounts, limits=None):
+        """
+        Context manager giving (container id, entrypoint) of a container for the image, mounts and amount of cpu and
+        memory which isn't running another command, starting one if they are all in use.
+        Commands run with docker exec share the limits of the container, so it is moved to the allocated cpus
+        """
+        key = (docker_image, tuple(sorted(mounts.items())), (len(limits.cpus), limits.mem) if limits else None)
+        with self.lock:
+            idle = self.idle.get(key)
+            container = idle.pop() if idle else None
+        if container is None:
+            container = self.start_container(docker_image, mounts, limits)
+            with self.lock:
+                self.containers.append(container)
+        elif limits and container.cpus != limits.cpus:
+            run_cli(["docker", "update", "--cpuset-cpus", get_cpuset(limits.cpus), container.container_id])
+            container.cpus = limits.cpus
+        try:
+            yield container.container_id, container.entrypoint
+        finally:
+            with self.lock:
+                self.idle.setdefault(key, []).append(container)
+
+    def run(self, docker_image, mounts, args, stdout=None, env=None, limits=None):
+        with self.checkout(docker_image, mounts, limits) as (container_id, entrypoint):
+            env_args = [arg for key, value in (env or {}).items() for arg in ["--env", f"{key}={value}"]]
+            docker_command = ["docker", "exec", *env_args, container_id, *entrypoint, *args]
+            logger.log("DOCKER", " ".join(docker_command))
+            # stderr is kept so that the launch governor can recognise daemon timeouts
+            return run_cli(docker_command, stdout=stdout)
+
+    def close(self):
+        """Removes all containers in the pool"""
+        with self.lock:
+            for container in self.containers:
+                subprocess.run(["docker", "rm", "--force", container.container_id], stdout=subprocess.DEVNULL)
+            self.containers = []
+            self.idle = {}
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix socket"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DockerClient:
+    """
+    Minimal client for the docker Engine API, only supporting what is needed to run a container to completion
+    https://docs.docker.com/engine/api/
+    """
+
+    def __init__(self, socket_path="/var/run/docker.sock"):
+        self.socket_path = socket_path
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        # http connections can't be shared between threads, so each thread keeps its own open connection
+        if not hasattr(self.local, "connection"):
+            self.local.connection = UnixHTTPConnection(self.socket_path)
+        return self.local.connection
+
+    def send(self, method, path, params=None, body=None):
+        """Sends request, returning the response which must be read fully before the next request"""
+        if params:
+            path = f"{path}?{urllib.parse.urlencode(params)}"
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        data = json.dumps(body).encode() if body is not None else None
+        try:
+            self.connection.request(method, path, body=data, headers=headers)
+            response = self.connection.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            # persistent connection was closed by the daemon, reconnect once
+            self.connection.close()
+            self.connection.request(method, path, body=data, headers=headers)
+            response = self.connection.getresponse()
+        if response.status >= 400:
+            message = response.read().decode(errors="replace")
+            try:
+                message = json.loads(message)["message"]
+            except (ValueError, KeyError):
+                pass
+            raise Exception(f"Docker API error {response.status} for {method} {path}: {message}")
+        return response
+
+    def request(self, method, path, params=None, body=None):
+        """Sends request, returning the decoded JSON response or None if there is no content"""
+        data = self.send(method, path, params=params, body=body).read()
+        return json.loads(data) if data else None
+
+    def create_container(self, docker_image, args, mounts, env=None, limits=None):
+        volumes = [f"{host_path}:{docker_path}:{mode}" for docker_path, (host_path, mode) in mounts.items()]
+        host_config = {"Binds": volumes}
+        if limits is not None:
+            host_config["NanoCpus"] = len(limits.cpus) * 10 ** 9
+            host_config["CpusetCpus"] = ",".join(f"{cpu}" for cpu in limits.cpus)
+            host_config["Memory"] = limits.mem * 1024 ** 3
+        body = {
+            "Image": docker_image,
+            "Cmd": list(args),
+            "Env": [f"{key}={value}" for key, value in (env or {}).items()],
+            "HostConfig": host_config,
+        }
+        return self.request("POST", "/containers/create", body=body)["Id"]
+
+    def start_container(self, container_id):
+        self.request("POST", f"/containers/{container_id}/start")
+
+    def iter_logs(self, container_id):
+        """Yields (stream, data) while the container is running, stream is 1 for stdout and 2 for stderr"""
+        response = self.send(
+            "GET", f"/containers/{container_id}/logs", params={"follow": 1, "stdout": 1, "stderr": 1}
+        )
+        while True:
+            # without a tty, output is multiplexed into frames with an 8 byte header of stream type and size
+            header = response.read(8)
+            if len(header) < 8:
+                break
+            stream, size = struct.unpack(">BxxxL", header)
+            yield stream, response.read(size)
+
+    def wait_container(self, container_id):
+        """Waits for the container to exit, returning its exit code"""
+        return self.request("POST", f"/containers/{container_id}/wait")["StatusCode"]
+
+    def remove_container(self, container_id):
+        self.request("DELETE", f"/containers/{container_id}", params={"force": 1})
+
+    def open_stream(self, docker_image, args, mounts, env=None, limits=None, record_start=None):
+        return ApiStream(self, docker_image, args, mounts, env=env, limits=limits, record_start=record_start)
+
+    @staticmethod
+    def write_output(handle, data):
+        # write to the file descriptor, as subprocess does, so that text and binary handles both work
+        handle.flush()
+        os.write(handle.fileno(), data)
+
+    def run(self, docker_image, args, mounts, stdout=None, env=None, limits=None, record_start=None):
+        """
+        Equivalent of `docker run --rm` with check=True, stdout can be None, a file handle or subprocess.PIPE
+
+        :param record_start: function called with the seconds taken for the daemon to create and start the container
+        """
+        started_at = time.monotonic()
+        container_id = self.create_container(docker_image, args, mounts, env=env, limits=limits)
+        captured = []
+        try:
+            self.start_container(container_id)
+            if record_start:
+                record_start(time.monotonic() - started_at)
+            for stream, data in self.iter_logs(container_id):
+                if stream == 2:
+                    self.write_output(sys.stderr, data)
+                elif stdout == subprocess.PIPE:
+                    captured.append(data)
+                else:
+                    self.write_output(stdout or sys.stdout, data)
+            exit_code = self.wait_container(container_id)
+        finally:
+            self.remove_container(container_id)
+        if exit_code != 0:
+            raise subprocess.CalledProcessError(exit_code, args)
+        return subprocess.CompletedProcess(args, 0, stdout=b"".join(captured) if stdout == subprocess.PIPE else None)
+
+
+def pass_through_stderr(pipe, stderr_tail):
+    """Writes lines from the pipe to stderr as they arrive, keeping the last lines in stderr_tail"""
+    for line in iter(pipe.readline, b""):
+        sys.stderr.write(line.decode(errors="replace"))
+        stderr_tail.append(line)
+
+
+class StartWatcher:
+    """
+    Calls record_start with the seconds a `docker run` CLI command took for the daemon to create its container,
+    which is when the CLI writes the container id to its cidfile
+    """
+
+    def __init__(self, docker_command, record_start):
+        self.record_start = record_start
+        self.temp_dir = tempfile.mkdtemp(prefix="cnv-patissier-cid.")
+        self.cid_path = f"{self.temp_dir}/container-id"
+        # options for docker run go straight after the subcommand
+        self.docker_command = [*docker_command[:2], "--cidfile", self.cid_path, *docker_command[2:]]
+        self.started_at = time.monotonic()
+        self.thread = None
+
+    def watch(self, process):
+        self.thread = threading.Thread(target=self.wait_for_container, args=(process,), daemon=True)
+        self.thread.start()
+
+    def container_created(self):
+        return os.path.exists(self.cid_path) and os.path.getsize(self.cid_path) > 0
+
+    def wait_for_container(self, process):
+        while process.poll() is None:
+            if self.container_created():
+                break
+            time.sleep(0.05)
+        if self.container_created():
+            self.record_start(time.monotonic() - self.started_at)
+
+    def close(self):
+        if self.thread:
+            self.thread.join()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+def run_cli(docker_command, stdout=None, record_start=None):
+    """
+    Equivalent of subprocess.run with check=True, stderr is passed through as it is written
+    and the end of it is kept in the CalledProcessError so that daemon errors can be recognised
+
+    :param record_start: for `docker run` commands, function called with the seconds taken to create the container
+    """
+    start_watcher = StartWatcher(docker_command, record_start) if record_start else None
+    if start_watcher:
+        docker_command = start_watcher.docker_command
+    stderr_tail = collections.deque(maxlen=20)
+    process = subprocess.Popen(docker_command, stdout=stdout, stderr=subprocess.PIPE)
+    if start_watcher:
+        start_watcher.watch(process)
+    stderr_thread = threading.Thread(target=pass_through_stderr, args=(process.stderr, stderr_tail))
+    stderr_thread.start()
+    captured_stdout = process.stdout.read() if stdout == subprocess.PIPE else None
+    process.wait()
+    stderr_thread.join()
+    process.stderr.close()
+    if start_watcher:
+        start_watcher.close()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode, docker_command, output=captured_stdout, stderr=b"".join(stderr_tail)
+        )
+    return subprocess.CompletedProcess(docker_command, 0, stdout=captured_stdout)
+
+
+def get_image_digest(docker_image):
+    """Returns the repository digest of a local image, its id if it was built locally, or None if it isn't present"""
+    process = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{json .}}", docker_image],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if process.returncode != 0:
+        return None
+    image_data = json.loads(process.stdout)
+    return (image_data.get("RepoDigests") or [image_data["Id"]])[0]
+
+
+def pull_image(docker_image):
+    subprocess.run(
+        ["docker", "pull", "--quiet", docker_image], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    return get_image_digest(docker_image)
+
+
+def preflight_images(docker_images, max_pulls=4):
+    """
+    Pulls any of the images which aren't present, max_pulls at a time, raising an exception listing any which couldn't
+    be pulled. Returns dictionary of image: digest
+    """
+    digests = {docker_image: get_image_digest(docker_image) for docker_image in sorted(set(docker_images))}
+    missing_images = [docker_image for docker_image, digest in digests.items() if digest is None]
+    failed_images = {}
+    if missing_images:
+        logger.info(f"Pulling {len(missing_images)} docker images: {', '.join(missing_images)}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_pulls) as executor:
+            pulls = {executor.submit(pull_image, docker_image): docker_image for docker_image in missing_images}
+            for pull in concurrent.futures.as_completed(pulls):
+                docker_image = pulls[pull]
+                try:
+                    digests[docker_image] = pull.result()
+                except subprocess.CalledProcessError as e:
+                    failed_images[docker_image] = e.stderr.decode(errors="replace").strip()
+    if failed_images:
+        raise Exception(
+            "Docker images could not be pulled:\n"
+            + "\n".join(f"{docker_image}: {error}" for docker_image, error in sorted(failed_images.items()))
+        )
+    return digests
+
+
+class CliStream:
+    """Docker CLI command whose decoded stdout lines can be read while it runs"""
+
+    def __init__(self, docker_command, record_start=None):
+        """
+        :param record_start: for `docker run` commands, function called with the seconds taken to create the container
+        """
+        self.start_watcher = StartWatcher(docker_command, record_start) if record_start else None
+        if self.start_watcher:
+            docker_command = self.start_watcher.docker_command
+        self.docker_command = docker_command
+        self.stderr_tail = collections.deque(maxlen=20)
+        self.process = subprocess.Popen(docker_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if self.start_watcher:
+            self.start_watcher.watch(self.process)
+        self.stderr_thread = threading.Thread(target=pass_through_stderr, args=(self.process.stderr, self.stderr_tail))
+        self.stderr_thread.start()
+        self.lines = io.TextIOWrapper(self.process.stdout, errors="replace")
+
+    def close(self, abort=False):
+        """
+        Waits for the command to finish, discarding any unread output, and raises CalledProcessError if it failed.
+        If abort is True the command is stopped instead
+        """
+        if abort:
+            # docker run passes the signal on to the container
+            self.process.terminate()
+        else:
+            for _ in self.lines:
+                pass
+        self.process.wait()
+        self.stderr_thread.join()
+        self.lines.close()
+        self.process.stderr.close()
+        if self.start_watcher:
+            self.start_watcher.close()
+        if not abort and self.process.returncode != 0:
+            raise subprocess.CalledProcessError(
+                self.process.returncode, self.docker_command, stderr=b"".join(self.stderr_tail)
+            )
+
+
+class LaunchGovernor:
+    """
+    Limits how many containers run at once and how quickly they are started, adapting to the docker daemon
+
+    When the daemon fails to start a container in time, the launch is retried with exponential backoff, the number of
+    containers allowed to run is halved and starts are spaced out. Each successful launch relaxes the limits again, so
+    healthy runs never wait.
+    """
+
+    daemon_timeout_error = "did not start before the specified timeout"
+
+    def __init__(self, max_running=8, retries=5, backoff=2.0, slow_start=5.0):
+        """
+        :param max_running: maximum number of containers to run at the same time
+        :param retries: number of times to retry a launch which failed because of a daemon timeout
+        :param backoff: seconds to wait before the first retry, doubling for each retry after that
+        :param slow_start: seconds for the daemon to start a container above which fewer are run at once
+        """
+        self.max_running = max_running
+        self.retries = retries
+        self.backoff = backoff
+        self.slow_start = slow_start
+        self.limit = max_running
+        self.running = 0
+        self.start_interval = 0
+        self.next_start = 0
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.running < self.limit)
+            self.running += 1
+            start_delay = max(self.next_start - time.monotonic(), 0)
+            self.next_start = max(self.next_start, time.monotonic()) + self.start_interval
+        try:
+            if start_delay:
+                time.sleep(start_delay)
+            yield
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.condition.notify_all()
+
+    def record_start(self, seconds):
+        """Reduces the number of running containers if the daemon was slow to start one"""
+        with self.condition:
+            if seconds > self.slow_start:
+                self.limit = max(self.limit - 1, 1)
+                logger.warning(f"Docker took {seconds:.1f}s to start a container, running up to {self.limit} at once")
+
+    def record_success(self):
+        with self.condition:
+            self.limit = min(self.limit + 1, self.max_running)
+            self.start_interval = self.start_interval / 2 if self.start_interval > 0.1 else 0
+            self.condition.notify_all()
+
+    def record_timeout(self):
+        with self.condition:
+            self.limit = max(self.limit // 2, 1)
+            self.start_interval = max(self.start_interval * 2, self.backoff)
+
+    def is_daemon_timeout(self, error):
+        stderr = getattr(error, "stderr", None) or b""
+        return self.daemon_timeout_error in f"{error}" or self.daemon_timeout_error.encode() in stderr
+
+    @contextlib.contextmanager
+    def stream(self, open_stream):
+        """
+        Context manager version of launch, open_stream returns a CliStream or ApiStream and the stream's lines are
+        given. Only retries if the container failed without writing any output, as output may have been used
+        """
+        for attempt in range(self.retries + 1):
+            with self.slot():
+                container_stream = open_stream()
+                try:
+                    first_line = next(container_stream.lines, None)
+                except BaseException:
+                    container_stream.close(abort=True)
+                    raise
+                if first_line is None:
+                    try:
+                        container_stream.close()
+                    except Exception as e:
+                        if attempt == self.retries or not self.is_daemon_timeout(e):
+                            raise
+                    else:
+                        self.record_success()
+                        yield iter([])
+                        return
+                else:
+                    try:
+                        yield itertools.chain([first_line], container_stream.lines)
+                    except BaseException:
+                        container_stream.close(abort=True)
+                        raise
+                    container_stream.close()
+                    self.record_success()
+                    return
+            self.record_timeout()
+            delay = self.backoff * 2 ** attempt
+            logger.warning(f"Docker daemon timed out starting a container, retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+    def launch(self, run):
+        """Calls run to launch a container, retrying if the daemon timed out starting it"""
+        for attempt in range(self.retries + 1):
+            try:
+                with self.slot():
+                    process = run()
+            except Exception as e:
+                if attempt == self.retries or not self.is_daemon_timeout(e):
+                    raise
+                self.record_timeout()
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"Docker daemon timed out starting a container, retrying in {delay:.0f}s")
+                time.sleep(delay)
+            else:
+                self.record_success()
+                return process
+
+
+class ApiStream:
+    """Container run through the docker API whose decoded stdout lines can be read while it runs"""
+
+    def __init__(self, client, docker_image, args, mounts, env=None, limits=None, record_start=None):
+        self.client = client
+        self.args = args
+        started_at = time.monotonic()
+        self.container_id = client.create_container(docker_image, args, mounts, env=env, limits=limits)
+        try:
+            client.start_container(self.container_id)
+        except Exception:
+            client.remove_container(self.container_id)
+            raise
+        if record_start:
+            record_start(time.monotonic() - started_at)
+        self.lines = self.iter_lines()
+
+    def iter_lines(self):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        partial_line = ""
+        for stream, data in self.client.iter_logs(self.container_id):
+            if stream == 2:
+                self.client.write_output(sys.stderr, data)
+                continue
+            *lines, partial_line = (partial_line + decoder.decode(data)).split("\n")
+            for line in lines:
+                yield f"{line}\n"
+        partial_line += decoder.decode(b"", final=True)
+        if partial_line:
+            yield partial_line
+
+    def close(self, abort=False):
+        """
+        Waits for the container to finish, discarding any unread output, and raises CalledProcessError if it failed.
+        If abort is True the container is stopped instead
+        """
+        exit_code = 0
+        try:
+            if abort:
+                # logs response is part read, so the connection can't be used for the next request
+                self.client.connection.close()
+            else:
+                for _ in self.lines:
+                    pass
+                exit_code = self.client.wait_container(self.container_id)
+        finally:
+            self.client.remove_container(self.container_id)
+        if exit_code != 0:
+            raise subprocess.CalledProcessError(exit_code, self.args)
+
+
+# shared by all callers in the process
+container_pool = ContainerPool()
+cpu_pool = CpuPool(get_host_cpus())
+docker_client = DockerClient()
+launch_governor = LaunchGovernor(max_running=int(cnv_pat_settings.get("max_containers", 8)))
+
+
+def run_container(docker_image, args, mounts, stdout=None, env=None, resources=None):
+    """
+    Runs args in the docker image, raising CalledProcessError if the command fails
+
+    :param mounts: dictionary of docker path: (host path, mode)
+    :param stdout: None, an open file handle or subprocess.PIPE, as for subprocess.run
+    :param env: dictionary of environment variables to set in the container
+    :param resources: ResourceProfile for the container's CPU and memory limits, no limits if None
+    """
+    with cpu_pool.allocate(resources) as limits:
+        if cnv_pat_settings.get("warm_containers", False):
+            return launch_governor.launch(
+                lambda: container_pool.run(docker_image, mounts, args, stdout=stdout, env=env, limits=limits)
+            )
+        if cnv_pat_settings.get("docker_api", False):
+            logger.log("DOCKER", f"API run {docker_image} {' '.join(args)}")
+            return launch_governor.launch(
+                lambda: docker_client.run(
+                    docker_image,
+                    args,
+                    mounts,
+                    stdout=stdout,
+                    env=env,
+                    limits=limits,
+                    record_start=launch_governor.record_start,
+                )
+            )
+
+        env_args = [arg for key, value in (env or {}).items() for arg in ["-e", f"{key}={value}"]]
+        docker_command = [
+            "docker",
+            "run",
+            "--rm",
+            *volume_args(mounts),
+            *limit_args(limits),
+            *env_args,
+            docker_image,
+            *args,
+        ]
+        logger.log("DOCKER", " ".join(docker_command))
+        return launch_governor.launch(
+            lambda: run_cli(docker_command, stdout=stdout, record_start=launch_governor.record_start)
+        )
+
+
+@contextlib.contextmanager
+def stream_container(docker_image, args, mounts, env=None, resources=None):
+    """
+    Context manager running args in the docker image, giving an iterator of decoded stdout lines while it runs.
+    Unread output is discarded when the context exits, and CalledProcessError is raised if the command failed
+
+    with stream_container(image, args, mounts) as lines:
+        for line in lines:
+            ...
+    """
+    with cpu_pool.allocate(resources) as limits, contextlib.ExitStack() as warm_container:
+        if cnv_pat_settings.get("warm_containers", False):
+            container_id, entrypoint = warm_container.enter_context(
+                container_pool.checkout(docker_image, mounts, limits)
+            )
+            env_args = [arg for key, value in (env or {}).items() for arg in ["--env", f"{key}={value}"]]
+            docker_command = ["docker", "exec", *env_args, container_id, *entrypoint, *args]
+            logger.log("DOCKER", " ".join(docker_command))
+            open_stream = functools.partial(CliStream, docker_command)
+        elif cnv_pat_settings.get("docker_api", False):
+            logger.log("DOCKER", f"API stream {docker_image} {' '.join(args)}")
+            open_stream = functools.partial(
+                docker_client.open_stream,
+                docker_image,
+                args,
+                mounts,
+                env=env,
+                limits=limits,
+                record_start=launch_governor.record_start,
+            )
+        else:
+            env_args = [arg for key, value in (env or {}).items() for arg in ["-e", f"{key}={value}"]]
+            docker_command = [
+                "docker",
+                "run",
+                "--rm",
+                *volume_args(mounts),
+                *limit_args(limits),
+                *env_args,
+                docker_image,
+                *args,
+            ]
+            logger.log("DOCKER", " ".join(docker_command))
+            open_stream = functools.partial(CliStream, docker_command, record_start=launch_governor.record_start)
+        with launch_governor.stream(open_stream) as lines:
+            yield lines
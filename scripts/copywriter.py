@@ -15,21 +15,22 @@ from . import utils, base_classes
 
 
 class Copywriter(base_classes.BaseCNVTool):
+    docker_image = "stefpiatek/copywriter:2.14.1"
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.run_type = "copywriter"
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
         self.extra_db_fields = ["num.mark", "unknown", "seg.mean", "control_id"]
-        self.settings = {**self.settings, "docker_image": "stefpiatek/copywriter:2.14.1"}
+        self.settings = {**self.settings, "docker_image": self.docker_image}
 
-    def parse_output_file(self, file_path, sample_id):
-        cnvs = []
+    def demultiplex_output_file(self, file_path, sample_ids):
+        bamfile_to_sample = {pathlib.Path(bam_path).name: sample for bam_path, sample in self.bam_to_sample.items()}
+        sample_cnvs = {sample_id: [] for sample_id in sample_ids}
         with open(file_path, "r") as handle:
             output = csv.DictReader(handle, delimiter="\t")
-            sample_to_bam = {sample: bam for (bam, sample) in self.bam_to_sample.items()}
-            bam_name = pathlib.Path(sample_to_bam[sample_id]).name
-            bamfile_to_sample = {pathlib.Path(bam_path).name: sample for bam_path, sample in self.bam_to_sample.items()}
             for row in output:
-                if row["unknown"] == bam_name:
+                sample_id = bamfile_to_sample.get(row["unknown"])
+                if sample_id in sample_cnvs:
                     cnv = dict(row)
                     cnv["chrom"] = f"{self.settings['chromosome_prefix']}{cnv['chrom']}"
                     cnv["sample_id"] = sample_id
@@ -42,8 +43,8 @@ class Copywriter(base_classes.BaseCNVTool):
                         cnv["alt"] = "DUP"
                     else:
                         continue
-                    cnvs.append(cnv)
-        return cnvs
+                    sample_cnvs[sample_id].append(cnv)
+        return sample_cnvs
 
     def run_command(self, args):
         self.run_docker_subprocess(["Rscript", f"/mnt/cnv-caller-resources/copywriter/copywriter_runner.R", *args])
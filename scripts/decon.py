@@ -12,6 +12,9 @@ class DECoN(base_classes.BaseCNVTool):
     """
     DECoN class, main in BaseCNVTool will cause self.run_workflow() to be triggered.
     """
+
+    docker_image = "stefpiatek/decon:1.0.2"
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.run_type = "decon"
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
@@ -29,33 +32,32 @@ class DECoN(base_classes.BaseCNVTool):
             "Reads.ratio",
             "Gene",
         ]
-        self.settings = {**self.settings, "docker_image": "stefpiatek/decon:1.0.2"}
+        self.settings = {**self.settings, "docker_image": self.docker_image}
 
-    def parse_output_file(self, file_path, sample_id):
-        sample_to_bam = {sample: bam for (bam, sample) in self.bam_to_sample.items()}
-        bam_name = pathlib.Path(sample_to_bam[sample_id]).name.replace(".bam", "")
+    def demultiplex_output_file(self, file_path, sample_ids):
         bamfile_to_sample = {
             pathlib.Path(bam_path).name.replace(".bam", ""): sample for bam_path, sample in self.bam_to_sample.items()
         }
-        cnvs = []
+        sample_cnvs = {sample_id: [] for sample_id in sample_ids}
         with open(file_path, "r") as handle:
             output = csv.DictReader(handle, delimiter="\t")
             for row in output:
-                if row["Sample"] == bam_name:
+                sample_id = bamfile_to_sample.get(row["Sample"])
+                if sample_id in sample_cnvs:
                     cnv = dict(row)
                     cnv["chrom"] = f"{self.settings['chromosome_prefix']}{cnv.pop('Chromosome').lstrip('chr')}"
                     cnv["start"] = cnv.pop("Start")
                     cnv["end"] = cnv.pop("End")
+                    cnv.pop("Sample")
                     cnv["sample_id"] = sample_id
-                    cnv["sample_id"] = bamfile_to_sample[cnv.pop("Sample")]
                     call = cnv.pop("CNV.type")
                     if call == "deletion":
                         cnv["alt"] = "DEL"
                     elif call == "duplication":
                         cnv["alt"] = "DUP"
 
-                    cnvs.append(cnv)
-        return cnvs
+                    sample_cnvs[sample_id].append(cnv)
+        return sample_cnvs
 
     def run_command(self, args):
         base_classes.logger.info(f"Running  {self.run_type}: {args[0]} \n output: {args[-1]}")
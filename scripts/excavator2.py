@@ -6,10 +6,13 @@ Excavator2 run with defaults https://github.com/matheuscburger/Excavator2/blob/m
 import os
 import subprocess
 
-from . import utils, base_classes
+from . import utils, base_classes, containers, vcf
 
 
 class Excavator2(base_classes.BaseCNVTool):
+    docker_image = "stefpiatek/excavator2:1.1.2"
+    helper_images = [*base_classes.BaseCNVTool.helper_images, "stefpiatek/bedtools:latest"]
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.run_type = "excavator2"
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
@@ -17,11 +20,11 @@ class Excavator2(base_classes.BaseCNVTool):
         self.settings = {
             **self.settings,
             "contig-ploidy-priors": f"/mnt/cnv-caller-resources/gatk/contig-ploidy-priors.tsv",
-            "docker_image": "stefpiatek/excavator2:1.1.2",
+            "docker_image": self.docker_image,
         }
 
     def parse_output_file(self, file_path, sample_id):
-        with open(file_path) as handle:
+        with vcf.open_vcf(file_path) as handle:
             cnvs = self.parse_vcf(handle, sample_id)
         return cnvs
 
@@ -34,14 +37,13 @@ class Excavator2(base_classes.BaseCNVTool):
         extra_chroms_bed = f"{self.output_base}/capture_with_mock.bed"
         docker_extra_chroms_bed = f"{self.output_base}/capture_with_mock.bed"
         chromosomes = [f"{self.settings['chromosome_prefix']}{chrom}" for chrom in list(range(1, 23)) + ["X"]]
+        capture_index = self.get_capture_index()
         with open(extra_chroms_bed, "w") as bed_output:
-            for index, chromosome in enumerate(chromosomes):
-                with open(self.settings["capture_path"].replace("/mnt", base_classes.cnv_pat_dir), "r") as bed_input:
-                    if not any([line.startswith(chromosome) for line in bed_input]):
-                        bed_output.write("\t".join([chromosome, "10000", "10010", "dummy\n"]))
-            with open(self.settings["capture_path"].replace("/mnt", base_classes.cnv_pat_dir), "r") as bed_input:
-                for line in bed_input:
-                    bed_output.write(f"{line}")
+            for chromosome in chromosomes:
+                if chromosome not in capture_index.chrom_bounds:
+                    bed_output.write("\t".join([chromosome, "10000", "10010", "dummy\n"]))
+            for line in capture_index.lines:
+                bed_output.write(f"{line}")
 
         docker_prepared_bed_file = prepared_bed_file.replace(self.output_base, self.docker_output_base)
         with open(prepared_bed_file.replace(".bed", ".sorted"), "w") as handle:
@@ -61,15 +63,30 @@ class Excavator2(base_classes.BaseCNVTool):
             self.run_docker_subprocess(
                 ["bedtools", "merge", "-i", f"{docker_prepared_bed_file.replace('.bed', '.sorted')}"],
                 docker_image="stefpiatek/bedtools:latest",
+                resources=containers.ResourceProfile(cpu=1, mem=1),
                 stdout=handle,
             )
 
+        # data preparation only depends on the BAM and the capture, so it is cached for each BAM and shared by
+        # every gene and run. Only the BAMs which aren't in the cache are written to the prepare file
+        step_cache = self.get_step_cache()
+        docker_source_target = source_target.replace(self.output_base, self.docker_output_base)
+        prepare_keys = {}
         experimental_file_prep = f"{self.output_base}/ExperimentalFilePrepare.txt"
-        docker_experimental_file_prep = experimental_file_prep.replace(self.output_base, self.docker_output_base)
         with open(experimental_file_prep, "w") as handle:
             for bam in self.settings["unknown_bams"] + self.settings["normal_bams"]:
                 sample = self.bam_to_sample[bam]
-                handle.write(f"{bam} {self.docker_output_base}/DataPrep/{sample} {sample}\n")
+                docker_prepared = f"{self.docker_output_base}/DataPrep/{sample}"
+                if step_cache:
+                    prepare_key = step_cache.get_key(
+                        self.docker_image,
+                        ["EXCAVATORDataPrepare.pl", bam, sample, docker_source_target, docker_prepared_bed_file],
+                    )
+                    if step_cache.restore(prepare_key, [docker_prepared]):
+                        base_classes.logger.info(f"Reused cached EXCAVATORDataPrepare output for {sample}")
+                        continue
+                    prepare_keys[prepare_key] = docker_prepared
+                handle.write(f"{bam} {docker_prepared} {sample}\n")
 
         exp_file_data = f"{self.output_base}/ExperimentalFileData.txt"
         with open(exp_file_data, "w") as handle:
@@ -85,6 +102,7 @@ class Excavator2(base_classes.BaseCNVTool):
                 sample = self.bam_to_sample[bam]
                 handle.write(f"C{c_counter} {self.docker_output_base}/DataPrep/{sample} {sample}\n")
 
+        # all three steps need to be run in the same container, the inputs are the files in the output base
         self.run_docker_subprocess(
             [
                 "python3.6",
@@ -97,6 +115,8 @@ class Excavator2(base_classes.BaseCNVTool):
                 self.max_cpu,
             ]
         )
+        for prepare_key, docker_prepared in prepare_keys.items():
+            step_cache.store(prepare_key, [docker_prepared])
         sample_names = [f"{self.bam_to_sample[unknown_bam]}" for unknown_bam in self.settings["unknown_bams"]]
         output_paths = [
             f"{self.output_base}/results/Results/{sample_name}/EXCAVATORRegionCall_{sample_name}.vcf"
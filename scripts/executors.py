@@ -0,0 +1,171 @@
+"""
+Backends which run the docker commands of each caller, chosen with the "executor" setting
+
+- local: runs containers on this machine's docker daemon, see containers.py
+- batch: writes a job script for each command and submits it to a slurm-style batch scheduler with sbatch, polling
+  squeue until it leaves the queue. The cnv-patissier directory must be shared with the cluster nodes.
+- mock: runs nothing, recording each command so that the orchestration can be checked without docker
+
+Callers use executor.run and executor.stream through BaseCNVTool, so they run unchanged on any backend.
+"""
+
+import contextlib
+import os
+import shlex
+import subprocess
+import sys
+import time
+import uuid
+
+from loguru import logger
+from settings import cnv_pat_settings
+from scripts import containers, utils
+
+
+class LocalExecutor:
+    def run(self, docker_image, args, mounts, stdout=None, env=None, resources=None):
+        return containers.run_container(docker_image, args, mounts, stdout=stdout, env=env, resources=resources)
+
+    def stream(self, docker_image, args, mounts, env=None, resources=None):
+        return containers.stream_container(docker_image, args, mounts, env=env, resources=resources)
+
+    def preflight(self, docker_images):
+        return containers.preflight_images(docker_images)
+
+
+class BatchExecutor:
+    def __init__(self, script_dir, submit_command="sbatch", status_command="squeue", poll_interval=30):
+        """
+        :param script_dir: directory for job scripts, logs and outputs, must be readable from the cluster nodes
+        :param poll_interval: seconds between checking if a job has finished
+        """
+        self.script_dir = script_dir
+        self.submit_command = submit_command
+        self.status_command = status_command
+        self.poll_interval = poll_interval
+
+    def write_script(self, job_name, docker_command, resources, stdout_path):
+        """Writes job script which runs the docker command and records its exit code, returns the script path"""
+        script_path = f"{self.script_dir}/{job_name}.sh"
+        lines = ["#!/bin/bash", f"#SBATCH --job-name={job_name}", f"#SBATCH --output={self.script_dir}/{job_name}.log"]
+        if resources:
+            lines.extend([f"#SBATCH --cpus-per-task={resources.cpu}", f"#SBATCH --mem={resources.mem}G"])
+        lines.append(f"{' '.join(shlex.quote(arg) for arg in docker_command)} > {shlex.quote(stdout_path)}")
+        # written to a temporary file first so that the exit code is only seen once it is complete
+        exit_path = shlex.quote(f"{self.script_dir}/{job_name}.exit")
+        lines.append(f"echo $? > {exit_path}.tmp && mv {exit_path}.tmp {exit_path}")
+        with open(script_path, "w") as handle:
+            handle.write("\n".join(lines) + "\n")
+        return script_path
+
+    def submit(self, script_path):
+        """Submits job script, returning the job id"""
+        process = subprocess.run([self.submit_command, "--parsable", script_path], check=True, stdout=subprocess.PIPE)
+        # --parsable gives "job_id" or "job_id;cluster_name"
+        return process.stdout.decode().strip().split(";")[0]
+
+    def is_queued(self, job_id):
+        """Returns True if the job is pending or running, squeue fails for job ids which have left the queue"""
+        process = subprocess.run(
+            [self.status_command, "--noheader", "--jobs", job_id, "--format", "%T"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        return process.returncode == 0 and bool(process.stdout.strip())
+
+    def wait(self, job_name, job_id):
+        """Waits for the job to finish, returning the exit code of its docker command"""
+        exit_path = f"{self.script_dir}/{job_name}.exit"
+        while not os.path.exists(exit_path):
+            if not self.is_queued(job_id):
+                # the exit code may not be visible on the shared filesystem yet
+                time.sleep(self.poll_interval)
+                if not os.path.exists(exit_path):
+                    raise Exception(
+                        f"Batch job {job_id} finished without an exit code, see {self.script_dir}/{job_name}.log"
+                    )
+                break
+            time.sleep(self.poll_interval)
+        with open(exit_path, "r") as handle:
+            return int(handle.read().strip())
+
+    def run(self, docker_image, args, mounts, stdout=None, env=None, resources=None):
+        """Submits a job running args in the docker image and waits for it, raising CalledProcessError if it fails"""
+        os.makedirs(self.script_dir, exist_ok=True)
+        env_args = [arg for key, value in (env or {}).items() for arg in ["-e", f"{key}={value}"]]
+        limit_args = ["--cpus", f"{resources.cpu}", "--memory", f"{resources.mem}g"] if resources else []
+        docker_command = ["docker", "run", "--rm", *containers.volume_args(mounts), *limit_args, *env_args]
+        docker_command.extend([docker_image, *args])
+
+        job_name = f"cnv-pat-{uuid.uuid4().hex[:12]}"
+        stdout_path = f"{self.script_dir}/{job_name}.stdout"
+        script_path = self.write_script(job_name, docker_command, resources, stdout_path)
+        job_id = self.submit(script_path)
+        logger.log("DOCKER", f"Batch job {job_id}: {' '.join(docker_command)}")
+        exit_code = self.wait(job_name, job_id)
+        if exit_code != 0:
+            raise subprocess.CalledProcessError(exit_code, args)
+
+        with open(stdout_path, "rb") as handle:
+            output = handle.read()
+        os.remove(stdout_path)
+        if stdout == subprocess.PIPE:
+            return subprocess.CompletedProcess(args, 0, stdout=output)
+        containers.DockerClient.write_output(stdout or sys.stdout, output)
+        return subprocess.CompletedProcess(args, 0)
+
+    @contextlib.contextmanager
+    def stream(self, docker_image, args, mounts, env=None, resources=None):
+        """Batch jobs can't be read while they run, so the lines are given once the job has finished"""
+        process = self.run(docker_image, args, mounts, stdout=subprocess.PIPE, env=env, resources=resources)
+        yield iter(process.stdout.decode(errors="replace").splitlines(keepends=True))
+
+    def preflight(self, docker_images):
+        logger.info("Docker images are pulled by each batch job, skipping preflight")
+        return {}
+
+
+class MockExecutor:
+    def __init__(self, handlers=None):
+        """
+        :param handlers: dictionary of command (the first argument) to a function called with (args, mounts),
+                         which returns the bytes written to stdout. Commands without a handler write nothing.
+        """
+        self.handlers = handlers or {}
+        self.calls = []
+
+    def get_output(self, docker_image, args, mounts):
+        self.calls.append((docker_image, list(args)))
+        logger.log("DOCKER", f"Mock run {docker_image} {' '.join(args)}")
+        handler = self.handlers.get(args[0])
+        return handler(args, mounts) if handler else b""
+
+    def run(self, docker_image, args, mounts, stdout=None, env=None, resources=None):
+        output = self.get_output(docker_image, args, mounts)
+        if stdout == subprocess.PIPE:
+            return subprocess.CompletedProcess(args, 0, stdout=output)
+        if stdout is not None and output:
+            containers.DockerClient.write_output(stdout, output)
+        return subprocess.CompletedProcess(args, 0)
+
+    @contextlib.contextmanager
+    def stream(self, docker_image, args, mounts, env=None, resources=None):
+        output = self.get_output(docker_image, args, mounts)
+        yield iter(output.decode(errors="replace").splitlines(keepends=True))
+
+    def preflight(self, docker_images):
+        return {}
+
+
+def get_executor(name):
+    if name == "local":
+        return LocalExecutor()
+    if name == "batch":
+        return BatchExecutor(f"{utils.get_cnv_patissier_dir()}/output/batch-jobs")
+    if name == "mock":
+        return MockExecutor()
+    raise Exception(f"Unknown executor '{name}', please use 'local', 'batch' or 'mock' in your local settings file")
+
+
+# shared by all callers in the process
+executor = get_executor(cnv_pat_settings.get("executor", "local"))
@@ -15,10 +15,12 @@ from . import utils, base_classes
 
 
 class ExomeDepthBase(base_classes.BaseCNVTool):
+    docker_image = "stefpiatek/exomedepth:1.1.10"
+
     def __init__(self, capture, gene, start_time, normal_panel):
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
 
-        self.settings = {**self.settings, "docker_image": "stefpiatek/exomedepth:1.1.10", "min_mapq": 20}
+        self.settings = {**self.settings, "docker_image": self.docker_image, "min_mapq": 20}
 
     def parse_output_file(self, file_path, sample_id):
         cnvs = []
@@ -79,6 +81,9 @@ class ExomeDepthCohort(ExomeDepthBase):
 
 
 class ExomeDepthCase(ExomeDepthBase):
+    incremental_unknowns = True
+    normal_panel_run_type = "exome-depth_cohort"
+
     def __init__(self, capture, gene, start_time):
         self.run_type = "exome-depth_case"
         super().__init__(capture, gene, start_time, normal_panel=False)
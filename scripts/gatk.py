@@ -10,10 +10,12 @@ import os
 
 import toml
 
-from . import utils, base_classes
+from . import utils, base_classes, vcf
 
 
 class GATKBase(base_classes.BaseCNVTool):
+    docker_image = "broadinstitute/gatk:4.1.0.0"
+
     def __init__(self, capture, gene, start_time, normal_panel):
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
         self.extra_db_fields = ["format_data", "info_data", "id", "ref", "qual", "filter"]
@@ -27,29 +29,30 @@ class GATKBase(base_classes.BaseCNVTool):
                 "/mnt/cnv-caller-resources/gatk/"
                 f"contig-ploidy-priors_prefix-{self.settings['chromosome_prefix']}.tsv"
             ),
-            "docker_image": "broadinstitute/gatk:4.1.0.0",
+            "docker_image": self.docker_image,
         }
 
     def parse_output_file(self, file_path, sample_id):
-        with open(file_path) as handle:
+        with vcf.open_vcf(file_path) as handle:
             cnvs = self.parse_vcf(handle, sample_id)
         return cnvs
 
-    def run_gatk_command(self, args):
-        """Create dir for output and runs a GATK command in docker"""
+    def run_gatk_command(self, args, cache_outputs=None):
+        """Create dir for output and runs a GATK command in docker, cache_outputs are reused for identical inputs"""
         try:
             os.makedirs(f"{self.output_base}/{args[0]}")
         except FileExistsError:
             base_classes.logger.info(f"Folder {args[0]} already exists")
 
         base_classes.logger.info(f"Running  GATK: {args[0]} \n output: {args[-1]}")
-        self.run_docker_subprocess(
-            ["java", f"-Xmx{self.max_mem}g", f"-XX:ConcGCThreads={self.max_cpu}", "-jar", "gatk.jar", *args]
-        )
+        self.run_docker_subprocess([*self.java_args(), "-jar", "gatk.jar", *args], cache_outputs=cache_outputs)
         base_classes.logger.info(f"Completed  GATK: {args[0]} {args[-1]}")
 
 
 class GATKCase(GATKBase):
+    incremental_unknowns = True
+    normal_panel_run_type = "gatk_cohort"
+
     def __init__(self, capture, gene, start_time):
         self.run_type = "gatk_case"
         super().__init__(capture, gene, start_time, normal_panel=False)
@@ -85,7 +88,8 @@ class GATKCase(GATKBase):
                     "OVERLAPPING_ONLY",
                     "-O",
                     hdf5_name,
-                ]
+                ],
+                cache_outputs=[hdf5_name],
             )
 
         determine_germline_ploidy_dir = f"{self.docker_output_base}/DetermineGermlineContigPloidy"
@@ -190,7 +194,8 @@ class GATKCohort(GATKBase):
                 "OVERLAPPING_ONLY",
                 "-O",
                 pre_process_interval_out,
-            ]
+            ],
+            cache_outputs=[pre_process_interval_out],
         )
 
         collect_read_counts = []
@@ -210,7 +215,8 @@ class GATKCohort(GATKBase):
                     "OVERLAPPING_ONLY",
                     "-O",
                     collect_read_count_out,
-                ]
+                ],
+                cache_outputs=[collect_read_count_out],
             )
 
         input_flags = []
@@ -0,0 +1,123 @@
+"""
+Sorted per-chromosome index of regions for fast overlap queries, and a parsed capture BED shared between callers
+
+Overlapping and adjacent regions are merged, so the starts and ends on each chromosome are both sorted and only the
+region with the last start before a query's end can overlap it. Queries are a binary search instead of a scan over
+every region. Coordinates are treated as closed intervals, matching the within/spanning checks for called CNVs.
+"""
+
+import bisect
+import os
+import threading
+
+# capture indexes by BED path, shared by all callers in the process
+capture_indexes = {}
+capture_indexes_lock = threading.Lock()
+
+
+class IntervalIndex:
+    def __init__(self, regions):
+        """
+        :param regions: iterable of (chrom, start, end) tuples
+        """
+        by_chrom = {}
+        for chrom, start, end in regions:
+            by_chrom.setdefault(chrom, []).append((int(start), int(end)))
+
+        self.starts = {}
+        self.ends = {}
+        for chrom, chrom_regions in by_chrom.items():
+            starts, ends = [], []
+            for start, end in sorted(chrom_regions):
+                if ends and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[chrom] = starts
+            self.ends[chrom] = ends
+
+    @classmethod
+    def from_bed_lines(cls, bed_lines):
+        regions = []
+        for line in bed_lines:
+            chrom, start, end, *_ = line.split()
+            regions.append((chrom, start, end))
+        return cls(regions)
+
+    def overlaps(self, chrom, start, end):
+        """Returns True if any region on the chromosome overlaps start to end (inclusive)"""
+        starts = self.starts.get(chrom)
+        if not starts:
+            return False
+        position = bisect.bisect_right(starts, int(end)) - 1
+        return position >= 0 and self.ends[chrom][position] >= int(start)
+
+
+class CaptureIndex:
+    """
+    Capture BED parsed once per process, with the targets for each gene and the bounds of each chromosome
+
+    Use CaptureIndex.get so that all callers share the same index, it is reparsed if the BED file changes.
+    """
+
+    chromosome_names = [f"{number}" for number in range(1, 23)] + ["X", "Y", "M", "mt"]
+
+    def __init__(self, bed_path):
+        self.bed_path = bed_path
+        with open(bed_path, "r") as handle:
+            self.lines = handle.readlines()
+
+        self.targets = []
+        self.gene_targets = {}
+        self.chrom_bounds = {}
+        for line in self.lines:
+            fields = line.split()
+            if len(fields) < 4 or not (fields[1].isdigit() and fields[2].isdigit()):
+                # blank and header lines aren't targets, they are kept in lines for invalid_line to report
+                continue
+            chrom, start, end, name = fields[:4]
+            target = (chrom, int(start), int(end), name)
+            self.targets.append(target)
+            self.gene_targets.setdefault(name, []).append(target)
+            chrom_start, chrom_end = self.chrom_bounds.get(chrom, target[1:3])
+            self.chrom_bounds[chrom] = (min(chrom_start, target[1]), max(chrom_end, target[2]))
+        self.gene_indexes = {}
+
+    @classmethod
+    def get(cls, bed_path):
+        stat = os.stat(bed_path)
+        key = (os.path.abspath(bed_path), stat.st_size, stat.st_mtime_ns)
+        with capture_indexes_lock:
+            if key not in capture_indexes:
+                capture_indexes[key] = cls(bed_path)
+            return capture_indexes[key]
+
+    def gene_bed(self, gene):
+        """Returns BED lines for the gene's targets"""
+        return [f"{chrom}\t{start}\t{end}\t{name}\n" for chrom, start, end, name in self.gene_targets.get(gene, [])]
+
+    def gene_index(self, gene):
+        if gene not in self.gene_indexes:
+            self.gene_indexes[gene] = IntervalIndex(target[:3] for target in self.gene_targets.get(gene, []))
+        return self.gene_indexes[gene]
+
+    def gene_bounds(self, gene):
+        """Returns chromosome, start of the first target and end of the last target for the gene"""
+        targets = self.gene_targets[gene]
+        return (targets[0][0], targets[0][1], targets[-1][2])
+
+    def invalid_line(self, chromosome_prefix):
+        """Returns line number and line of the first line which doesn't start with a prefixed chromosome, or None"""
+        chromosomes = tuple(f"{chromosome_prefix}{name}\t" for name in self.chromosome_names)
+        for line_number, line in enumerate(self.lines, start=1):
+            if not line.startswith(chromosomes):
+                return (line_number, line)
+        return None
+
+    def unprefixed_targets(self, chromosome_prefix):
+        """Returns targets with the chromosome prefix removed"""
+        return [
+            (chrom[len(chromosome_prefix) :] if chrom.startswith(chromosome_prefix) else chrom, start, end, name)
+            for chrom, start, end, name in self.targets
+        ]
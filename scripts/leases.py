@@ -0,0 +1,138 @@
+"""
+Lease files so that several workers can share one output directory
+
+Each caller and gene is claimed by creating its lease file, which only one worker can do. While the caller runs, a
+heartbeat thread updates the modification time of the file. If a worker crashes its heartbeat stops, and once the
+lease hasn't been updated for the timeout, another worker removes it and takes over. If the heartbeat finds that the
+lease was lost or can't update it, the worker stops its job at the next check.
+
+The lease directory must be on a filesystem shared by all workers, and their clocks should be in sync.
+"""
+
+import os
+import threading
+import time
+import uuid
+
+from loguru import logger
+from settings import cnv_pat_settings
+
+
+class LeaseHeld(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class Lease:
+    def __init__(self, path, timeout=None):
+        """
+        :param path: lease file path, all workers must use the same path for the same job
+        :param timeout: seconds without a heartbeat after which the lease can be reclaimed
+        """
+        self.path = path
+        self.timeout = float(timeout or cnv_pat_settings.get("lease_timeout", 600))
+        self.heartbeat_interval = self.timeout / 10
+        self.owner = f"{os.uname().nodename} {os.getpid()} {uuid.uuid4().hex}"
+        self.stop_heartbeat = threading.Event()
+        self.heartbeat_thread = None
+        self.lost = threading.Event()
+
+    def __enter__(self):
+        self.acquire(wait=True)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    @staticmethod
+    def read_owner(path):
+        try:
+            with open(path, "r") as handle:
+                return handle.read()
+        except FileNotFoundError:
+            return None
+
+    def create(self):
+        """Creates the lease file if it doesn't exist, returns True if it was created"""
+        try:
+            lease_fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(lease_fd, "w") as handle:
+            handle.write(self.owner)
+        return True
+
+    def reclaim_expired(self):
+        """Removes the lease file if it hasn't had a heartbeat within the timeout, returns True if it was removed"""
+        expired_owner = self.read_owner(self.path)
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return True
+        if age <= self.timeout:
+            return False
+
+        # renaming is atomic, so only one worker can reclaim the lease
+        expired_path = f"{self.path}.{uuid.uuid4().hex}.expired"
+        try:
+            os.rename(self.path, expired_path)
+        except FileNotFoundError:
+            return True
+        if self.read_owner(expired_path) != expired_owner:
+            # another worker reclaimed and created the lease after it was checked, so put theirs back
+            try:
+                os.link(expired_path, self.path)
+            except FileExistsError:
+                pass
+            os.remove(expired_path)
+            return False
+        os.remove(expired_path)
+        logger.warning(f"Reclaimed expired lease {self.path} from {expired_owner}")
+        return True
+
+    def acquire(self, wait=False, poll_interval=1):
+        """
+        Claims the lease, returns True if it was claimed.
+        If wait is True, waits until the lease is free instead of returning False
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        while True:
+            if self.create() or (self.reclaim_expired() and self.create()):
+                self.stop_heartbeat.clear()
+                self.lost.clear()
+                self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+                self.heartbeat_thread.start()
+                return True
+            if not wait:
+                return False
+            time.sleep(poll_interval)
+
+    def heartbeat(self):
+        while not self.stop_heartbeat.wait(self.heartbeat_interval):
+            try:
+                if self.read_owner(self.path) != self.owner:
+                    logger.error(f"Lease {self.path} was lost, another worker may be running the same job")
+                    self.lost.set()
+                    return
+                os.utime(self.path)
+            except OSError as error:
+                logger.error(f"Could not update lease {self.path}, another worker may take over the job: {error}")
+                self.lost.set()
+                return
+
+    def check(self):
+        """Raises LeaseLost if the heartbeat found that the lease was lost, so that the job is stopped"""
+        if self.lost.is_set():
+            raise LeaseLost(f"Lease {self.path} was lost, stopping the job so that only one worker runs it")
+
+    def release(self):
+        """Stops the heartbeat and removes the lease file, if it is still owned by this worker"""
+        if self.heartbeat_thread:
+            self.stop_heartbeat.set()
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+        if self.read_owner(self.path) == self.owner:
+            os.remove(self.path)
@@ -0,0 +1,121 @@
+"""
+Upgrades an existing capture database in place to the schema in scripts/models.py
+
+DbSession.global_init only creates missing tables, so constraints and indexes added to existing tables are applied
+here. Rows which duplicate the natural key of another row are merged into the most recently added row, with foreign
+keys repointed to it, and then each table is rebuilt with the current schema. The schema version is stored in the
+sqlite user_version so that up to date databases are left alone.
+"""
+
+import contextlib
+import os
+import sqlite3
+
+from sqlalchemy import UniqueConstraint, create_engine
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from . import base_classes
+from .db_session import Base
+
+SCHEMA_VERSION = 1
+
+
+def get_schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def get_table_names(connection):
+    return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def needs_migration(sqlite_path):
+    """Returns True if the database exists and was created with an older schema"""
+    if not os.path.exists(sqlite_path):
+        return False
+    with contextlib.closing(sqlite3.connect(sqlite_path)) as connection:
+        return bool(get_table_names(connection)) and get_schema_version(connection) < SCHEMA_VERSION
+
+
+def set_schema_version(sqlite_path):
+    """Marks database as using the current schema, should only be used once the tables have been created"""
+    with contextlib.closing(sqlite3.connect(sqlite_path)) as connection:
+        connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        connection.commit()
+
+
+def create_table(connection, table, engine):
+    connection.execute(f"{CreateTable(table).compile(engine)}")
+    for index in table.indexes:
+        connection.execute(f"{CreateIndex(index).compile(engine)}")
+
+
+def deduplicate(connection, table):
+    """Removes rows which share a unique key with a later row, repointing foreign keys to the row which is kept"""
+    references = [
+        (foreign_key.parent.table.name, foreign_key.parent.name)
+        for other_table in Base.metadata.sorted_tables
+        for foreign_key in other_table.foreign_keys
+        if foreign_key.column.table is table
+    ]
+    existing_tables = get_table_names(connection)
+    for constraint in table.constraints:
+        if not isinstance(constraint, UniqueConstraint):
+            continue
+        key_columns = ", ".join(f'"{column.name}"' for column in constraint.columns)
+        duplicates = connection.execute(
+            f'SELECT MAX(id), GROUP_CONCAT(id) FROM "{table.name}" GROUP BY {key_columns} HAVING COUNT(*) > 1'
+        ).fetchall()
+        for kept_id, grouped_ids in duplicates:
+            removed_ids = [int(row_id) for row_id in grouped_ids.split(",") if int(row_id) != kept_id]
+            placeholders = ", ".join("?" for _ in removed_ids)
+            for reference_table, reference_column in references:
+                if reference_table in existing_tables:
+                    connection.execute(
+                        f'UPDATE "{reference_table}" SET "{reference_column}" = ? '
+                        f'WHERE "{reference_column}" IN ({placeholders})',
+                        [kept_id, *removed_ids],
+                    )
+            connection.execute(f'DELETE FROM "{table.name}" WHERE id IN ({placeholders})', removed_ids)
+        if duplicates:
+            base_classes.logger.info(f"Merged {len(duplicates)} duplicated rows in {table.name}")
+
+
+def rebuild_table(connection, table, engine):
+    """Recreates the table with the current schema, copying over all columns which exist in both"""
+    old_columns = {row[1] for row in connection.execute(f'PRAGMA table_info("{table.name}")')}
+    columns = ", ".join(f'"{column.name}"' for column in table.columns if column.name in old_columns)
+    old_name = f"_old_{table.name}"
+    connection.execute(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"')
+    create_table(connection, table, engine)
+    connection.execute(f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{old_name}"')
+    connection.execute(f'DROP TABLE "{old_name}"')
+
+
+def migrate(sqlite_path):
+    """Upgrades the database to the current schema, returns False if it was already up to date"""
+    if not os.path.exists(sqlite_path):
+        raise Exception(f"Database {sqlite_path} does not exist")
+    engine = create_engine(f"sqlite:///{sqlite_path}")
+    with contextlib.closing(sqlite3.connect(sqlite_path, isolation_level=None)) as connection:
+        if get_schema_version(connection) >= SCHEMA_VERSION:
+            base_classes.logger.info(f"Database {sqlite_path} is already at schema version {SCHEMA_VERSION}")
+            return False
+        # stops renaming a table from rewriting the foreign keys of other tables to point at the renamed table
+        connection.execute("PRAGMA foreign_keys = OFF")
+        connection.execute("PRAGMA legacy_alter_table = ON")
+        connection.execute("BEGIN")
+        try:
+            existing_tables = get_table_names(connection)
+            for table in Base.metadata.sorted_tables:
+                if table.name in existing_tables:
+                    deduplicate(connection, table)
+                    rebuild_table(connection, table, engine)
+                else:
+                    create_table(connection, table, engine)
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    base_classes.logger.info(f"Migrated {sqlite_path} to schema version {SCHEMA_VERSION}")
+    return True
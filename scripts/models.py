@@ -8,9 +8,11 @@ class CalledCNV(Base):
     __tablename__ = "called_cnvs"
     id = Column(Integer, primary_key=True)
     caller_id = Column(Integer, ForeignKey("callers.id", ondelete="CASCADE"), nullable=False)
-    cnv_id = Column(Integer, ForeignKey("cnvs.id", ondelete="CASCADE"), nullable=False)
+    cnv_id = Column(Integer, ForeignKey("cnvs.id", ondelete="CASCADE"), nullable=False, index=True)
     json_data = Column(Text)
-    sample_id = Column(Integer, ForeignKey("samples.id", ondelete="CASCADE"), nullable=False)
+    sample_id = Column(Integer, ForeignKey("samples.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    __table_args__ = (UniqueConstraint(caller_id, cnv_id, sample_id),)
 
     def __repr__(self):
         return f"{self.id}"
@@ -21,6 +23,8 @@ class Caller(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String)
 
+    __table_args__ = (UniqueConstraint(name),)
+
     def __repr__(self):
         return f"{self.name}"
 
@@ -34,6 +38,8 @@ class CNV(Base):
     genome_build = Column(String)
     start = Column(Integer)
 
+    __table_args__ = (UniqueConstraint(genome_build, chrom, start, end, alt),)
+
     def __repr__(self):
         return f"{self.build } {self.chrom}:{self.start}-{self.end} {self.alt}"
 
@@ -71,7 +77,9 @@ class KnownCNV(Base):
     __tablename__ = "known_cnvs"
     id = Column(Integer, primary_key=True)
     cnv_id = Column(Integer, ForeignKey("cnvs.id", ondelete="CASCADE"), nullable=False)
-    sample_id = Column(Integer, ForeignKey("samples.id", ondelete="CASCADE"), nullable=False)
+    sample_id = Column(Integer, ForeignKey("samples.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    __table_args__ = (UniqueConstraint(cnv_id, sample_id),)
 
     def __repr__(self):
         return f"{self.id}"
@@ -95,10 +103,12 @@ class Sample(Base):
     __tablename__ = "samples"
     id = Column(Integer, primary_key=True)
     bam_header = Column(Text)
-    gene_id = Column(Integer, ForeignKey("genes.id", ondelete="CASCADE"), nullable=False)
+    gene_id = Column(Integer, ForeignKey("genes.id", ondelete="CASCADE"), nullable=False, index=True)
     name = Column(String)
     path = Column(Text)
     result_type = Column(String)
 
+    __table_args__ = (UniqueConstraint(name, gene_id),)
+
     def __repr__(self):
         return f"{self.name}"
@@ -7,22 +7,24 @@ Used splitting of BED file with defaults (100bp bins with 50 bp overlap)
 import csv
 import pathlib
 
-from . import base_classes
+from . import utils, base_classes
 
 
 class panelcnMOPS(base_classes.BaseCNVTool):
+    docker_image = "stefpiatek/panelcn_mops:1.4.0"
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.run_type = "panelcn_mops"
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
         self.extra_db_fields = ["gene", "exon", "rc", "medrc", "rc.norm", "medrc.norm", "lowqual", "cn"]
-        self.settings = {**self.settings, "docker_image": "stefpiatek/panelcn_mops:1.4.0"}
+        self.settings = {**self.settings, "docker_image": self.docker_image}
 
-    def parse_output_file(self, file_path, sample_id):
-        cnvs = []
+    def demultiplex_output_file(self, file_path, sample_ids):
+        sample_cnvs = {sample_id: [] for sample_id in sample_ids}
         with open(file_path, "r") as handle:
             output = csv.DictReader(handle, delimiter="\t")
             for row in output:
-                if row["Sample"] == sample_id:
+                if row["Sample"] in sample_cnvs:
                     cnv = {key.lower(): value for key, value in row.items()}
                     cnv["chrom"] = f"{self.settings['chromosome_prefix']}{cnv.pop('chr')}"
                     cnv["sample_id"] = cnv.pop("sample")
@@ -33,23 +35,19 @@ class panelcnMOPS(base_classes.BaseCNVTool):
                         cnv["alt"] = "DUP"
                     else:
                         raise Exception(f"row doesn't have a copy number change {cnv}")
-                    cnvs.append(cnv)
+                    sample_cnvs[cnv["sample_id"]].append(cnv)
 
-        return cnvs
+        return sample_cnvs
 
     def run_command(self, args):
         self.run_docker_subprocess(["Rscript", f"/mnt/cnv-caller-resources/panelcn_mops/panelcn_mops_runner.R", *args])
 
     def run_workflow(self):
-        bed_path = self.settings["capture_path"].replace("/mnt", base_classes.cnv_pat_dir)
-
         pathlib.Path(self.output_base).mkdir(parents=True, exist_ok=True)
 
-        with open(bed_path, "r") as input_bed:
-            with open(f"{self.output_base}/capture.bed", "w") as output_bed:
-                for line in input_bed:
-                    chrom, start, end, gene = line.split()
-                    output_bed.write(f"{chrom}\t{start}\t{end}\t{gene}.{chrom}.{start}.{end}\n")
+        with open(f"{self.output_base}/capture.bed", "w") as output_bed:
+            for chrom, start, end, gene in self.get_capture_index().targets:
+                output_bed.write(f"{chrom}\t{start}\t{end}\t{gene}.{chrom}.{start}.{end}\n")
 
         with open(f"{self.output_base}/samples.tsv", "w") as handle:
             handle.write(f"bam_path\tsample_name\tsample_type\n")
@@ -62,7 +60,11 @@ class panelcnMOPS(base_classes.BaseCNVTool):
 
                 handle.write(f"{bam}\t{sample}\t{sample_type}\n")
 
-        self.run_command([f"--output-path={self.docker_output_base}", f"--gene={self.gene}"])
+        if self.gene == utils.CAPTURE_WIDE:
+            genes = ",".join(utils.get_capture_genes(self.capture))
+        else:
+            genes = self.gene
+        self.run_command([f"--output-path={self.docker_output_base}", f"--gene={genes}"])
 
         sample_names = [f"{self.bam_to_sample[unknown_bam]}" for unknown_bam in self.settings["unknown_bams"]]
         output_paths = [f"{self.output_base}/calls.tsv" for sample_name in sample_names]
@@ -0,0 +1,154 @@
+"""
+Estimates how long the callers and genes which need to be run will take, without running anything
+
+Each caller's time per sample is taken from its previous runs: the duration in the runs table, or the successful run
+settings for cohort callers, which don't upload runs. A case caller's run duration includes its cohort caller's, so
+the cohort's duration is removed. Pending callers and genes are estimated from their number of unknown samples, then
+scheduled longest job first on the given number of concurrent jobs, with case callers waiting for their cohort.
+"""
+
+import glob
+import heapq
+import json
+import os
+
+import toml
+
+from scripts import models
+
+
+class Unit:
+    """Caller and gene to be run, parents must finish before it can start"""
+
+    def __init__(self, run_type, gene, samples, parents=None):
+        self.run_type = run_type
+        self.gene = gene
+        self.samples = samples
+        self.parents = list(parents or [])
+        self.seconds = None
+
+    def __repr__(self):
+        return f"{self.run_type} {self.gene}"
+
+
+def settings_duration(settings_path):
+    """Returns seconds taken and number of unknown samples from a successful run settings file"""
+    with open(settings_path) as handle:
+        run_settings = toml.load(handle)
+    seconds = (run_settings["end_datetime"] - run_settings["start_datetime"]).total_seconds()
+    return seconds, len(run_settings["unknown_bams"])
+
+
+def get_history(session, settings_dir):
+    """Returns dictionary of run_type: [(seconds, number of samples)] for previous runs"""
+    history = {}
+    runs = (
+        session.query(models.Run, models.Caller.name, models.Gene)
+        .join(models.Caller, models.Run.caller_id == models.Caller.id)
+        .join(models.Gene, models.Run.gene_id == models.Gene.id)
+    )
+    for run, run_type, gene in runs:
+        if not run.samples or run.duration is None:
+            continue
+        seconds = run.duration.total_seconds()
+        if run_type.endswith("case"):
+            cohort_path = f"{settings_dir}/{gene.capture}/{run_type.replace('case', 'cohort')}/{gene.name}.toml"
+            if os.path.exists(cohort_path):
+                seconds = max(seconds - settings_duration(cohort_path)[0], 0)
+        history.setdefault(run_type, []).append((seconds, len(json.loads(run.samples))))
+
+    # cohort callers only have their successful run settings
+    settings_history = {}
+    for settings_path in glob.glob(f"{settings_dir}/*/*_cohort/*.toml"):
+        run_type = os.path.basename(os.path.dirname(settings_path))
+        settings_history.setdefault(run_type, []).append(settings_duration(settings_path))
+    for run_type, runs in settings_history.items():
+        history.setdefault(run_type, runs)
+    return history
+
+
+def get_seconds_per_sample(history):
+    """Returns dictionary of run_type: seconds per sample, with None for the mean of all callers"""
+    totals = {
+        run_type: (sum(seconds for seconds, _ in runs), sum(samples for _, samples in runs))
+        for run_type, runs in history.items()
+    }
+    seconds_per_sample = {run_type: seconds / samples for run_type, (seconds, samples) in totals.items() if samples}
+    all_seconds, all_samples = sum(total[0] for total in totals.values()), sum(total[1] for total in totals.values())
+    seconds_per_sample[None] = all_seconds / all_samples if all_samples else None
+    return seconds_per_sample
+
+
+def estimate(units, history):
+    """Sets the estimated seconds for each unit, returns the units which had no previous runs for their caller"""
+    seconds_per_sample = get_seconds_per_sample(history)
+    if seconds_per_sample[None] is None and units:
+        raise Exception("No previous runs found to estimate durations from, please run at least one caller first")
+    without_history = []
+    for unit in units:
+        if unit.run_type not in seconds_per_sample:
+            without_history.append(unit)
+        unit.seconds = seconds_per_sample.get(unit.run_type, seconds_per_sample[None]) * unit.samples
+    return without_history
+
+
+def longest_first(units, max_jobs):
+    """
+    Simulates running the units on max_jobs at a time, always starting the longest unit which is ready.
+    Returns list of (unit, start seconds, end seconds) in the order they are started
+    """
+    worker_free_at = [0.0] * max(int(max_jobs), 1)
+    finished_at = {}
+    pending = list(units)
+    order = []
+    while pending:
+        # parents which aren't pending have already been run
+        ready = [unit for unit in pending if not any(parent in pending for parent in unit.parents)]
+        unit = max(ready, key=lambda unit: unit.seconds)
+        pending.remove(unit)
+        parents_finished_at = [finished_at[parent] for parent in unit.parents if parent in finished_at]
+        start = max([heapq.heappop(worker_free_at)] + parents_finished_at)
+        finished_at[unit] = start + unit.seconds
+        heapq.heappush(worker_free_at, finished_at[unit])
+        order.append((unit, start, finished_at[unit]))
+    return order
+
+
+def critical_path(units):
+    """Returns the chain of units with the longest total duration, parents first"""
+    longest = []
+    for unit in units:
+        chain = [unit]
+        while any(parent in units for parent in chain[0].parents):
+            chain.insert(0, max((parent for parent in chain[0].parents if parent in units), key=lambda p: p.seconds))
+        if sum(link.seconds for link in chain) > sum(link.seconds for link in longest):
+            longest = chain
+    return longest
+
+
+def format_seconds(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    return f"{hours}h {remainder // 60:02d}m"
+
+
+def report(units, history, max_jobs):
+    """Returns text of the estimated duration and order for the units"""
+    if not units:
+        return "All callers have already been run for every gene, nothing to plan"
+    without_history = estimate(units, history)
+    order = longest_first(units, max_jobs)
+    makespan = max(end for _, _, end in order)
+    lines = [f"Suggested order, longest first with {max_jobs} concurrent jobs:"]
+    for number, (unit, start, end) in enumerate(order, start=1):
+        lines.append(
+            f"{number:>4}. {unit.run_type:<20} {unit.gene:<20} {unit.samples:>5} samples "
+            f"{format_seconds(unit.seconds):>9}  (starts at {format_seconds(start)})"
+        )
+    lines.append(f"Expected total time: {format_seconds(makespan)}")
+    lines.append(f"Total caller time: {format_seconds(sum(unit.seconds for unit in units))}")
+    path = critical_path(units)
+    lines.append(f"Critical path ({format_seconds(sum(unit.seconds for unit in path))}): {' -> '.join(map(str, path))}")
+    if without_history:
+        run_types = sorted({unit.run_type for unit in without_history})
+        lines.append(f"No previous runs for {', '.join(run_types)}, estimated from the mean of all callers")
+    return "\n".join(lines)
@@ -0,0 +1,37 @@
+"""
+Compact record for a called CNV, used between parsing a caller's output and uploading it
+
+Coordinates are converted to integers once and chromosome and alt strings are interned, so large result sets
+share them. Caller-specific fields are kept in the extra dictionary and only serialised to JSON at upload.
+"""
+
+import json
+import sys
+
+
+class CalledCNVRecord:
+    __slots__ = ("chrom", "start", "end", "alt", "sample_id", "extra")
+
+    def __init__(self, chrom, start, end, alt, sample_id, extra=None):
+        self.chrom = sys.intern(chrom)
+        self.start = int(start)
+        self.end = int(end)
+        self.alt = sys.intern(alt)
+        self.sample_id = sample_id
+        self.extra = extra if extra is not None else {}
+
+    @classmethod
+    def from_call(cls, cnv, extra_db_fields):
+        """Creates record from a parsed call, keeping only the extra_db_fields of the caller"""
+        extra = {field: cnv[field] for field in extra_db_fields}
+        return cls(cnv["chrom"], cnv["start"], cnv["end"], cnv["alt"], cnv["sample_id"], extra)
+
+    @property
+    def cnv_key(self):
+        return (self.chrom, self.start, self.end, self.alt)
+
+    def json_data(self):
+        return json.dumps(self.extra)
+
+    def __repr__(self):
+        return f"{self.sample_id} {self.chrom}:{self.start}-{self.end} {self.alt}"
@@ -11,6 +11,8 @@ from scripts import base_classes
 
 
 class SavvyCNV(base_classes.BaseCNVTool):
+    docker_image = "stefpiatek/savvycnv:f996a83"
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.run_type = "savvycnv"
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
@@ -22,17 +24,20 @@ class SavvyCNV(base_classes.BaseCNVTool):
             "relative_dosage",
             "coverage_filename",
         ]
-        self.settings = {**self.settings, "docker_image": "stefpiatek/savvycnv:f996a83"}
+        self.settings = {**self.settings, "docker_image": self.docker_image}
 
-    def parse_output_file(self, file_path, sample_id):
+    def demultiplex_output_file(self, file_path, sample_ids):
         call_fields = ["chrom", "start", "end", "call", *self.extra_db_fields]
-        coverage_filename = f"{self.docker_output_base}/CoverageBinner/{sample_id}.coverageBinner"
-        cnvs = []
+        coverage_dir = f"{self.docker_output_base}/CoverageBinner"
+        coverage_to_sample = {f"{coverage_dir}/{sample_id}.coverageBinner": sample_id for sample_id in sample_ids}
+        sample_cnvs = {sample_id: [] for sample_id in sample_ids}
 
         with open(file_path, "r") as handle:
             output = csv.DictReader(handle, delimiter="\t", fieldnames=call_fields)
             for row in output:
-                if row["coverage_filename"] == coverage_filename:
+                coverage_filename = row["coverage_filename"]
+                if coverage_filename in coverage_to_sample:
+                    sample_id = coverage_to_sample[coverage_filename]
                     cnv = dict(row)
                     cnv["chrom"] = f"{self.settings['chromosome_prefix']}{cnv['chrom'].lstrip('chr')}"
                     cnv["sample_id"] = sample_id
@@ -43,16 +48,14 @@ class SavvyCNV(base_classes.BaseCNVTool):
                         cnv["alt"] = "DUP"
                     else:
                         raise Exception(f"No call has been made for {coverage_filename}")
-                    cnvs.append(cnv)
-        return cnvs
+                    sample_cnvs[sample_id].append(cnv)
+        return sample_cnvs
 
     def run_command(self, args, stdout):
         """Runs SavvyCNV command in docker"""
 
         base_classes.logger.info(f"Running {args[0]} step of SavvyCNV for {args[-1]} ")
-        self.run_docker_subprocess(
-            ["java", f"-Xmx{self.max_mem}g", f"-XX:ConcGCThreads={self.max_cpu}", *args], stdout=stdout
-        )
+        self.run_docker_subprocess([*self.java_args(), *args], stdout=stdout)
         base_classes.logger.info(f"Completed {args[0]} step of SavvyCNV for {args[-1]}")
 
     def run_workflow(self):
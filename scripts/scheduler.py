@@ -0,0 +1,123 @@
+"""
+Runs CNV caller jobs concurrently
+
+Jobs are started as soon as all of their parent jobs have completed and there is enough of the cpu and memory
+budget free. If a job fails, every job that depends on it is cancelled and the remaining jobs carry on.
+A job which raises Deferred, e.g. because another worker is running it, is tried again after retry_interval.
+"""
+
+import concurrent.futures
+import time
+
+from . import base_classes
+
+
+class Deferred(Exception):
+    """Raised by a job which can't be run yet, the job is put back in the queue instead of failing"""
+
+
+class Job:
+    """
+    Single unit of work for the scheduler, run is called with no arguments in a worker thread.
+
+    parents are the jobs which must complete successfully before this job can start
+    """
+
+    def __init__(self, name, run, cpu=1, mem=1, parents=None):
+        self.name = name
+        self.run = run
+        self.cpu = cpu
+        self.mem = mem
+        self.parents = list(parents or [])
+        self.status = "pending"
+        self.retry_at = None
+
+    def __repr__(self):
+        return f"{self.name}"
+
+
+class Scheduler:
+    def __init__(self, max_cpu, max_mem, retry_interval=60):
+        self.max_cpu = int(max_cpu)
+        self.max_mem = int(max_mem)
+        self.retry_interval = retry_interval
+        self.jobs = []
+
+    def add_job(self, name, run, cpu=1, mem=1, parents=None):
+        """Adds job to the scheduler, requests larger than the budget are capped so that the job can run alone"""
+        job = Job(name, run, cpu=min(int(cpu), self.max_cpu), mem=min(int(mem), self.max_mem), parents=parents)
+        self.jobs.append(job)
+        return job
+
+    def cancel_dependents(self, failed_job):
+        """Cancels all pending jobs which depend on the failed job, directly or through other jobs"""
+        failed = {failed_job}
+        for job in self.jobs:
+            if job.status == "pending" and failed.intersection(job.parents):
+                job.status = "cancelled"
+                failed.add(job)
+                base_classes.logger.warning(f"Cancelled {job.name} because {failed_job.name} failed")
+
+    def ready_jobs(self):
+        now = time.monotonic()
+        return [
+            job
+            for job in self.jobs
+            if job.status == "pending"
+            and (job.retry_at is None or job.retry_at <= now)
+            and all(parent.status == "done" for parent in job.parents)
+        ]
+
+    def seconds_to_retry(self):
+        """Returns seconds until the next deferred job can be retried, or None if no jobs are waiting to be retried"""
+        now = time.monotonic()
+        retry_times = [
+            job.retry_at
+            for job in self.jobs
+            if job.status == "pending" and job.retry_at is not None and job.retry_at > now
+        ]
+        if not retry_times:
+            return None
+        return min(retry_times) - now
+
+    def run(self):
+        """Runs all jobs, returns list of jobs which failed or were cancelled"""
+        free_cpu, free_mem = self.max_cpu, self.max_mem
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(self.max_cpu, 1)) as executor:
+            while True:
+                for job in self.ready_jobs():
+                    if job.cpu <= free_cpu and job.mem <= free_mem:
+                        free_cpu -= job.cpu
+                        free_mem -= job.mem
+                        job.status = "running"
+                        base_classes.logger.info(f"Starting {job.name}")
+                        running[executor.submit(job.run)] = job
+
+                seconds_to_retry = self.seconds_to_retry()
+                if not running:
+                    if seconds_to_retry is None:
+                        break
+                    time.sleep(seconds_to_retry)
+                    continue
+
+                finished, _ = concurrent.futures.wait(
+                    running, timeout=seconds_to_retry, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    job = running.pop(future)
+                    free_cpu += job.cpu
+                    free_mem += job.mem
+                    if isinstance(future.exception(), Deferred):
+                        job.status = "pending"
+                        job.retry_at = time.monotonic() + self.retry_interval
+                        base_classes.logger.info(f"Deferred {job.name}: {future.exception()}")
+                    elif future.exception():
+                        job.status = "failed"
+                        base_classes.logger.error(f"{job.name} failed: {future.exception()!r}")
+                        self.cancel_dependents(job)
+                    else:
+                        job.status = "done"
+                        base_classes.logger.info(f"Completed {job.name}")
+
+        return [job for job in self.jobs if job.status in ("failed", "cancelled")]
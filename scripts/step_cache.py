@@ -0,0 +1,148 @@
+"""
+Content-addressed cache for caller steps which only depend on their input files, e.g. read counting per BAM
+
+The key for a step is a hash of the docker image, the arguments and the input files in the arguments, including the
+files listed in small text inputs such as a bam.list. The step's own outputs aren't fingerprinted, and resource flags
+such as the java heap are left out so that the key doesn't depend on how many jobs are run at once.
+Paths within the run's output directory are replaced by a placeholder so that the same step in a different
+gene or run has the same key. Outputs are stored as hardlinks (or copies) in output/step-cache/<key>
+and are linked back into the output directory when a step with the same key is run again.
+"""
+
+import hashlib
+import os
+import pathlib
+import shutil
+import tempfile
+import uuid
+
+# files larger than this (e.g. BAMs and the reference genome) are fingerprinted by their size and modification time
+MAX_HASHED_SIZE = 64 * 1024 ** 2
+# text files up to this size are read for the paths of other inputs (e.g. BAMs in a bam.list)
+MAX_LIST_SIZE = 1024 ** 2
+# arguments which only set the resources of the step
+RESOURCE_ARG_PREFIXES = ("-Xmx", "-XX:ConcGCThreads=")
+
+
+class StepCache:
+    def __init__(self, cache_dir, output_base, docker_output_base, get_host_path):
+        """
+        :param cache_dir: directory to store cached outputs in
+        :param output_base: output directory for the run on the host
+        :param docker_output_base: output directory for the run within docker
+        :param get_host_path: function which converts a docker path to the path on the host
+        """
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.output_base = output_base
+        self.docker_output_base = docker_output_base
+        self.get_host_path = get_host_path
+
+    def file_fingerprint(self, path):
+        """Returns hash of file contents with the output directory normalised, or size and mtime for large files"""
+        stat = path.stat()
+        if stat.st_size > MAX_HASHED_SIZE:
+            return f"{stat.st_size}:{stat.st_mtime_ns}"
+        normalised = path.read_bytes()
+        for output_dir in [self.output_base, self.docker_output_base]:
+            normalised = normalised.replace(output_dir.encode(), b"{output_base}")
+        return hashlib.sha256(normalised).hexdigest()
+
+    @staticmethod
+    def listed_paths(path):
+        """Returns the docker paths listed in a small text file, empty if it isn't one"""
+        if path.stat().st_size > MAX_LIST_SIZE:
+            return []
+        try:
+            text = path.read_text()
+        except UnicodeDecodeError:
+            return []
+        return list(dict.fromkeys(token for token in text.split() if token.startswith("/mnt/")))
+
+    def file_and_listed_fingerprint(self, path):
+        """Returns fingerprint of a file and of the paths listed in it, which aren't followed any further"""
+        listed = [
+            (listed_path.replace(self.docker_output_base, "{output_base}"), self.path_fingerprint(listed_path, False))
+            for listed_path in self.listed_paths(path)
+        ]
+        return [self.file_fingerprint(path), listed]
+
+    def path_fingerprint(self, docker_path, follow_lists=True):
+        """Returns fingerprint for a file or directory, None if the argument isn't an existing path"""
+        host_path = pathlib.Path(self.get_host_path(docker_path))
+        fingerprint = self.file_and_listed_fingerprint if follow_lists else self.file_fingerprint
+        if host_path.is_file():
+            return fingerprint(host_path)
+        if host_path.is_dir():
+            files = sorted(path for path in host_path.rglob("*") if path.is_file())
+            return [(f"{path.relative_to(host_path)}", fingerprint(path)) for path in files]
+        return None
+
+    def get_key(self, docker_image, args, docker_outputs=()):
+        """Returns the cache key for running the args in the docker image, without fingerprinting the outputs"""
+        key = hashlib.sha256(docker_image.encode())
+        for arg in args:
+            arg = f"{arg}"
+            if arg.startswith(RESOURCE_ARG_PREFIXES):
+                continue
+            key.update(arg.replace(self.docker_output_base, "{output_base}").encode())
+            # handle flags with values such as --bam=/mnt/bam-input/sample.bam
+            value = arg.split("=", 1)[-1]
+            is_output = any(value == output or value.startswith(f"{output}/") for output in docker_outputs)
+            if value.startswith("/") and not is_output:
+                key.update(f"{self.path_fingerprint(value)}".encode())
+        return key.hexdigest()
+
+    @staticmethod
+    def link_path(source, destination, fallback):
+        """
+        Hardlinks file or directory tree from source to destination, using the fallback if it fails.
+        Existing files at the destination (e.g. from a partial previous run) are replaced
+        """
+        if source.is_dir():
+            destination.mkdir(parents=True, exist_ok=True)
+            for child in source.iterdir():
+                StepCache.link_path(child, destination / child.name, fallback)
+            return
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # linked to a temporary name first and renamed, so an existing file is replaced atomically
+        temp_destination = destination.with_name(f".{destination.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            os.link(source, temp_destination)
+        except OSError:
+            # different filesystem or not allowed to link to files owned by the docker root user
+            fallback(source, temp_destination)
+        os.replace(temp_destination, destination)
+
+    def relative_outputs(self, docker_outputs):
+        relative_paths = []
+        for docker_output in docker_outputs:
+            assert docker_output.startswith(
+                self.docker_output_base
+            ), f"Cached output '{docker_output}' must be within '{self.docker_output_base}'"
+            relative_paths.append(docker_output[len(self.docker_output_base) :].lstrip("/"))
+        return relative_paths
+
+    def restore(self, key, docker_outputs):
+        """Links cached outputs into the output directory, returns True if the step was in the cache"""
+        cached_dir = self.cache_dir / key
+        if not cached_dir.exists():
+            return False
+        for relative_path in self.relative_outputs(docker_outputs):
+            self.link_path(cached_dir / relative_path, pathlib.Path(self.output_base, relative_path), os.symlink)
+        return True
+
+    def store(self, key, docker_outputs):
+        """Stores the outputs of a completed step in the cache"""
+        cached_dir = self.cache_dir / key
+        if cached_dir.exists():
+            return
+        # write to temporary directory first so that the cache never contains partial outputs
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_dir = pathlib.Path(tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp", dir=self.cache_dir))
+        for relative_path in self.relative_outputs(docker_outputs):
+            self.link_path(pathlib.Path(self.output_base, relative_path), temp_dir / relative_path, shutil.copy2)
+        try:
+            os.rename(temp_dir, cached_dir)
+        except OSError:
+            # another caller has stored the same step
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -1,6 +1,16 @@
+import contextlib
 import csv
+import hashlib
+import io
 import os
 import pathlib
+import sqlite3
+import struct
+import zlib
+
+
+# gene name used when each caller is run once on the samples from every gene's sample sheet
+CAPTURE_WIDE = "capture-wide"
 
 
 def get_cnv_patissier_dir():
@@ -8,7 +18,240 @@ def get_cnv_patissier_dir():
     return os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
 
+def get_local_cache_dir():
+    """
+    Returns directory on this host's own disk for caches which are only used by this host's workers,
+    one for each cnv-patissier directory
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    project_hash = hashlib.sha256(get_cnv_patissier_dir().encode()).hexdigest()[:12]
+    cache_dir = f"{cache_home}/cnv-patissier/{project_hash}"
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_capture_genes(capture):
+    """Returns sorted list of genes which have a sample sheet for the capture"""
+    sample_sheet_path = pathlib.Path(get_cnv_patissier_dir(), "input", capture, "sample-sheets")
+    return sorted(path.stem for path in sample_sheet_path.glob("*.txt"))
+
+
+def get_sample_sheet_path(capture, gene):
+    """Returns path to the gene's sample sheet, or the merged sample sheet when running capture-wide"""
+    if gene == CAPTURE_WIDE:
+        return f"{get_cnv_patissier_dir()}/output/{capture}/sample-sheets/{CAPTURE_WIDE}.txt"
+    return f"{get_cnv_patissier_dir()}/input/{capture}/sample-sheets/{gene}.txt"
+
+
+class BgzfReader:
+    """Reads decompressed data from a BGZF file (e.g. BAM) one block at a time"""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.buffer = b""
+
+    def read_block(self):
+        """Returns decompressed data from the next BGZF block, None at the end of the file"""
+        header = self.handle.read(12)
+        if not header:
+            return None
+        id1, id2, compression_method, flags, _, _, _, extra_length = struct.unpack("<BBBBIBBH", header)
+        if (id1, id2, compression_method) != (31, 139, 8) or not flags & 4:
+            raise Exception(f"{self.handle.name} is not a BGZF file")
+
+        extra = self.handle.read(extra_length)
+        block_size = None
+        offset = 0
+        while offset < extra_length:
+            subfield_id, subfield_length = extra[offset : offset + 2], struct.unpack_from("<H", extra, offset + 2)[0]
+            if subfield_id == b"BC":
+                block_size = struct.unpack_from("<H", extra, offset + 4)[0] + 1
+            offset += 4 + subfield_length
+        if block_size is None:
+            raise Exception(f"{self.handle.name} has a block without a BGZF block size")
+
+        compressed = self.handle.read(block_size - extra_length - 20)
+        crc, uncompressed_size = struct.unpack("<II", self.handle.read(8))
+        data = zlib.decompress(compressed, -15)
+        if len(data) != uncompressed_size or zlib.crc32(data) != crc:
+            raise Exception(f"{self.handle.name} has a corrupt BGZF block")
+        return data
+
+    def read(self, size):
+        """Returns the next size bytes of decompressed data"""
+        while len(self.buffer) < size:
+            block = self.read_block()
+            if block is None:
+                raise Exception(f"{self.handle.name} ended unexpectedly")
+            self.buffer += block
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class BamUtils:
+    @classmethod
+    def read_header(cls, bam_path):
+        """Returns the header text of a BAM file, like `samtools view -H`"""
+        with open(bam_path, "rb") as handle:
+            reader = BgzfReader(handle)
+            if reader.read(4) != b"BAM\1":
+                raise Exception(f"{bam_path} is not a BAM file")
+            text_length = struct.unpack("<i", reader.read(4))[0]
+            header = reader.read(text_length).rstrip(b"\0").decode()
+            if not header:
+                # samtools writes the reference sequences when there is no header text
+                reference_count = struct.unpack("<i", reader.read(4))[0]
+                for _ in range(reference_count):
+                    name_length = struct.unpack("<i", reader.read(4))[0]
+                    name = reader.read(name_length).rstrip(b"\0").decode()
+                    reference_length = struct.unpack("<i", reader.read(4))[0]
+                    header += f"@SQ\tSN:{name}\tLN:{reference_length}\n"
+        return header
+
+    @classmethod
+    def get_sample_name(cls, header):
+        """Returns the SM tag from the read group in the header, None if there isn't one"""
+        sample_name = None
+        for line in header.splitlines():
+            if line.startswith("@RG"):
+                for field_value in line.split("\t"):
+                    if field_value.startswith("SM:"):
+                        sample_name = field_value[3:].strip()
+        return sample_name
+
+    @classmethod
+    def check_index(cls, bam_path):
+        """Raises Exception if the BAM doesn't have an index, or the index is older than the BAM"""
+        bam = pathlib.Path(bam_path)
+        index_paths = [pathlib.Path(f"{bam}.bai"), bam.with_suffix(".bai")]
+        indexes = [index for index in index_paths if index.exists()]
+        if not indexes:
+            raise Exception(f"No index found for {bam}, please index the BAM file")
+        if indexes[0].stat().st_mtime < bam.stat().st_mtime:
+            raise Exception(f"Index {indexes[0]} is older than {bam}, please re-index or touch the index")
+
+
+class DisposableCache:
+    """
+    Sqlite cache which only holds values that can be worked out again, kept on local disk (see get_local_cache_dir)
+    because sqlite locking isn't reliable on network filesystems. If the file can't be read it is deleted and
+    recreated, and if it is locked for too long the cache is skipped
+    """
+
+    create_table = None
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        try:
+            self.create()
+        except sqlite3.DatabaseError as error:
+            self.discard(error)
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    def create(self):
+        with contextlib.closing(self.connect()) as connection, connection:
+            connection.execute(self.create_table)
+
+    def discard(self, error):
+        """Handles an error from the cache, recreating the cache unless the error was it being locked"""
+        if isinstance(error, sqlite3.OperationalError) and "locked" in f"{error}":
+            return
+        for suffix in ["", "-journal", "-wal", "-shm"]:
+            if os.path.exists(f"{self.db_path}{suffix}"):
+                os.remove(f"{self.db_path}{suffix}")
+        self.create()
+
+
+class BamHeaderCache(DisposableCache):
+    """
+    Persistent cache of BAM headers and their SM tag, so that BAMs are only read again if they have changed.
+    BAMs are identified by their path, size, modification time and inode
+    """
+
+    create_table = (
+        "CREATE TABLE IF NOT EXISTS bam_headers "
+        "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, header TEXT, sample_name TEXT)"
+    )
+
+    def get_header(self, bam_path):
+        """Returns (header, sample_name) for the BAM, reading the BAM only if it isn't in the cache"""
+        path = f"{pathlib.Path(bam_path).resolve()}"
+        stat = os.stat(path)
+        file_key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        try:
+            with contextlib.closing(self.connect()) as connection:
+                cached = connection.execute(
+                    "SELECT size, mtime_ns, inode, header, sample_name FROM bam_headers WHERE path = ?", (path,)
+                ).fetchone()
+        except sqlite3.DatabaseError as error:
+            self.discard(error)
+            cached = None
+        if cached and tuple(cached[:3]) == file_key:
+            return cached[3], cached[4]
+
+        header = BamUtils.read_header(path)
+        sample_name = BamUtils.get_sample_name(header)
+        try:
+            with contextlib.closing(self.connect()) as connection, connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO bam_headers VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, *file_key, header, sample_name),
+                )
+        except sqlite3.DatabaseError as error:
+            self.discard(error)
+        return header, sample_name
+
+
+class CompletionManifest(DisposableCache):
+    """
+    Fingerprint of the inputs for each caller and gene which completed, so that they can be skipped without building
+    the caller. An entry is only used while the successful run settings file is unchanged, so deleting the file still
+    forces a rerun. Each host has its own manifest, callers which aren't in it are built and checked as usual
+    """
+
+    create_table = (
+        "CREATE TABLE IF NOT EXISTS completed_runs (capture TEXT, caller TEXT, gene TEXT, fingerprint TEXT, "
+        "settings_path TEXT, settings_size INTEGER, settings_mtime_ns INTEGER, PRIMARY KEY (capture, caller, gene))"
+    )
+
+    def is_complete(self, capture, caller, gene, fingerprint):
+        """Returns True if the caller completed with the same fingerprint and its settings file hasn't changed"""
+        try:
+            with contextlib.closing(self.connect()) as connection:
+                completed = connection.execute(
+                    "SELECT fingerprint, settings_path, settings_size, settings_mtime_ns FROM completed_runs "
+                    "WHERE capture = ? AND caller = ? AND gene = ?",
+                    (capture, caller, gene),
+                ).fetchone()
+        except sqlite3.DatabaseError as error:
+            self.discard(error)
+            return False
+        if not completed or completed[0] != fingerprint:
+            return False
+        try:
+            stat = os.stat(completed[1])
+        except FileNotFoundError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == tuple(completed[2:])
+
+    def record(self, capture, caller, gene, fingerprint, settings_path):
+        stat = os.stat(settings_path)
+        try:
+            with contextlib.closing(self.connect()) as connection, connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO completed_runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (capture, caller, gene, fingerprint, settings_path, stat.st_size, stat.st_mtime_ns),
+                )
+        except sqlite3.DatabaseError as error:
+            self.discard(error)
+
+
 class SampleUtils:
+    # result types of the samples which are run, in order of priority when merging sample sheets
+    result_types = ["normal-panel", "normal", "positive"]
+
     @classmethod
     def check_files(cls, paths):
         """ Takes in a list of paths and raises Exception if:
@@ -71,6 +314,45 @@ class SampleUtils:
             assert len(output_ids) >= 30, "There must be 30 normal-panel samples in the sample sheet"
         return output_ids, output_paths
 
+    @classmethod
+    def merge_sample_sheets(cls, sample_sheets, output_path):
+        """
+        Writes a single sample sheet with every sample from the sample sheets
+        A sample is an unknown if it is an unknown in any of the sample sheets, otherwise it is in the normal panel
+        Rows with any other result type are skipped, as they are by select_samples
+        """
+        result_types = cls.result_types
+        samples = {}
+        for sample_sheet in sample_sheets:
+            with open(sample_sheet) as handle:
+                for sample in csv.DictReader(handle, delimiter="\t"):
+                    if not (sample["sample_id"] and sample["sample_path"]):
+                        continue
+                    if sample["result_type"] not in result_types:
+                        continue
+                    sample_id, sample_path = sample["sample_id"].strip(), sample["sample_path"].strip()
+                    previous_path, previous_type = samples.get(sample_id, (sample_path, "normal-panel"))
+                    if previous_path != sample_path:
+                        raise Exception(
+                            f"Sample {sample_id} has different paths in the sample sheets:\n "
+                            f"{previous_path}\n {sample_path}"
+                        )
+                    result_type = max(previous_type, sample["result_type"], key=result_types.index)
+                    samples[sample_id] = (sample_path, result_type)
+
+        merged = io.StringIO()
+        writer = csv.writer(merged, delimiter="\t", lineterminator="\n")
+        writer.writerow(["sample_id", "sample_path", "result_type"])
+        for sample_id, (sample_path, result_type) in sorted(samples.items()):
+            writer.writerow([sample_id, sample_path, result_type])
+
+        # only written if it has changed, so completed callers can be skipped using its modification time
+        output = pathlib.Path(output_path)
+        if output.exists() and output.read_text() == merged.getvalue():
+            return
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(merged.getvalue())
+
     @classmethod
     def get_mount_point(cls, paths):
         """Returns common root path for a list of paths"""
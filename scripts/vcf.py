@@ -0,0 +1,96 @@
+"""
+Streaming reader for CNV calls in VCF v4.0 - v4.2 files
+
+Records are read one line at a time from plain or gzip compressed files. The sample's FORMAT data is decoded first
+so that records with the reference copy number (CN=2, or a GT of 0 or missing) are skipped before INFO is decoded.
+"""
+
+import gzip
+
+fields = ["chrom", "pos", "id", "ref", "alt", "qual", "filter", "info", "format"]
+
+
+def open_vcf(vcf_path):
+    """Opens VCF for reading as text, decompressing it if the path ends with .gz"""
+    if f"{vcf_path}".endswith(".gz"):
+        return gzip.open(vcf_path, "rt")
+    return open(vcf_path, "r")
+
+
+def parse_info(info):
+    info_data = {}
+    for info_field in info.split(";"):
+        try:
+            field, value = info_field.split("=")
+        except ValueError as e:
+            if info_field and info_field != "IMPRECISE":
+                raise e
+            elif info_field:
+                field, value = ["calling", "IMPRECISE"]
+            else:
+                # empty value so just skip field
+                continue
+        info_data[field] = value
+    return info_data
+
+
+def get_alt(format_data):
+    """Returns DEL or DUP from the copy number (CN) or genotype (GT), None for a reference call"""
+    if "CN" in format_data:  # copy number is copy info
+        copy_number = int(format_data["CN"])
+        if copy_number < 2:
+            return "DEL"
+        elif copy_number > 2:
+            return "DUP"
+        return None
+    # genotype gives copy number info as a string
+    genotype = format_data["GT"]
+    if genotype == "1":
+        return "DEL"
+    elif genotype == "2":
+        return "DUP"
+    return None
+
+
+def parse_call(row, format_keys, sample_data, sample_id):
+    """Returns CNV dictionary for one sample's data in a record, or None if the sample has the reference copy number"""
+    format_data = dict(zip(format_keys, sample_data.split(":")))
+    alt = get_alt(format_data)
+    if not alt:
+        return None
+    cnv = {field: value for (field, value) in zip(fields, row) if field not in ("pos", "info", "format")}
+    info_data = parse_info(row[7])
+    cnv["start"] = row[1]
+    cnv["alt"] = alt
+    return {**cnv, "end": info_data["END"], "sample_id": sample_id, "format_data": format_data, "info_data": info_data}
+
+
+def iter_cnvs(input_vcf, sample_id):
+    """Yields CNVs from the first sample column of a VCF, input_vcf is an iterable of lines"""
+    for line in input_vcf:
+        line = line.rstrip("\r\n")
+        if line.startswith("#") or not line:
+            continue
+        row = line.split("\t")
+        cnv = parse_call(row, row[8].split(":"), row[9], sample_id)
+        if cnv:
+            yield cnv
+
+
+def iter_sample_cnvs(input_vcf, sample_ids):
+    """Yields CNVs for each of the sample_ids from a multi-sample VCF, sample columns are found from the header"""
+    sample_columns = []
+    for line in input_vcf:
+        line = line.rstrip("\r\n")
+        if line.startswith("#CHROM"):
+            header = line.split("\t")
+            sample_columns = [(header.index(sample_id), sample_id) for sample_id in sample_ids if sample_id in header]
+            continue
+        if line.startswith("#") or not line:
+            continue
+        row = line.split("\t")
+        format_keys = row[8].split(":")
+        for column, sample_id in sample_columns:
+            cnv = parse_call(row, format_keys, row[column], sample_id)
+            if cnv:
+                yield cnv
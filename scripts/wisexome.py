@@ -17,11 +17,13 @@ from . import base_classes
 
 
 class WISExome(base_classes.BaseCNVTool):
+    docker_image = "stefpiatek/wisexome:latest"
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.run_type = "wisexome"
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
         self.extra_db_fields = []
-        self.settings = {**self.settings, "docker_image": "stefpiatek/wisexome:latest"}
+        self.settings = {**self.settings, "docker_image": self.docker_image}
 
     def parse_output_file(self, file_path, sample_id):
         cnvs = []
@@ -11,21 +11,24 @@ Defaults used from XHMM documentation https://atgu.mgh.harvard.edu/xhmm/tutorial
 """
 
 import subprocess
-import time
 import os
 
-from . import utils, base_classes
+from . import utils, base_classes, vcf
 
 
 class XHMM(base_classes.BaseCNVTool):
+    docker_image = "stefpiatek/xhmm:1.0"
+
     def __init__(self, capture, gene, start_time, normal_panel=True):
         self.run_type = "xhmm"
         super().__init__(capture, gene, start_time, normal_panel=normal_panel)
         self.extra_db_fields = ["id", "ref", "qual", "filter", "format_data", "info_data"]
-        self.settings = {**self.settings, "docker_image": "stefpiatek/xhmm:1.0"}
+        self.settings = {**self.settings, "docker_image": self.docker_image}
 
-    def run_gatk_command(self, args):
-        """Create dir for output and runs a GATK command in the XHMM docker"""
+    def run_gatk_command(self, args, cache_outputs=None):
+        """
+        Create dir for output and runs a GATK command in the XHMM docker, cache_outputs are reused for identical inputs
+        """
         try:
             os.makedirs(f"{self.output_base}/{args[0]}")
         except FileExistsError:
@@ -34,41 +37,35 @@ class XHMM(base_classes.BaseCNVTool):
         base_classes.logger.info(f"Running  GATK step of XHMM: {args[0]} \n output: {args[-1]}")
         self.run_docker_subprocess(
             [
-                "java",
-                f"-Xmx{self.max_mem}g",
-                f"-XX:ConcGCThreads={self.max_cpu}",
+                *self.java_args(),
                 "-jar",
                 "GenomeAnalysisTK.jar",
                 "-T",
                 *args,
-            ]
+            ],
+            cache_outputs=cache_outputs,
         )
         base_classes.logger.info(f"Completed  GATK step of XHMM: {args[0]} {args[-1]}")
 
-    def parse_output_file(self, file_path, sample_id):
-        if "PYTEST_CURRENT_TEST" in os.environ.keys():
-            docker_file_path = file_path.replace(f"{base_classes.cnv_pat_dir}/tests", "/mnt")
-        else:
-            docker_file_path = file_path.replace(base_classes.cnv_pat_dir, "/mnt")
-
-        if not os.path.exists(f"{file_path}.gz.tbi"):
-            self.run_docker_subprocess(["bgzip", docker_file_path], docker_image="lethalfang/tabix:1.7")
-            self.run_docker_subprocess(
-                ["tabix", "-p", "vcf", f"{docker_file_path}.gz"], docker_image="lethalfang/tabix:1.7"
-            )
-
-        sample_vcf = self.run_docker_subprocess(
-            ["bcftools", "view", "-c1", "-Ov", "--force-samples", "-s", sample_id, f"{docker_file_path}.gz"],
-            docker_image="halllab/bcftools:v1.9",
-            stdout=subprocess.PIPE,
-        )
-        # avoid Error response from daemon: containerd: container did not start before the specified timeout.
-        time.sleep(5)
-
-        vcf_data = str(sample_vcf.stdout, "utf-8").split("\n")
-        cnvs = self.parse_vcf(vcf_data, sample_id)
-
-        return cnvs
+    def demultiplex_output_file(self, file_path, sample_ids):
+        """
+        Reads XHMM's multi-sample VCF once, returning the calls for each sample.
+        Gives the same output as subsetting each sample with `bcftools view -c1 -s`,
+        so AC and AN are recalculated for the sample and float INFO values are normalised
+        """
+        sample_cnvs = {sample_id: [] for sample_id in sample_ids}
+        with vcf.open_vcf(file_path) as handle:
+            for cnv in vcf.iter_sample_cnvs(handle, sample_ids):
+                info_data = cnv["info_data"]
+                alleles = [allele for allele in cnv["format_data"]["GT"].replace("|", "/").split("/") if allele != "."]
+                alt_numbers = range(1, len(info_data["AC"].split(",")) + 1)
+                info_data["AC"] = ",".join(f"{alleles.count(f'{alt_number}')}" for alt_number in alt_numbers)
+                info_data["AN"] = f"{len(alleles)}"
+                for field in ["AF", "GQT"]:
+                    if field in info_data:
+                        info_data[field] = ",".join(f"{float(value):g}" for value in info_data[field].split(","))
+                sample_cnvs[cnv["sample_id"]].append(cnv)
+        return sample_cnvs
 
     def run_xhmm_command(self, args):
         """Runs xhmm command in docker"""
@@ -77,7 +74,10 @@ class XHMM(base_classes.BaseCNVTool):
         base_classes.logger.info(f"Completed  XHMM: {args[0]} {args[-1]}")
 
     def run_workflow(self):
-        os.makedirs(f"{self.output_base}")
+        try:
+            os.makedirs(f"{self.output_base}")
+        except FileExistsError:
+            pass
 
         all_bams = self.settings["unknown_bams"] + self.settings["normal_bams"]
         with open(f"{self.output_base}/bam.list", "w") as handle:
@@ -118,7 +118,9 @@ class XHMM(base_classes.BaseCNVTool):
                 "COUNT_FRAGMENTS",
                 "-o",
                 depth_out,
-            ]
+            ],
+            # output is used as a prefix for several files
+            cache_outputs=[f"{self.docker_output_base}/DepthOfCoverage"],
         )
 
         xhmm_read_depth_out = f"{self.docker_output_base}/DATA.RD.txt"
@@ -136,7 +138,8 @@ class XHMM(base_classes.BaseCNVTool):
                 self.settings["ref_fasta"],
                 "-o",
                 gc_content_out,
-            ]
+            ],
+            cache_outputs=[gc_content_out],
         )
 
         extreme_gc_out = f"{self.docker_output_base}/extreme_gc_targets.txt"
@@ -0,0 +1,9 @@
+cnv_pat_settings = {
+    "genome_fasta_path": "/var/reference_sequences/hg19/genome.fa",
+    "max_cpu": "30",
+    "max_mem": "50",
+    "max_jobs": 1,  # number of callers run at the same time, max_cpu and max_mem are split between them
+    "http_proxy": None, # None or following pattern "http://192.168.1.1:8080/"
+    "genome_build_name": "hg19",
+    "chromosome_prefix": "chr",  # "" or "chr"
+}
@@ -1,7 +1,6 @@
 import datetime
 import json
 import os
-import subprocess
 
 import pytest
 
@@ -12,15 +11,6 @@ from scripts.base_classes import Queries, BaseCNVTool
 # global application scope.  create Session class, engine
 
 
-@pytest.yield_fixture(scope="class")
-def cleanup_after_xhmm():
-    vcf_path = "tests/test_files/output_parsing/xhmm/DATA.vcf"
-    yield
-    # teardown
-    subprocess.run(["gunzip", f"{vcf_path}.gz"], check=True)
-    subprocess.run(["rm", f"{vcf_path}.gz.tbi"], check=True)
-
-
 @pytest.yield_fixture(scope="class")
 def db():
     """Session-wide test database."""
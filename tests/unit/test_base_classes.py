@@ -1,10 +1,15 @@
+import os
 import pathlib
+import shutil
 import subprocess
+import tempfile
 
 import pytest
+import toml
 
 from scripts.base_classes import BaseCNVTool
-from scripts import models, utils
+from scripts.records import CalledCNVRecord
+from scripts import base_classes, checkpoints, containers, executors, leases, models, utils
 
 cnv_pat_dir = utils.get_cnv_patissier_dir()
 
@@ -23,11 +28,11 @@ class TestCheckChromPrefix:
         self.caller.check_chrom_prefix("tests/test_files/input/bed/chr-prefix.bed")
 
     def test_chr_prefix_mismatch(self):
-        with pytest.raises(Exception):
+        with pytest.raises(Exception, match="BED file contains line which has an invalid chromosome"):
             self.caller.check_chrom_prefix("tests/test_files/input/bed/no-prefix.bed")
 
     def test_blank_lines(self):
-        with pytest.raises(Exception):
+        with pytest.raises(Exception, match="BED file contains line which has an invalid chromosome"):
             self.caller.check_chrom_prefix("tests/test_files/input/bed/chr-prefix_blank.bed")
 
     def test_no_prefix_working(self):
@@ -36,12 +41,13 @@ class TestCheckChromPrefix:
 
     def test_no_prefix_mismatch(self):
         self.caller.settings = {"chromosome_prefix": ""}
-        with pytest.raises(Exception):
+        with pytest.raises(Exception, match="BED file contains line which has an invalid chromosome"):
             self.caller.check_chrom_prefix("tests/test_files/input/bed/chr-prefix.bed")
 
     def test_header(self):
         self.caller.settings = {"chromosome_prefix": ""}
-        with pytest.raises(Exception):
+        expected_message = "BED file contains line which has an invalid chromosome:\nLine number: 1\n"
+        with pytest.raises(Exception, match=expected_message):
             self.caller.check_chrom_prefix("tests/test_files/input/bed/no-prefix_header.bed")
 
 
@@ -51,6 +57,7 @@ class TestFilterCNVs:
         self.caller = BaseCNVTool("capture", "gene", "time")
         self.caller.run_type = "example_type"
         self.caller.extra_db_fields = ["extra"]
+        self.call = {"alt": "DEL", "sample_id": "sample"}
         self.gene_bed = [
             "chr1\t1000\t1500\tgene",
             "chr1\t2000\t2500\tgene",
@@ -59,45 +66,45 @@ class TestFilterCNVs:
         ]
 
     def test_filter_out(self):
-        chrom_mismatch = dict(chrom="chr21", start="1000", end="1500", extra="dummy")
-        outside_start_end = dict(chrom="chr17", start="2000", end="2500", extra="dummy")
+        chrom_mismatch = dict(chrom="chr21", start="1000", end="1500", extra="dummy", **self.call)
+        outside_start_end = dict(chrom="chr17", start="2000", end="2500", extra="dummy", **self.call)
         filtered = self.caller.filter_cnvs([chrom_mismatch, outside_start_end], self.gene_bed)
         assert filtered == []
 
     def test_filter_within(self):
 
-        within = dict(chrom="chr17", start="1200", end="1300", extra="dummy")
+        within = dict(chrom="chr17", start="1200", end="1300", extra="dummy", **self.call)
         within_filtered = self.caller.filter_cnvs([within], self.gene_bed)
 
-        start_within = dict(chrom="chr17", start="1200", end="2000", extra="dummy")
+        start_within = dict(chrom="chr17", start="1200", end="2000", extra="dummy", **self.call)
         start_within_filtered = self.caller.filter_cnvs([start_within], self.gene_bed)
 
-        end_within = dict(chrom="chr17", start="500", end="1200", extra="dummy")
+        end_within = dict(chrom="chr17", start="500", end="1200", extra="dummy", **self.call)
         end_within_filtered = self.caller.filter_cnvs([end_within], self.gene_bed)
 
-        assert within_filtered[0]["start"] == "1200"
-        assert start_within_filtered[0]["start"] == "1200"
-        assert end_within_filtered[0]["end"] == "1200"
+        assert within_filtered[0].start == 1200
+        assert start_within_filtered[0].start == 1200
+        assert end_within_filtered[0].end == 1200
 
     def test_filter_span(self):
-        span = dict(chrom="chr1", start="500", end="1600", extra="dummy")
+        span = dict(chrom="chr1", start="500", end="1600", extra="dummy", **self.call)
         span_filtered = self.caller.filter_cnvs([span], self.gene_bed)
 
-        span_multiple = dict(chrom="chr1", start="500", end="4000", extra="dummy")
+        span_multiple = dict(chrom="chr1", start="500", end="4000", extra="dummy", **self.call)
         span_multiple_filtered = self.caller.filter_cnvs([span_multiple], self.gene_bed)
 
-        assert span_filtered[0]["start"] == "500"
+        assert span_filtered[0].start == 500
         assert len(span_multiple_filtered) == 1
-        assert span_multiple_filtered[0]["start"] == "500"
+        assert span_multiple_filtered[0].start == 500
 
     def test_multiple_cnvs(self):
-        span_multiple = dict(chrom="chr1", start="500", end="4000", extra="dummy")
-        within = dict(chrom="chr17", start="1200", end="1300", extra="dummy")
+        span_multiple = dict(chrom="chr1", start="500", end="4000", extra="dummy", **self.call)
+        within = dict(chrom="chr17", start="1200", end="1300", extra="dummy", **self.call)
 
         filtered = self.caller.filter_cnvs([span_multiple, within], self.gene_bed)
         assert len(filtered) == 2
-        assert filtered[0]["chrom"] == "chr1"
-        assert filtered[1]["chrom"] == "chr17"
+        assert filtered[0].chrom == "chr1"
+        assert filtered[1].chrom == "chr17"
 
     def test_extra_fields(self):
         dummy = {
@@ -106,10 +113,9 @@ class TestFilterCNVs:
             "key2": "val2",
             "key3": "val3",
         }
-        within = dict(chrom="chr17", start="1200", end="1300", extra=dummy)
+        within = dict(chrom="chr17", start="1200", end="1300", extra=dummy, **self.call)
         filtered = self.caller.filter_cnvs([within], self.gene_bed)
-        print(filtered[0])
-        assert filtered[0]["json_data"]["extra"] == dummy
+        assert filtered[0].extra["extra"] == dummy
 
 
 @pytest.mark.usefixtures("db", "db_session")
@@ -151,6 +157,207 @@ class TestGetMd5sum:
             output = self.caller.get_md5sum("does_not_exist.txt")
 
 
+class TestAddedUnknowns:
+    def setup(self):
+        self.settings_path = f"{cnv_pat_dir}/tests/test_files/input/checks/incremental.toml"
+        self.caller = BaseCNVTool("capture", "gene", "time_2")
+        self.caller.incremental_unknowns = True
+        self.caller.settings = {
+            "normal_bams": ["/mnt/bam-input/normal.bam"],
+            "start_time": "time_2",
+            "sample_sheet_md5sum": "new",
+            "unknown_bams": ["/mnt/bam-input/sample_1.bam", "/mnt/bam-input/sample_2.bam"],
+            "unknown_samples": {"sample_1": "/mnt/bam-input/sample_1.bam", "sample_2": "/mnt/bam-input/sample_2.bam"},
+        }
+        self.previous_settings = {
+            **self.caller.settings,
+            "start_time": "time_1",
+            "sample_sheet_md5sum": "old",
+            "unknown_bams": ["/mnt/bam-input/sample_1.bam"],
+            "unknown_samples": {"sample_1": "/mnt/bam-input/sample_1.bam"},
+        }
+
+    def teardown(self):
+        os.remove(self.settings_path)
+
+    def write_previous_settings(self, **changes):
+        with open(self.settings_path, "w") as handle:
+            toml.dump({**self.previous_settings, **changes}, handle)
+
+    def test_added_unknown(self):
+        self.write_previous_settings()
+        assert self.caller.settings_changed(self.settings_path)
+        assert self.caller.get_added_unknowns(self.settings_path) == ["/mnt/bam-input/sample_2.bam"]
+
+    def test_changed_bam(self):
+        self.write_previous_settings(
+            unknown_bams=["/mnt/bam-input/old_1.bam", "/mnt/bam-input/sample_2.bam"],
+            unknown_samples={"sample_1": "/mnt/bam-input/old_1.bam", "sample_2": "/mnt/bam-input/sample_2.bam"},
+        )
+        assert self.caller.get_added_unknowns(self.settings_path) == ["/mnt/bam-input/sample_1.bam"]
+
+    def test_removed_unknown(self):
+        self.write_previous_settings(
+            unknown_bams=["/mnt/bam-input/sample_0.bam", "/mnt/bam-input/sample_1.bam"],
+            unknown_samples={"sample_0": "/mnt/bam-input/sample_0.bam", "sample_1": "/mnt/bam-input/sample_1.bam"},
+        )
+        assert self.caller.get_added_unknowns(self.settings_path) is None
+
+    def test_removed_bam_without_samples(self):
+        previous_settings = {**self.previous_settings, "unknown_bams": ["/mnt/bam-input/old_1.bam"]}
+        previous_settings.pop("unknown_samples")
+        with open(self.settings_path, "w") as handle:
+            toml.dump(previous_settings, handle)
+        assert self.caller.get_added_unknowns(self.settings_path) is None
+
+    def test_other_settings_changed(self):
+        self.write_previous_settings(normal_bams=["/mnt/bam-input/other.bam"])
+        assert self.caller.get_added_unknowns(self.settings_path) is None
+
+    def test_not_incremental(self):
+        self.write_previous_settings()
+        self.caller.incremental_unknowns = False
+        assert self.caller.get_added_unknowns(self.settings_path) is None
+
+    def test_run_added_unknowns(self, monkeypatch):
+        self.write_previous_settings()
+        self.caller.added_unknowns = self.caller.get_added_unknowns(self.settings_path)
+        run_bams = []
+        monkeypatch.setattr(self.caller, "run_workflow", lambda: run_bams.extend(self.caller.settings["unknown_bams"]))
+
+        self.caller.run_added_unknowns()
+        assert run_bams == ["/mnt/bam-input/sample_2.bam"]
+        assert len(self.caller.settings["unknown_bams"]) == 2
+
+
+class TestIsComplete:
+    def setup(self):
+        self.settings_path = f"{cnv_pat_dir}/tests/test_files/input/checks/BRCA1.toml"
+        with open(self.settings_path, "w") as handle:
+            handle.write('gene = "BRCA1"\n')
+        manifest_path = f"{cnv_pat_dir}/tests/test_files/input/checks/completion-manifest.sqlite"
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        self.manifest = utils.CompletionManifest(manifest_path)
+
+    def teardown(self):
+        os.remove(self.settings_path)
+
+    def test_is_complete(self, monkeypatch):
+        monkeypatch.setattr(base_classes, "completion_manifest", self.manifest)
+        assert not BaseCNVTool.is_complete("ICR_example", "BRCA1")
+
+        fingerprint = BaseCNVTool.get_completion_fingerprint("ICR_example", "BRCA1")
+        self.manifest.record("ICR_example", "BaseCNVTool", "BRCA1", fingerprint, self.settings_path)
+        assert BaseCNVTool.is_complete("ICR_example", "BRCA1")
+        assert not BaseCNVTool.is_complete("ICR_example", "BRCA2")
+
+    def test_case_after_cohort_rerun(self, monkeypatch):
+        class CaseCaller(BaseCNVTool):
+            normal_panel_run_type = "caller_cohort"
+
+        temp_dir = tempfile.mkdtemp()
+        monkeypatch.setattr(base_classes, "completion_manifest", self.manifest)
+        monkeypatch.setattr(base_classes, "cnv_pat_dir", temp_dir)
+        cohort_settings = pathlib.Path(f"{temp_dir}/successful-run-settings/ICR_example/caller_cohort/BRCA1.toml")
+        cohort_settings.parent.mkdir(parents=True)
+        cohort_settings.write_text('start_time = "time_1"\n')
+
+        fingerprint = CaseCaller.get_completion_fingerprint("ICR_example", "BRCA1")
+        self.manifest.record("ICR_example", "CaseCaller", "BRCA1", fingerprint, self.settings_path)
+        assert CaseCaller.is_complete("ICR_example", "BRCA1")
+
+        cohort_settings.write_text('start_time = "time_2"\nend_time = "time_3"\n')
+        assert not CaseCaller.is_complete("ICR_example", "BRCA1")
+        shutil.rmtree(temp_dir)
+
+    def test_fingerprint_uses_settings(self, monkeypatch):
+        fingerprint = BaseCNVTool.get_completion_fingerprint("ICR_example", "BRCA1")
+        monkeypatch.setitem(base_classes.cnv_pat_settings, "chromosome_prefix", "other")
+        assert BaseCNVTool.get_completion_fingerprint("ICR_example", "BRCA1") != fingerprint
+
+
+class TestMain:
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.messages = []
+        self.sink_id = base_classes.logger.add(self.messages.append, level="INFO")
+
+    def teardown(self):
+        base_classes.logger.remove(self.sink_id)
+        shutil.rmtree(self.temp_dir)
+
+    def test_lease_held(self, monkeypatch):
+        monkeypatch.setattr(base_classes, "cnv_pat_dir", self.temp_dir)
+        caller = BaseCNVTool("capture", "gene", "time")
+        caller.run_type = "caller"
+        lease_path = f"{self.temp_dir}/output/leases/capture/caller/gene.lease"
+        other_worker = leases.Lease(lease_path, timeout=60)
+        assert other_worker.acquire()
+
+        with pytest.raises(leases.LeaseHeld):
+            caller.main()
+        other_worker.release()
+
+        levels = [message.record["level"].name for message in self.messages]
+        assert levels == ["INFO"]
+        assert "is being run by another worker" in self.messages[0]
+
+
+class TestRunDockerSubprocess:
+    def setup(self):
+        self.caller = BaseCNVTool("capture", "gene", "time")
+        self.caller.settings["docker_image"] = "image:1.0"
+        self.caller.max_cpu, self.caller.max_mem = "2", "4"
+        self.caller.bam_mount = "/bams/"
+        bam_mount_handler = lambda args, mounts: f"{mounts['/mnt/bam-input/'][0]}\n".encode()
+        self.executor = executors.MockExecutor(handlers={"tool": bam_mount_handler})
+
+    def test_mock_executor(self, monkeypatch):
+        monkeypatch.setattr(executors, "executor", self.executor)
+        process = self.caller.run_docker_subprocess(["tool", "arg"], stdout=subprocess.PIPE)
+
+        assert process.stdout == b"/bams/\n"
+        assert self.executor.calls == [("image:1.0", ["tool", "arg"])]
+        assert self.caller.resource_profile() == containers.ResourceProfile(cpu=2, mem=4)
+
+    def test_stream(self, monkeypatch):
+        monkeypatch.setattr(executors, "executor", self.executor)
+        with self.caller.stream_docker_subprocess(["tool"], docker_image="other:1.0") as lines:
+            assert list(lines) == ["/bams/\n"]
+        assert self.executor.calls == [("other:1.0", ["tool"])]
+
+    def test_skips_completed_steps(self, monkeypatch):
+        monkeypatch.setattr(executors, "executor", self.executor)
+        self.caller.output_base = tempfile.mkdtemp()
+        self.caller.step_journal = checkpoints.StepJournal(self.caller.output_base, lambda path: path, {})
+        output_path = f"{self.caller.output_base}/output.txt"
+
+        def write_output(args, mounts):
+            pathlib.Path(output_path).write_text("output")
+            return b""
+
+        self.executor.handlers["write"] = write_output
+
+        self.caller.run_docker_subprocess(["write", output_path])
+        self.caller.run_docker_subprocess(["write", output_path])
+        self.caller.run_docker_subprocess(["tool"], stdout=subprocess.PIPE)
+        self.caller.run_docker_subprocess(["tool"], stdout=subprocess.PIPE)
+
+        assert self.executor.calls == [("image:1.0", ["write", output_path]), *[("image:1.0", ["tool"])] * 2]
+        shutil.rmtree(self.caller.output_base)
+
+    def test_stops_when_lease_lost(self, monkeypatch):
+        monkeypatch.setattr(executors, "executor", self.executor)
+        self.caller.lease = leases.Lease(f"{tempfile.gettempdir()}/unused.lease", timeout=60)
+        self.caller.run_docker_subprocess(["tool"], stdout=subprocess.PIPE)
+        self.caller.lease.lost.set()
+
+        with pytest.raises(leases.LeaseLost):
+            self.caller.run_docker_subprocess(["tool"], stdout=subprocess.PIPE)
+        assert self.executor.calls == [("image:1.0", ["tool"])]
+
+
 @pytest.mark.usefixtures("db", "db_session", "populate_db")
 class TestPreRunSteps:
     def setup(self):
@@ -159,6 +366,8 @@ class TestPreRunSteps:
         with open(f"{self.test_file_prefix}/sample_sheet_working.txt", "w") as handle:
             handle.write("sample_id\tsample_path\n")
             handle.write(f"12S13548\t{cnv_pat_dir}/tests/test_files/input/bam_header.bam\n")
+        # index must be newer than the bam
+        pathlib.Path(f"{cnv_pat_dir}/tests/test_files/input/bam_header.bam.bai").touch()
 
         self.caller = BaseCNVTool("ICR", "gene_1", "time")
         self.caller.bam_mount = "/mnt/data/"
@@ -269,11 +478,7 @@ class TestUploadSamples:
         self.expected_output = [
             {
                 "cnv": {"alt": "DUP", "genome_build": "hg19", "chrom": "chr17", "start": "1200", "end": "1500"},
-                "sample_defaults": {
-                    "name": "12S13548",
-                    "gene_id": 1,
-                    "path": "/mnt/data/181225_NB503215_run/analysis/Alignments/12S13548_sorted.bam",
-                },
+                "sample_defaults": {"name": "12S13548", "gene_id": 1},
             }
         ]
 
@@ -289,6 +494,93 @@ class TestUploadSamples:
         assert uploaded_1.name == "12S13548"
         assert output_table == self.expected_output
 
+    def test_changed_path(self):
+        self.caller.upload_samples(self.sample_sheet)
+        moved_sample_sheet = f"{cnv_pat_dir}/tests/test_files/input/checks/moved_gene_1.txt"
+        with open(self.sample_sheet) as handle, open(moved_sample_sheet, "w") as out_handle:
+            out_handle.write(handle.read().replace("12S13548_sorted.bam", "12S13548_resequenced.bam"))
+        self.caller.upload_samples(moved_sample_sheet)
+        os.remove(moved_sample_sheet)
+
+        samples = self.caller.session.query(models.Sample).filter_by(name="12S13548", gene_id=1).all()
+        assert len(samples) == 1
+        assert samples[0].path == "/mnt/data/181225_NB503215_run/analysis/Alignments/12S13548_resequenced.bam"
+
+    def test_unknown_result_type_skipped(self):
+        """Rows which aren't in the merged capture-wide sample sheet have no bam header and aren't uploaded"""
+        failed_sample_sheet = f"{cnv_pat_dir}/tests/test_files/input/checks/failed_gene_1.txt"
+        with open(self.sample_sheet) as handle, open(failed_sample_sheet, "w") as out_handle:
+            out_handle.write(handle.read())
+            out_handle.write("15S10000\t/mnt/data/15S10000_sorted.bam\tfailed-qc\tgene_1\tICR\tchr17\tNA\tNA\tNA\n")
+        output_table = self.caller.upload_samples(failed_sample_sheet)
+        os.remove(failed_sample_sheet)
+
+        assert output_table == self.expected_output
+        assert not self.caller.session.query(models.Sample).filter_by(name="15S10000").first()
+
+
+@pytest.mark.usefixtures("db", "db_session", "populate_db")
+class TestIncrementalUpload:
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.old_bam = "/mnt/data/181225_NB503215_run/analysis/Alignments/12S13548_sorted.bam"
+        self.new_bam = "/mnt/data/181225_NB503215_run/analysis/Alignments/12S13548_resequenced.bam"
+        self.caller = BaseCNVTool("ICR", "gene_1", "time_2")
+        self.caller.run_type = "first_caller"
+        self.caller.incremental_unknowns = True
+        self.caller.bam_headers = {"12S13548": "header1"}
+        self.caller.bam_to_sample = {self.new_bam: "12S13548"}
+        self.caller.settings = {
+            "genome_build_name": "hg19",
+            "start_time": "time_2",
+            "unknown_bams": [self.new_bam],
+            "unknown_samples": {"12S13548": self.new_bam},
+        }
+        self.caller.sample_sheet = f"{self.temp_dir}/gene_1.txt"
+        with open("tests/test_files/input/gene_1.txt") as handle, open(self.caller.sample_sheet, "w") as out_handle:
+            out_handle.write(handle.read().replace(self.old_bam, self.new_bam))
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def called_cnvs(self):
+        sample = self.caller.session.query(models.Sample).filter_by(name="12S13548", gene_id=1).one()
+        called_cnvs = self.caller.session.query(models.CalledCNV).filter_by(caller_id=1, sample_id=sample.id)
+        return sorted(
+            (cnv.chrom, cnv.start, cnv.end)
+            for cnv in self.caller.session.query(models.CNV).filter(
+                models.CNV.id.in_([called_cnv.cnv_id for called_cnv in called_cnvs])
+            )
+        )
+
+    def test_changed_bam(self, monkeypatch):
+        self.caller.upload_samples("tests/test_files/input/gene_1.txt")
+        self.caller.upload_called_cnvs([CalledCNVRecord("chr17", "1000", "1100", "DEL", "12S13548")])
+        monkeypatch.setattr(base_classes, "cnv_pat_dir", self.temp_dir)
+        monkeypatch.setitem(base_classes.cnv_pat_settings, "resume_steps", False)
+        previous_settings = {
+            **self.caller.settings,
+            "start_time": "time_1",
+            "unknown_bams": [self.old_bam],
+            "unknown_samples": {"12S13548": self.old_bam},
+        }
+        os.makedirs(os.path.dirname(self.caller.get_run_settings_path()))
+        with open(self.caller.get_run_settings_path(), "w") as handle:
+            toml.dump(previous_settings, handle)
+
+        new_call = CalledCNVRecord("chr17", "1200", "1500", "DUP", "12S13548")
+        monkeypatch.setattr(self.caller, "prerun_steps", lambda *args: self.caller.bam_headers)
+        monkeypatch.setattr(self.caller, "run_workflow", lambda: (["output.txt"], ["12S13548"]))
+        monkeypatch.setattr(self.caller, "process_caller_output", lambda *args: [new_call])
+        monkeypatch.setattr(self.caller, "upload_gene", lambda: None)
+        monkeypatch.setattr(self.caller, "upload_run_data", lambda *args, **kwargs: None)
+        self.caller.run_if_required()
+
+        assert self.caller.added_unknowns == [self.new_bam]
+        samples = self.caller.session.query(models.Sample).filter_by(name="12S13548", gene_id=1).all()
+        assert [sample.path for sample in samples] == [self.new_bam]
+        assert self.called_cnvs() == [("chr17", 1200, 1500)]
+
 
 @pytest.mark.usefixtures("db", "db_session", "populate_db")
 class TestUploadPositiveCNVs:
@@ -360,3 +652,27 @@ class TestUploadCalledCNV:
         assert uploaded_cnv.alt == "DEL"
         assert uploaded_called_cnv.id > 2
         assert uploaded_called_cnv.json_data == '{"extra_field1": "extra_data1", "extra_field2": "extra_data2"}'
+
+    def test_get_cnv_ids(self):
+        self.caller.upload_called_cnvs([CalledCNVRecord("chr1", "10", "120", "DEL", "10S21354")])
+        cnv_ids = self.caller.get_cnv_ids("hg19", {("chr1", 10, 120, "DEL"), ("chr1", 10, 130, "DEL")})
+        assert list(cnv_ids) == [("chr1", 10, 120, "DEL")]
+        assert self.caller.get_cnv_ids("hg38", {("chr1", 10, 120, "DEL")}) == {}
+
+    def test_bulk_reupload(self):
+        first_sample_call = CalledCNVRecord("chr1", "10", "120", "DEL", "10S21354", {"extra_field1": "extra_data1"})
+        second_sample_call = CalledCNVRecord("chr1", "10", "120", "DEL", "92S13548", {"extra_field1": "extra_data1"})
+        self.caller.upload_called_cnvs([first_sample_call, second_sample_call])
+        first_sample_call.extra = {"extra_field1": "updated"}
+        self.caller.upload_called_cnvs([first_sample_call])
+
+        uploaded_cnvs = self.caller.session.query(models.CNV).filter_by(start=10, end=120, chrom="chr1").all()
+        uploaded_called_cnvs = (
+            self.caller.session.query(models.CalledCNV)
+            .filter_by(caller_id=1, cnv_id=uploaded_cnvs[0].id)
+            .order_by(models.CalledCNV.sample_id)
+            .all()
+        )
+        assert len(uploaded_cnvs) == 1
+        assert len(uploaded_called_cnvs) == 2
+        assert uploaded_called_cnvs[0].json_data == '{"extra_field1": "updated"}'
@@ -0,0 +1,74 @@
+import os
+import pathlib
+import shutil
+import tempfile
+
+from scripts import checkpoints
+
+
+class TestStepJournal:
+    def setup(self):
+        self.base_dir = pathlib.Path(tempfile.mkdtemp())
+        self.output_base = self.base_dir / "output" / "capture" / "time_1" / "caller" / "gene"
+        self.output_base.mkdir(parents=True)
+        with open(self.base_dir / "input.txt", "w") as handle:
+            handle.write("input")
+        self.settings = {"gene": "gene", "start_time": "time_1", "unknown_bams": ["/mnt/bam-input/sample.bam"]}
+        self.args = ["tool", "-I", "/mnt/input.txt", "--output=/mnt/output/capture/time_1/caller/gene/Step"]
+        self.journal = self.get_journal()
+
+    def teardown(self):
+        shutil.rmtree(self.base_dir)
+
+    def get_journal(self, settings=None):
+        get_host_path = lambda path: path.replace("/mnt", f"{self.base_dir}")
+        return checkpoints.StepJournal(f"{self.output_base}", get_host_path, settings or self.settings)
+
+    def run_step(self, journal, contents="counts"):
+        with journal.record("image:1", self.args):
+            (self.output_base / "Step").mkdir(exist_ok=True)
+            with open(self.output_base / "Step" / "counts.txt", "w") as handle:
+                handle.write(contents)
+
+    def test_completed_step(self):
+        assert not self.journal.is_complete("image:1", self.args)
+        self.run_step(self.journal)
+
+        resumed = self.get_journal()
+        assert resumed.steps[resumed.get_step_id("image:1", self.args)]["outputs"].keys() == {"Step/counts.txt"}
+        assert resumed.is_complete("image:1", self.args)
+        assert not resumed.is_complete("image:2", self.args)
+
+    def test_changed_input(self):
+        self.run_step(self.journal)
+        with open(self.base_dir / "input.txt", "a") as handle:
+            handle.write("more input")
+        assert not self.get_journal().is_complete("image:1", self.args)
+
+    def test_changed_output(self):
+        self.run_step(self.journal)
+        os.remove(self.output_base / "Step" / "counts.txt")
+        assert not self.get_journal().is_complete("image:1", self.args)
+
+    def test_different_settings(self):
+        self.run_step(self.journal)
+        settings = {**self.settings, "unknown_bams": []}
+        assert not self.get_journal(settings).is_complete("image:1", self.args)
+
+    def test_failed_step_not_recorded(self):
+        try:
+            with self.journal.record("image:1", self.args):
+                raise ValueError("step failed")
+        except ValueError:
+            pass
+        assert not os.path.exists(self.journal.path)
+
+    def test_find_resumable_start_time(self):
+        capture_dir = f"{self.base_dir}/output/capture"
+        assert checkpoints.find_resumable_start_time(capture_dir, "caller", "gene", self.settings) is None
+
+        self.run_step(self.journal)
+        next_run_settings = {**self.settings, "start_time": "time_2"}
+        assert checkpoints.find_resumable_start_time(capture_dir, "caller", "gene", next_run_settings) == "time_1"
+        changed_settings = {**next_run_settings, "unknown_bams": []}
+        assert checkpoints.find_resumable_start_time(capture_dir, "caller", "gene", changed_settings) is None
@@ -0,0 +1,453 @@
+import http.server
+import json
+import os
+import shutil
+import socketserver
+import struct
+import subprocess
+import tempfile
+import threading
+
+import pytest
+
+from scripts import containers
+
+
+class TestContainerPool:
+    def setup(self):
+        self.pool = containers.ContainerPool()
+        self.mounts = {"/mnt/output/": ("/output/", "rw")}
+        self.commands = []
+
+    def fake_run(self, command, **kwargs):
+        self.commands.append(command)
+        if command[:3] == ["docker", "image", "inspect"]:
+            return subprocess.CompletedProcess(command, 0, stdout=b'["/bin/entry"]\n')
+        return subprocess.CompletedProcess(command, 0, stdout=b"container_id\n")
+
+    def fake_run_cli(self, command, stdout=None):
+        return self.fake_run(command, stdout=stdout)
+
+    def test_reuses_container(self, monkeypatch):
+        monkeypatch.setattr(containers.subprocess, "run", self.fake_run)
+        monkeypatch.setattr(containers, "run_cli", self.fake_run_cli)
+        self.pool.run("image:1.0", self.mounts, ["tool", "first"])
+        self.pool.run("image:1.0", self.mounts, ["tool", "second"])
+
+        started = [command for command in self.commands if command[:2] == ["docker", "run"]]
+        assert len(started) == 1
+        assert started[0][-2:] == ["image:1.0", "infinity"]
+        assert self.commands[-1] == ["docker", "exec", "container_id", "/bin/entry", "tool", "second"]
+
+    def test_different_mounts(self, monkeypatch):
+        monkeypatch.setattr(containers.subprocess, "run", self.fake_run)
+        monkeypatch.setattr(containers, "run_cli", self.fake_run_cli)
+        self.pool.run("image:1.0", self.mounts, ["tool"])
+        self.pool.run("image:1.0", {**self.mounts, "/mnt/input/": ("/input/", "ro")}, ["tool"])
+
+        assert len(self.pool.containers) == 2
+
+    def test_moved_to_allocated_cpus(self, monkeypatch):
+        monkeypatch.setattr(containers.subprocess, "run", self.fake_run)
+        monkeypatch.setattr(containers, "run_cli", self.fake_run_cli)
+        self.pool.run("image:1.0", self.mounts, ["tool"], limits=containers.Limits((0, 1), 4))
+        self.pool.run("image:1.0", self.mounts, ["tool"], limits=containers.Limits((2, 3), 4))
+        self.pool.run("image:1.0", self.mounts, ["tool"], limits=containers.Limits((2, 3), 4))
+
+        started = [command for command in self.commands if command[:2] == ["docker", "run"]]
+        assert len(started) == 1
+        assert ["--cpuset-cpus", "0,1", "--memory", "4g"] == started[0][-8:-4]
+        updated = [command for command in self.commands if command[:2] == ["docker", "update"]]
+        assert updated == [["docker", "update", "--cpuset-cpus", "2,3", "container_id"]]
+
+    def test_different_amounts(self, monkeypatch):
+        monkeypatch.setattr(containers.subprocess, "run", self.fake_run)
+        monkeypatch.setattr(containers, "run_cli", self.fake_run_cli)
+        self.pool.run("image:1.0", self.mounts, ["tool"], limits=containers.Limits((0, 1), 4))
+        self.pool.run("image:1.0", self.mounts, ["tool"], limits=containers.Limits((0, 1, 2), 4))
+
+        assert len(self.pool.containers) == 2
+
+    def test_one_command_per_container(self, monkeypatch):
+        monkeypatch.setattr(containers.subprocess, "run", self.fake_run)
+        monkeypatch.setattr(containers, "run_cli", self.fake_run_cli)
+        with self.pool.checkout("image:1.0", self.mounts):
+            with self.pool.checkout("image:1.0", self.mounts):
+                pass
+        with self.pool.checkout("image:1.0", self.mounts):
+            pass
+
+        assert len(self.pool.containers) == 2
+
+    def test_close(self, monkeypatch):
+        monkeypatch.setattr(containers.subprocess, "run", self.fake_run)
+        monkeypatch.setattr(containers, "run_cli", self.fake_run_cli)
+        self.pool.run("image:1.0", self.mounts, ["tool"])
+        self.pool.close()
+
+        assert self.commands[-1] == ["docker", "rm", "--force", "container_id"]
+        assert self.pool.containers == []
+
+
+
+# stand-in for docker where the first exec fails with a daemon timeout
+fake_docker = """#!/bin/sh
+case "$1" in
+    image) echo '[]' ;;
+    run) echo container_id ;;
+    exec)
+        if [ ! -e "$(dirname "$0")/timed-out" ]; then
+            touch "$(dirname "$0")/timed-out"
+            echo "Error response from daemon: container did not start before the specified timeout" >&2
+            exit 125
+        fi
+        echo done ;;
+esac
+"""
+
+
+class TestWarmContainerTimeout:
+    def setup(self):
+        self.bin_dir = tempfile.mkdtemp()
+        with open(f"{self.bin_dir}/docker", "w") as handle:
+            handle.write(fake_docker)
+        os.chmod(f"{self.bin_dir}/docker", 0o755)
+
+    def teardown(self):
+        shutil.rmtree(self.bin_dir)
+
+    def test_retries_daemon_timeout(self, monkeypatch):
+        monkeypatch.setenv("PATH", f"{self.bin_dir}:{os.environ['PATH']}")
+        pool = containers.ContainerPool()
+        governor = containers.LaunchGovernor(max_running=4, retries=2, backoff=0)
+
+        process = governor.launch(lambda: pool.run("image:1.0", {}, ["tool"], stdout=subprocess.PIPE))
+        assert process.stdout == b"done\n"
+        assert governor.limit == 3
+
+
+class TestCpuPool:
+    def setup(self):
+        self.pool = containers.CpuPool([0, 1, 2, 3])
+
+    def test_disjoint_sets(self):
+        with self.pool.allocate(containers.ResourceProfile(cpu=2, mem=4)) as first:
+            with self.pool.allocate(containers.ResourceProfile(cpu=2, mem=8)) as second:
+                assert first == containers.Limits((0, 1), 4)
+                assert second == containers.Limits((2, 3), 8)
+        assert self.pool.free_cpus == [0, 1, 2, 3]
+
+    def test_waits_for_free_cpus(self):
+        allocated = []
+
+        def allocate():
+            with self.pool.allocate(containers.ResourceProfile(cpu=2, mem=1)) as limits:
+                allocated.append(limits.cpus)
+
+        with self.pool.allocate(containers.ResourceProfile(cpu=3, mem=1)):
+            thread = threading.Thread(target=allocate)
+            thread.start()
+            thread.join(0.1)
+            assert allocated == []
+        thread.join()
+        assert allocated == [(0, 1)]
+
+    def test_more_than_host(self):
+        with self.pool.allocate(containers.ResourceProfile(cpu=30, mem=50)) as limits:
+            assert limits.cpus == (0, 1, 2, 3)
+            assert containers.limit_args(limits) == ["--cpus", "4", "--cpuset-cpus", "0,1,2,3", "--memory", "50g"]
+
+    def test_no_limits(self):
+        with self.pool.allocate(None) as limits:
+            assert limits is None
+            assert containers.limit_args(limits) == []
+
+
+class TestPreflightImages:
+    def setup(self):
+        self.local_images = {"present:1.0"}
+        self.pulled = []
+
+    def fake_run(self, command, **kwargs):
+        docker_image = command[-1]
+        if command[:3] == ["docker", "image", "inspect"]:
+            if docker_image not in self.local_images:
+                return subprocess.CompletedProcess(command, 1)
+            image_data = {"Id": "sha256:abc", "RepoDigests": [f"{docker_image.split(':')[0]}@sha256:def"]}
+            return subprocess.CompletedProcess(command, 0, stdout=json.dumps(image_data).encode())
+        if docker_image == "missing:1.0":
+            raise subprocess.CalledProcessError(1, command, stderr=b"manifest unknown\n")
+        self.pulled.append(docker_image)
+        self.local_images.add(docker_image)
+        return subprocess.CompletedProcess(command, 0)
+
+    def test_pulls_missing(self, monkeypatch):
+        monkeypatch.setattr(containers.subprocess, "run", self.fake_run)
+        digests = containers.preflight_images(["present:1.0", "new:1.0", "new:1.0"])
+
+        assert self.pulled == ["new:1.0"]
+        assert digests == {"new:1.0": "new@sha256:def", "present:1.0": "present@sha256:def"}
+
+    def test_missing_image(self, monkeypatch):
+        monkeypatch.setattr(containers.subprocess, "run", self.fake_run)
+        with pytest.raises(Exception) as error:
+            containers.preflight_images(["present:1.0", "new:1.0", "missing:1.0"])
+        assert "missing:1.0: manifest unknown" in f"{error.value}"
+        assert self.pulled == ["new:1.0"]
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", f"{len(body)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path))
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length)) if length else None
+        if self.path == "/containers/create":
+            self.server.created.append(body)
+            self.send_json(201, {"Id": "abc123"})
+        elif self.path.endswith("/start"):
+            self.send_response(204)
+            self.end_headers()
+        elif self.path.endswith("/wait"):
+            self.send_json(200, {"StatusCode": self.server.exit_code})
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+        frames = b""
+        for stream, data in [(1, b"header\n"), (2, b"warning\n"), (1, b"line\n")]:
+            frames += struct.pack(">BxxxL", stream, len(data)) + data
+        # logs are streamed with chunked encoding while the container runs
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in [frames[:5], frames[5:]]:
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_DELETE(self):
+        self.server.requests.append(("DELETE", self.path))
+        self.send_response(204)
+        self.end_headers()
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        self.connections += 1
+        # unix sockets have no client address, which BaseHTTPRequestHandler expects
+        return request, ("local", 0)
+
+
+class TestDockerClient:
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        socket_path = f"{self.temp_dir}/docker.sock"
+        self.server = FakeDockerServer(socket_path, FakeDockerHandler)
+        self.server.requests, self.server.created, self.server.connections, self.server.exit_code = [], [], 0, 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = containers.DockerClient(socket_path)
+        self.mounts = {"/mnt/output/": ("/output/", "rw")}
+
+    def teardown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_run(self):
+        process = self.client.run("image:1.0", ["tool", "arg"], self.mounts, stdout=subprocess.PIPE)
+
+        assert process.stdout == b"header\nline\n"
+        assert self.server.created == [
+            {
+                "Image": "image:1.0",
+                "Cmd": ["tool", "arg"],
+                "Env": [],
+                "HostConfig": {"Binds": ["/output/:/mnt/output/:rw"]},
+            }
+        ]
+        assert [request[0] for request in self.server.requests] == ["POST", "POST", "GET", "POST", "DELETE"]
+
+    def test_limits(self):
+        limits = containers.Limits((2, 3), 4)
+        self.client.run("image:1.0", ["tool"], self.mounts, stdout=subprocess.PIPE, limits=limits)
+        assert self.server.created[0]["HostConfig"] == {
+            "Binds": ["/output/:/mnt/output/:rw"],
+            "NanoCpus": 2 * 10 ** 9,
+            "CpusetCpus": "2,3",
+            "Memory": 4 * 1024 ** 3,
+        }
+
+    def test_persistent_connection(self):
+        self.client.run("image:1.0", ["tool"], self.mounts, stdout=subprocess.PIPE)
+        self.client.run("image:1.0", ["tool"], self.mounts, stdout=subprocess.PIPE)
+        assert self.server.connections == 1
+
+    def test_stdout_to_file(self):
+        output_path = f"{self.temp_dir}/output.txt"
+        with open(output_path, "w") as handle:
+            self.client.run("image:1.0", ["tool"], self.mounts, stdout=handle)
+        with open(output_path) as handle:
+            assert handle.read() == "header\nline\n"
+
+    def test_failed_command(self):
+        self.server.exit_code = 3
+        with pytest.raises(subprocess.CalledProcessError):
+            self.client.run("image:1.0", ["tool"], self.mounts, stdout=subprocess.PIPE)
+        assert self.server.requests[-1][0] == "DELETE"
+
+    def test_stream(self):
+        governor = containers.LaunchGovernor(max_running=4)
+        with governor.stream(lambda: self.client.open_stream("image:1.0", ["tool"], self.mounts)) as lines:
+            assert list(lines) == ["header\n", "line\n"]
+        assert [request[0] for request in self.server.requests] == ["POST", "POST", "GET", "POST", "DELETE"]
+
+
+class TestLaunchGovernor:
+    def setup(self):
+        self.governor = containers.LaunchGovernor(max_running=4, retries=2, backoff=0)
+        self.attempts = 0
+
+    def daemon_timeout(self):
+        self.attempts += 1
+        if self.attempts < 3:
+            stderr = b"docker: Error response from daemon: container did not start before the specified timeout.\n"
+            raise subprocess.CalledProcessError(125, ["docker", "run"], stderr=stderr)
+        return "done"
+
+    def test_retries_daemon_timeout(self):
+        assert self.governor.launch(self.daemon_timeout) == "done"
+        assert self.attempts == 3
+        # halved twice by the timeouts, then increased by the successful launch
+        assert self.governor.limit == 2
+
+    def test_gives_up(self):
+        self.governor.retries = 1
+        with pytest.raises(subprocess.CalledProcessError):
+            self.governor.launch(self.daemon_timeout)
+        assert self.attempts == 2
+
+    def test_other_errors_not_retried(self):
+        def fail():
+            self.attempts += 1
+            raise subprocess.CalledProcessError(1, ["docker", "run"], stderr=b"tool failed\n")
+
+        with pytest.raises(subprocess.CalledProcessError):
+            self.governor.launch(fail)
+        assert self.attempts == 1
+
+    def test_slow_start(self):
+        self.governor.record_start(10)
+        assert self.governor.limit == 3
+
+
+class TestRunCli:
+    def test_stderr_kept(self):
+        with pytest.raises(subprocess.CalledProcessError) as error:
+            containers.run_cli(["sh", "-c", "echo out; echo problem >&2; exit 2"], stdout=subprocess.PIPE)
+        assert error.value.stderr == b"problem\n"
+        assert error.value.output == b"out\n"
+
+
+# stand-in for docker run which takes a while to create its container before writing the id to the cidfile
+slow_docker_run = """#!/bin/sh
+if [ "$4" = "missing:1.0" ]; then
+    echo "Unable to find image 'missing:1.0' locally" >&2
+    exit 125
+fi
+sleep 0.3
+echo container_id > "$3"
+echo done
+"""
+
+
+class TestCliStartLatency:
+    def setup(self):
+        self.bin_dir = tempfile.mkdtemp()
+        self.docker = f"{self.bin_dir}/docker"
+        with open(self.docker, "w") as handle:
+            handle.write(slow_docker_run)
+        os.chmod(self.docker, 0o755)
+        self.governor = containers.LaunchGovernor(max_running=4, slow_start=0.1)
+
+    def teardown(self):
+        shutil.rmtree(self.bin_dir)
+
+    def test_run_cli(self):
+        command = [self.docker, "run", "image:1.0", "tool"]
+        process = containers.run_cli(command, stdout=subprocess.PIPE, record_start=self.governor.record_start)
+        assert process.stdout == b"done\n"
+        assert self.governor.limit == 3
+
+    def test_stream(self):
+        starts = []
+        command = [self.docker, "run", "image:1.0", "tool"]
+        with self.governor.stream(lambda: containers.CliStream(command, record_start=starts.append)) as lines:
+            assert list(lines) == ["done\n"]
+        assert len(starts) == 1 and starts[0] >= 0.3
+
+    def test_no_container_created(self):
+        starts = []
+        command = [self.docker, "run", "missing:1.0", "tool"]
+        with pytest.raises(subprocess.CalledProcessError):
+            containers.run_cli(command, stdout=subprocess.PIPE, record_start=starts.append)
+        assert starts == []
+
+
+class TestCliStream:
+    def setup(self):
+        self.governor = containers.LaunchGovernor(max_running=4, retries=2, backoff=0)
+
+    def test_lines_while_running(self):
+        command = ["sh", "-c", "echo first; sleep 0.1; echo second"]
+        with self.governor.stream(lambda: containers.CliStream(command)) as lines:
+            assert next(lines) == "first\n"
+            assert list(lines) == ["second\n"]
+        assert self.governor.running == 0
+
+    def test_failed_command(self):
+        command = ["sh", "-c", "echo out; echo problem >&2; exit 2"]
+        with pytest.raises(subprocess.CalledProcessError) as error:
+            with self.governor.stream(lambda: containers.CliStream(command)) as lines:
+                list(lines)
+        assert error.value.stderr == b"problem\n"
+
+    def test_unread_output_discarded(self):
+        command = ["sh", "-c", "seq 100000"]
+        with self.governor.stream(lambda: containers.CliStream(command)) as lines:
+            assert next(lines) == "1\n"
+
+    def test_abort_on_error(self):
+        streams = []
+
+        def open_stream():
+            streams.append(containers.CliStream(["sh", "-c", "echo first; exec sleep 10"]))
+            return streams[0]
+
+        with pytest.raises(ValueError):
+            with self.governor.stream(open_stream) as lines:
+                next(lines)
+                raise ValueError("parsing failed")
+        assert streams[0].process.returncode is not None
+
+    def test_retries_daemon_timeout(self):
+        commands = [
+            ["sh", "-c", "echo 'container did not start before the specified timeout' >&2; exit 125"],
+            ["sh", "-c", "echo done"],
+        ]
+        with self.governor.stream(lambda: containers.CliStream(commands.pop(0))) as lines:
+            assert list(lines) == ["done\n"]
+        assert not commands
@@ -73,3 +73,7 @@ class TestParseOutputFile:
     def test_normal(self):
         parsed = self.caller.parse_output_file(self.output_file, "normal")
         assert parsed == []
+
+    def test_demultiplex(self):
+        demultiplexed = self.caller.demultiplex_output_file(self.output_file, ["del", "normal"])
+        assert demultiplexed == {"del": self.del_expected_output, "normal": []}
@@ -1,5 +1,9 @@
+import os
 import pathlib
+import shutil
+import tempfile
 
+from scripts import base_classes, executors
 from scripts.excavator2 import Excavator2
 
 
@@ -54,3 +58,60 @@ class TestParseOutputFile:
     def test_normal(self):
         parsed = self.caller.parse_output_file(self.output_base / "sample_3.vcf", "sample_3")
         assert parsed == []
+
+
+class TestDataPrepareCache:
+    def setup(self):
+        self.cnv_pat_dir = tempfile.mkdtemp()
+        shutil.copy("tests/test_files/input/capture.bed", f"{self.cnv_pat_dir}/capture.bed")
+        self.bam_dir = pathlib.Path(self.cnv_pat_dir, "bams")
+        self.bam_dir.mkdir()
+        for sample in ["sample_1", "sample_2"]:
+            (self.bam_dir / f"{sample}.bam").write_text(sample)
+        self.prepared = []
+        self.executor = executors.MockExecutor(handlers={"python3.6": self.run_excavator})
+
+    def teardown(self):
+        shutil.rmtree(self.cnv_pat_dir)
+
+    def run_excavator(self, args, mounts):
+        output_base = args[args.index("--output-base") + 1].replace("/mnt", self.cnv_pat_dir, 1)
+        with open(f"{output_base}/ExperimentalFilePrepare.txt") as handle:
+            for line in handle:
+                bam, prepared_dir, sample = line.split()
+                os.makedirs(prepared_dir.replace("/mnt", self.cnv_pat_dir, 1))
+                pathlib.Path(prepared_dir.replace("/mnt", self.cnv_pat_dir, 1), "prepared.txt").write_text(bam)
+                self.prepared.append(sample)
+        return b""
+
+    def run_gene(self, gene, max_cpu="2"):
+        caller = Excavator2("capture", gene, "time")
+        caller.output_base, caller.docker_output_base = caller.base_output_dirs()
+        caller.max_cpu, caller.max_mem = max_cpu, "4"
+        caller.bam_mount = f"{self.bam_dir}/"
+        caller.bam_to_sample = {f"/mnt/bam-input/{sample}.bam": sample for sample in ["sample_1", "sample_2"]}
+        caller.settings = {
+            **caller.settings,
+            "capture_path": "/mnt/capture.bed",
+            "ref_fasta": "/mnt/ref_genome/genome.fa",
+            "unknown_bams": ["/mnt/bam-input/sample_1.bam"],
+            "normal_bams": ["/mnt/bam-input/sample_2.bam"],
+        }
+        caller.run_workflow()
+        return caller.output_base
+
+    def test_shared_between_genes(self, monkeypatch):
+        monkeypatch.setattr(base_classes, "cnv_pat_dir", self.cnv_pat_dir)
+        monkeypatch.setattr(executors, "executor", self.executor)
+        monkeypatch.setitem(base_classes.cnv_pat_settings, "step_cache", True)
+        self.run_gene("gene_1")
+        assert self.prepared == ["sample_1", "sample_2"]
+
+        gene_2_output = self.run_gene("gene_2", max_cpu="4")
+        assert self.prepared == ["sample_1", "sample_2"]
+        prepared_path = pathlib.Path(gene_2_output, "DataPrep", "sample_1", "prepared.txt")
+        assert prepared_path.read_text() == "/mnt/bam-input/sample_1.bam"
+
+        (self.bam_dir / "sample_1.bam").write_text("resequenced sample_1")
+        self.run_gene("gene_3")
+        assert self.prepared == ["sample_1", "sample_2", "sample_1"]
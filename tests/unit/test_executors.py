@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+import pytest
+
+from scripts import containers, executors
+
+# stand-ins for the batch scheduler, jobs are run in the background and their id is the process id
+fake_sbatch = """#!/bin/sh
+bash "$2" > /dev/null 2>&1 &
+echo "$!;local"
+"""
+fake_squeue = """#!/bin/sh
+kill -0 "$4" 2> /dev/null && echo RUNNING
+"""
+# stand-in for docker which writes its arguments, failing if the last argument is "fail"
+fake_docker = """#!/bin/sh
+echo "$@"
+[ "$(eval echo \\${$#})" != "fail" ] || exit 3
+"""
+
+
+class TestBatchExecutor:
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.bin_dir = f"{self.temp_dir}/bin"
+        os.makedirs(self.bin_dir)
+        for name, script in [("sbatch", fake_sbatch), ("squeue", fake_squeue), ("docker", fake_docker)]:
+            with open(f"{self.bin_dir}/{name}", "w") as handle:
+                handle.write(script)
+            os.chmod(f"{self.bin_dir}/{name}", 0o755)
+        self.executor = executors.BatchExecutor(f"{self.temp_dir}/jobs", poll_interval=0.05)
+        self.mounts = {"/mnt/output/": ("/output/", "rw")}
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_run(self, monkeypatch):
+        monkeypatch.setenv("PATH", f"{self.bin_dir}:{os.environ['PATH']}")
+        resources = containers.ResourceProfile(cpu=2, mem=4)
+        process = self.executor.run(
+            "image:1.0", ["tool", "arg"], self.mounts, stdout=subprocess.PIPE, resources=resources
+        )
+
+        assert process.stdout == b"run --rm -v /output/:/mnt/output/:rw --cpus 2 --memory 4g image:1.0 tool arg\n"
+        script_path = next(path for path in os.listdir(self.executor.script_dir) if path.endswith(".sh"))
+        with open(f"{self.executor.script_dir}/{script_path}") as handle:
+            script = handle.read()
+        assert "#SBATCH --cpus-per-task=2\n#SBATCH --mem=4G\n" in script
+
+    def test_stdout_to_file(self, monkeypatch):
+        monkeypatch.setenv("PATH", f"{self.bin_dir}:{os.environ['PATH']}")
+        output_path = f"{self.temp_dir}/output.txt"
+        with open(output_path, "w") as handle:
+            self.executor.run("image:1.0", ["tool"], self.mounts, stdout=handle)
+        with open(output_path) as handle:
+            assert handle.read() == "run --rm -v /output/:/mnt/output/:rw image:1.0 tool\n"
+
+    def test_failed_command(self, monkeypatch):
+        monkeypatch.setenv("PATH", f"{self.bin_dir}:{os.environ['PATH']}")
+        with pytest.raises(subprocess.CalledProcessError) as error:
+            self.executor.run("image:1.0", ["tool", "fail"], self.mounts)
+        assert error.value.returncode == 3
+
+    def test_job_without_exit_code(self, monkeypatch):
+        monkeypatch.setenv("PATH", f"{self.bin_dir}:{os.environ['PATH']}")
+        monkeypatch.setattr(self.executor, "write_script", lambda *args: "/missing/job.sh")
+        with pytest.raises(Exception, match="finished without an exit code"):
+            self.executor.run("image:1.0", ["tool"], self.mounts)
+
+
+class TestMockExecutor:
+    def setup(self):
+        self.executor = executors.MockExecutor(handlers={"count": lambda args, mounts: b"1\n2\n"})
+
+    def test_run(self):
+        assert self.executor.run("image:1.0", ["count"], {}, stdout=subprocess.PIPE).stdout == b"1\n2\n"
+        assert self.executor.run("image:1.0", ["other"], {}, stdout=subprocess.PIPE).stdout == b""
+        assert self.executor.calls == [("image:1.0", ["count"]), ("image:1.0", ["other"])]
+
+    def test_stream(self):
+        with self.executor.stream("image:1.0", ["count"], {}) as lines:
+            assert list(lines) == ["1\n", "2\n"]
+
+    def test_unknown_executor(self):
+        with pytest.raises(Exception, match="Unknown executor"):
+            executors.get_executor("cloud")
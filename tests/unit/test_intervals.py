@@ -0,0 +1,58 @@
+from scripts.intervals import CaptureIndex, IntervalIndex
+
+
+class TestIntervalIndex:
+    def setup(self):
+        self.index = IntervalIndex.from_bed_lines(
+            [
+                "chr1\t5000\t6000\tgene",
+                "chr1\t1000\t1500\tgene",
+                "chr1\t1400\t1600\tgene",
+                "chr1\t2000\t2500\tgene",
+                "chr17\t1000\t1500\tgene_2",
+            ]
+        )
+
+    def test_merged(self):
+        assert self.index.starts["chr1"] == [1000, 2000, 5000]
+        assert self.index.ends["chr1"] == [1600, 2500, 6000]
+
+    def test_within(self):
+        assert self.index.overlaps("chr1", 1100, 1200)
+        assert self.index.overlaps("chr1", 1550, 1800)
+        assert self.index.overlaps("chr1", 500, 1000)
+
+    def test_spanning(self):
+        assert self.index.overlaps("chr1", 500, 7000)
+        assert self.index.overlaps("chr17", "900", "1600")
+
+    def test_outside(self):
+        assert not self.index.overlaps("chr1", 1601, 1999)
+        assert not self.index.overlaps("chr1", 100, 999)
+        assert not self.index.overlaps("chr1", 6001, 7000)
+        assert not self.index.overlaps("chr2", 1000, 1500)
+
+
+class TestCaptureIndex:
+    def setup(self):
+        self.capture_index = CaptureIndex.get("tests/test_files/input/capture.bed")
+
+    def test_shared(self):
+        assert CaptureIndex.get("tests/test_files/input/capture.bed") is self.capture_index
+
+    def test_gene_bounds(self):
+        assert self.capture_index.gene_bounds("gene_3") == ("chr3", 1500, 1950)
+
+    def test_gene_bed(self):
+        gene_bed = self.capture_index.gene_bed("gene_3")
+        assert gene_bed[0].startswith("chr3\t1500\t")
+        assert all(line.endswith("\tgene_3\n") for line in gene_bed)
+
+    def test_header_skipped(self):
+        capture_index = CaptureIndex.get("tests/test_files/input/bed/no-prefix_header.bed")
+        assert capture_index.targets[0] == ("19", 1206912, 1207203, "STK11")
+        assert capture_index.invalid_line("") == (1, "chrom\tstart\tend\tgene\n")
+
+    def test_unprefixed_targets(self):
+        assert all(not chrom.startswith("chr") for chrom, *_ in self.capture_index.unprefixed_targets("chr"))
+        assert self.capture_index.unprefixed_targets("") == self.capture_index.targets
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+from scripts import leases
+
+
+class TestLease:
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.lease_path = f"{self.temp_dir}/capture/caller/gene.lease"
+        os.makedirs(os.path.dirname(self.lease_path))
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_single_owner(self):
+        first = leases.Lease(self.lease_path, timeout=60)
+        second = leases.Lease(self.lease_path, timeout=60)
+
+        assert first.acquire()
+        assert not second.acquire()
+        first.release()
+        assert not os.path.exists(self.lease_path)
+        assert second.acquire()
+        second.release()
+
+    def test_expired_lease_reclaimed(self):
+        crashed = leases.Lease(self.lease_path, timeout=60)
+        crashed.create()
+        expired = time.time() - 120
+        os.utime(self.lease_path, (expired, expired))
+
+        worker = leases.Lease(self.lease_path, timeout=60)
+        assert worker.acquire()
+        assert leases.Lease.read_owner(self.lease_path) == worker.owner
+        worker.release()
+        assert os.listdir(os.path.dirname(self.lease_path)) == []
+
+    def test_heartbeat(self):
+        worker = leases.Lease(self.lease_path, timeout=0.5)
+        worker.acquire()
+        time.sleep(1)
+
+        assert not leases.Lease(self.lease_path, timeout=0.5).acquire()
+        worker.release()
+
+    def test_lost_lease(self):
+        worker = leases.Lease(self.lease_path, timeout=0.5)
+        worker.acquire()
+        worker.check()
+        with open(self.lease_path, "w") as handle:
+            handle.write("other worker")
+        time.sleep(0.2)
+
+        with pytest.raises(leases.LeaseLost):
+            worker.check()
+        worker.release()
+        assert leases.Lease.read_owner(self.lease_path) == "other worker"
+
+    def test_heartbeat_error(self, monkeypatch):
+        def fail_utime(path):
+            raise OSError("Stale file handle")
+
+        monkeypatch.setattr(leases.os, "utime", fail_utime)
+        worker = leases.Lease(self.lease_path, timeout=0.5)
+        worker.acquire()
+        time.sleep(0.2)
+
+        assert not worker.heartbeat_thread.is_alive()
+        with pytest.raises(leases.LeaseLost):
+            worker.check()
+        worker.release()
+
+    def test_release_keeps_other_owner(self):
+        worker = leases.Lease(self.lease_path, timeout=60)
+        worker.create()
+        leases.Lease(self.lease_path, timeout=60).release()
+        assert leases.Lease.read_owner(self.lease_path) == worker.owner
+
+    def test_waits_for_lease(self):
+        expired = leases.Lease(self.lease_path, timeout=0.2)
+        expired.create()
+
+        with leases.Lease(self.lease_path, timeout=0.2) as worker:
+            assert leases.Lease.read_owner(self.lease_path) == worker.owner
+        assert not os.path.exists(self.lease_path)
@@ -0,0 +1,88 @@
+import contextlib
+import os
+import sqlite3
+
+import pytest
+
+from scripts import migrate
+
+# schema before unique constraints and indexes were added
+old_schema = """
+CREATE TABLE callers (id INTEGER NOT NULL, name VARCHAR, PRIMARY KEY (id));
+CREATE TABLE cnvs (
+    id INTEGER NOT NULL, alt VARCHAR, chrom VARCHAR, "end" INTEGER, genome_build VARCHAR, start INTEGER,
+    PRIMARY KEY (id)
+);
+CREATE TABLE genes (
+    id INTEGER NOT NULL, capture VARCHAR, chrom VARCHAR, "end" INTEGER, genome_build VARCHAR, start INTEGER,
+    name VARCHAR, PRIMARY KEY (id), UNIQUE (chrom, start, "end", capture, genome_build)
+);
+CREATE TABLE samples (
+    id INTEGER NOT NULL, bam_header TEXT, gene_id INTEGER NOT NULL, name VARCHAR, path TEXT, result_type VARCHAR,
+    PRIMARY KEY (id), FOREIGN KEY(gene_id) REFERENCES genes (id) ON DELETE CASCADE
+);
+CREATE TABLE called_cnvs (
+    id INTEGER NOT NULL, caller_id INTEGER NOT NULL, cnv_id INTEGER NOT NULL, json_data TEXT,
+    sample_id INTEGER NOT NULL, PRIMARY KEY (id),
+    FOREIGN KEY(caller_id) REFERENCES callers (id) ON DELETE CASCADE,
+    FOREIGN KEY(cnv_id) REFERENCES cnvs (id) ON DELETE CASCADE,
+    FOREIGN KEY(sample_id) REFERENCES samples (id) ON DELETE CASCADE
+);
+INSERT INTO callers VALUES (1, 'first_caller');
+INSERT INTO genes VALUES (1, 'ICR', 'chr17', 3000, 'hg19', 1000, 'gene_1');
+INSERT INTO samples VALUES (1, 'header', 1, 'sample_1', '/path/sample_1.bam', 'positive');
+INSERT INTO cnvs VALUES (1, 'DEL', 'chr17', 1500, 'hg19', 1200);
+INSERT INTO cnvs VALUES (2, 'DEL', 'chr17', 1500, 'hg19', 1200);
+INSERT INTO cnvs VALUES (3, 'DUP', 'chr17', 1500, 'hg19', 1200);
+INSERT INTO called_cnvs VALUES (1, 1, 1, '{"call": "old"}', 1);
+INSERT INTO called_cnvs VALUES (2, 1, 2, '{"call": "new"}', 1);
+INSERT INTO called_cnvs VALUES (3, 1, 3, '{"call": "dup"}', 1);
+"""
+
+
+class TestMigrate:
+    def setup(self):
+        self.db_path = "tests/test_files/migrate.sqlite"
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            connection.executescript(old_schema)
+
+    def teardown(self):
+        os.remove(self.db_path)
+
+    def query(self, statement):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            return connection.execute(statement).fetchall()
+
+    def test_needs_migration(self):
+        assert migrate.needs_migration(self.db_path)
+        assert not migrate.needs_migration("tests/test_files/missing.sqlite")
+
+    def test_duplicates_merged(self):
+        assert migrate.migrate(self.db_path)
+
+        assert self.query("SELECT id, alt FROM cnvs ORDER BY id") == [(2, "DEL"), (3, "DUP")]
+        assert self.query("SELECT cnv_id, json_data FROM called_cnvs ORDER BY cnv_id") == [
+            (2, '{"call": "new"}'),
+            (3, '{"call": "dup"}'),
+        ]
+        assert not migrate.needs_migration(self.db_path)
+
+    def test_schema_upgraded(self):
+        migrate.migrate(self.db_path)
+
+        indexes = {row[0] for row in self.query("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert "ix_called_cnvs_sample_id" in indexes
+        assert "ix_samples_gene_id" in indexes
+        assert "_old_" not in self.query("SELECT sql FROM sqlite_master WHERE name = 'called_cnvs'")[0][0]
+        assert ("known_cnvs",) in self.query("SELECT name FROM sqlite_master WHERE type = 'table'")
+        with pytest.raises(sqlite3.IntegrityError):
+            self.query(
+                "INSERT INTO cnvs (alt, chrom, start, \"end\", genome_build) "
+                "VALUES ('DEL', 'chr17', 1200, 1500, 'hg19')"
+            )
+
+    def test_already_migrated(self):
+        migrate.migrate(self.db_path)
+        assert not migrate.migrate(self.db_path)
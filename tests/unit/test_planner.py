@@ -0,0 +1,102 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+import toml
+
+from scripts import models, planner
+from scripts.db_session import DbSession
+
+
+class TestEstimate:
+    def setup(self):
+        self.history = {"decon": [(100, 10), (300, 10)], "xhmm": [(600, 20)]}
+
+    def test_scaled_by_samples(self):
+        units = [planner.Unit("decon", "BRCA1", 5), planner.Unit("xhmm", "BRCA1", 10)]
+        assert planner.estimate(units, self.history) == []
+        assert [unit.seconds for unit in units] == [100, 300]
+
+    def test_without_history(self):
+        unit = planner.Unit("codex2", "BRCA1", 4)
+        assert planner.estimate([unit], self.history) == [unit]
+        # mean of all callers is 1000 seconds over 40 samples
+        assert unit.seconds == 100
+
+    def test_no_history(self):
+        with pytest.raises(Exception):
+            planner.estimate([planner.Unit("decon", "BRCA1", 5)], {})
+
+
+class TestLongestFirst:
+    def setup(self):
+        self.cohort = planner.Unit("gatk_cohort", "BRCA1", 10)
+        self.case = planner.Unit("gatk_case", "BRCA1", 10, parents=[self.cohort])
+        self.short = planner.Unit("decon", "BRCA1", 10)
+        self.long = planner.Unit("xhmm", "BRCA1", 10)
+        for unit, seconds in [(self.cohort, 30), (self.case, 20), (self.short, 10), (self.long, 40)]:
+            unit.seconds = seconds
+        self.units = [self.short, self.cohort, self.case, self.long]
+
+    def test_order(self):
+        order = planner.longest_first(self.units, 2)
+        assert [(unit, start) for unit, start, _ in order] == [
+            (self.long, 0),
+            (self.cohort, 0),
+            (self.case, 30),
+            (self.short, 40),
+        ]
+        assert max(end for _, _, end in order) == 50
+
+    def test_single_job(self):
+        assert max(end for _, _, end in planner.longest_first(self.units, 1)) == 100
+
+    def test_parent_already_run(self):
+        order = planner.longest_first([self.case], 1)
+        assert order == [(self.case, 0, 20)]
+
+    def test_critical_path(self):
+        assert planner.critical_path(self.units) == [self.cohort, self.case]
+
+
+@pytest.mark.usefixtures("db", "db_session")
+class TestGetHistory:
+    def setup(self):
+        self.settings_dir = tempfile.mkdtemp()
+        session = DbSession.factory()
+        session.add_all(
+            [
+                models.Caller(id=10, name="gatk_case"),
+                models.Caller(id=11, name="decon"),
+                models.Gene(id=10, name="BRCA1", capture="ICR", chrom="chr17", start=1, end=2, genome_build="hg19"),
+                models.Run(
+                    id=10, caller_id=10, gene_id=10, duration=datetime.timedelta(hours=3), samples=json.dumps([1, 2])
+                ),
+                models.Run(id=11, caller_id=11, gene_id=10, duration=datetime.timedelta(hours=1), samples=None),
+            ]
+        )
+        session.commit()
+        os.makedirs(f"{self.settings_dir}/ICR/gatk_cohort")
+        cohort_settings = {
+            "start_datetime": datetime.datetime(2019, 1, 1, 10),
+            "end_datetime": datetime.datetime(2019, 1, 1, 12),
+            "unknown_bams": ["/mnt/bam-input/1.bam", "/mnt/bam-input/2.bam", "/mnt/bam-input/3.bam"],
+        }
+        with open(f"{self.settings_dir}/ICR/gatk_cohort/BRCA1.toml", "w") as handle:
+            toml.dump(cohort_settings, handle)
+        self.session = session
+
+    def teardown(self):
+        shutil.rmtree(self.settings_dir)
+        self.session.query(models.Run).filter(models.Run.id >= 10).delete()
+        self.session.query(models.Gene).filter(models.Gene.id >= 10).delete()
+        self.session.query(models.Caller).filter(models.Caller.id >= 10).delete()
+        self.session.commit()
+
+    def test_history(self):
+        history = planner.get_history(self.session, self.settings_dir)
+        # the case run includes the 2 hours of the cohort run, runs without samples are skipped
+        assert history == {"gatk_case": [(3600, 2)], "gatk_cohort": [(7200, 3)]}
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from scripts.scheduler import Deferred, Scheduler
+
+
+class TestSchedulerRun:
+    def setup(self):
+        self.scheduler = Scheduler(max_cpu=4, max_mem=8)
+        self.order = []
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def record(self, name, duration=0.05):
+        def run():
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.running, self.max_running)
+            time.sleep(duration)
+            with self.lock:
+                self.running -= 1
+                self.order.append(name)
+
+        return run
+
+    def fail(self):
+        raise Exception("Caller failed")
+
+    def test_dependency_order(self):
+        cohort = self.scheduler.add_job("cohort", self.record("cohort"), cpu=1, mem=1)
+        self.scheduler.add_job("case", self.record("case"), cpu=1, mem=1, parents=[cohort])
+        self.scheduler.add_job("other", self.record("other", duration=0.2), cpu=1, mem=1)
+
+        unsuccessful = self.scheduler.run()
+        assert unsuccessful == []
+        assert self.order == ["cohort", "case", "other"]
+
+    def test_budget(self):
+        for number in range(6):
+            self.scheduler.add_job(f"job_{number}", self.record(f"job_{number}"), cpu=2, mem=2)
+
+        self.scheduler.run()
+        assert len(self.order) == 6
+        assert self.max_running == 2
+
+    def test_oversized_job_runs_alone(self):
+        self.scheduler.add_job("big", self.record("big"), cpu=10, mem=100)
+        self.scheduler.add_job("small", self.record("small"), cpu=1, mem=1)
+
+        assert self.scheduler.run() == []
+        assert self.max_running == 1
+
+    def test_failure_cancels_dependents(self):
+        cohort = self.scheduler.add_job("cohort", self.fail)
+        case = self.scheduler.add_job("case", self.record("case"), parents=[cohort])
+        after_case = self.scheduler.add_job("after_case", self.record("after_case"), parents=[case])
+        other = self.scheduler.add_job("other", self.record("other"))
+
+        unsuccessful = self.scheduler.run()
+        assert unsuccessful == [cohort, case, after_case]
+        assert cohort.status == "failed"
+        assert case.status == "cancelled"
+        assert after_case.status == "cancelled"
+        assert other.status == "done"
+        assert self.order == ["other"]
+
+    def test_deferred_job_retried(self):
+        attempts = []
+
+        def claimed_elsewhere():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise Deferred("Run by another worker")
+
+        self.scheduler.retry_interval = 0.1
+        cohort = self.scheduler.add_job("cohort", claimed_elsewhere)
+        self.scheduler.add_job("case", self.record("case"), parents=[cohort])
+        self.scheduler.add_job("other", self.record("other"))
+
+        assert self.scheduler.run() == []
+        assert len(attempts) == 2
+        assert attempts[1] - attempts[0] >= 0.1
+        assert self.order == ["other", "case"]
@@ -0,0 +1,80 @@
+import os
+import pathlib
+import tempfile
+
+from scripts.step_cache import StepCache
+
+
+class TestStepCache:
+    def setup(self):
+        self.base_dir = pathlib.Path(tempfile.mkdtemp())
+        self.cache_dir = self.base_dir / "step-cache"
+        self.caches = []
+        for gene in ["gene_1", "gene_2"]:
+            output_base = self.base_dir / "output" / gene
+            output_base.mkdir(parents=True)
+            with open(output_base / "bam.list", "w") as handle:
+                handle.write(f"/mnt/output/{gene}/sample.bam\n")
+            self.caches.append(
+                StepCache(
+                    self.cache_dir,
+                    f"{output_base}",
+                    f"/mnt/output/{gene}",
+                    lambda path: path.replace("/mnt/output", f"{self.base_dir}/output"),
+                )
+            )
+
+    def test_key_independent_of_output_base(self):
+        keys = [cache.get_key("image:1", ["-I", f"{cache.docker_output_base}/bam.list"]) for cache in self.caches]
+        assert keys[0] == keys[1]
+
+    def test_key_uses_input_contents(self):
+        first_key = self.caches[0].get_key("image:1", ["-I", "/mnt/output/gene_1/bam.list"])
+        with open(self.base_dir / "output" / "gene_1" / "bam.list", "a") as handle:
+            handle.write("/mnt/output/gene_1/another.bam\n")
+        second_key = self.caches[0].get_key("image:1", ["-I", "/mnt/output/gene_1/bam.list"])
+        assert first_key != second_key
+
+    def test_key_uses_listed_files(self):
+        bam_path = self.base_dir / "output" / "gene_1" / "sample.bam"
+        bam_path.write_text("bam")
+        first_key = self.caches[0].get_key("image:1", ["-I", "/mnt/output/gene_1/bam.list"])
+        bam_path.write_text("replaced bam")
+        second_key = self.caches[0].get_key("image:1", ["-I", "/mnt/output/gene_1/bam.list"])
+        assert first_key != second_key
+
+    def test_key_without_resources_and_outputs(self):
+        args = ["-I", "/mnt/output/gene_1/bam.list", "-O", "/mnt/output/gene_1/Step"]
+        first_key = self.caches[0].get_key("image:1", ["java", "-Xmx1024m", *args], ["/mnt/output/gene_1/Step"])
+        pathlib.Path(self.caches[0].output_base, "Step").mkdir()
+        second_key = self.caches[0].get_key("image:1", ["java", "-Xmx2048m", *args], ["/mnt/output/gene_1/Step"])
+        assert first_key == second_key
+
+    def test_key_uses_image(self):
+        args = ["-I", "/mnt/output/gene_1/bam.list"]
+        assert self.caches[0].get_key("image:1", args) != self.caches[0].get_key("image:2", args)
+
+    def test_store_and_restore(self):
+        first, second = self.caches
+        step_dir = pathlib.Path(first.output_base, "Step")
+        step_dir.mkdir()
+        with open(step_dir / "counts.txt", "w") as handle:
+            handle.write("counts")
+
+        assert not second.restore("key", ["/mnt/output/gene_2/Step"])
+        first.store("key", ["/mnt/output/gene_1/Step"])
+        assert second.restore("key", ["/mnt/output/gene_2/Step"])
+        with open(pathlib.Path(second.output_base, "Step", "counts.txt")) as handle:
+            assert handle.read() == "counts"
+
+    def test_restore_over_existing_outputs(self):
+        first, second = self.caches
+        for cache, contents in [(first, "counts"), (second, "partial")]:
+            step_dir = pathlib.Path(cache.output_base, "Step")
+            step_dir.mkdir()
+            (step_dir / "counts.txt").write_text(contents)
+        first.store("key", ["/mnt/output/gene_1/Step"])
+
+        assert second.restore("key", ["/mnt/output/gene_2/Step"])
+        assert pathlib.Path(second.output_base, "Step", "counts.txt").read_text() == "counts"
+        assert os.listdir(pathlib.Path(second.output_base, "Step")) == ["counts.txt"]
@@ -1,4 +1,6 @@
+import os
 import pathlib
+import shutil
 
 import pytest
 
@@ -109,3 +111,194 @@ class TestSampleUtilsGetMountPoint:
         different_root = [*self.paths, "/home/user/this/wont/work/"]
         with pytest.raises(AssertionError):
             utils.SampleUtils.get_mount_point(different_root)
+
+
+class TestMergeSampleSheets:
+    def setup(self):
+        self.test_file_prefix = f"{cnv_pat_dir}/tests/test_files/input/checks"
+        self.output = f"{self.test_file_prefix}/merged/capture-wide.txt"
+        with open(f"{self.test_file_prefix}/merge_gene_1.txt", "w") as handle:
+            handle.write("sample_id\tsample_path\tresult_type\tcnv_call\n")
+            handle.write("sample_1\t/path/1.bam\tnormal-panel\t\n")
+            handle.write("sample_2\t/path/2.bam\tpositive\tDEL\n")
+            handle.write("sample_3\t/path/3.bam\tnormal-panel\t\n")
+        with open(f"{self.test_file_prefix}/merge_gene_2.txt", "w") as handle:
+            handle.write("sample_id\tsample_path\tresult_type\tcnv_call\n")
+            handle.write("sample_1\t/path/1.bam\tnormal\t\n")
+            handle.write("sample_2\t/path/2.bam\tnormal-panel\t\n")
+            handle.write("sample_4\t/path/4.bam\tnormal-panel\t\n")
+
+    def test_merged(self):
+        utils.SampleUtils.merge_sample_sheets(
+            [f"{self.test_file_prefix}/merge_gene_1.txt", f"{self.test_file_prefix}/merge_gene_2.txt"], self.output
+        )
+        with open(self.output) as handle:
+            merged = handle.read()
+        assert merged == (
+            "sample_id\tsample_path\tresult_type\n"
+            "sample_1\t/path/1.bam\tnormal\n"
+            "sample_2\t/path/2.bam\tpositive\n"
+            "sample_3\t/path/3.bam\tnormal-panel\n"
+            "sample_4\t/path/4.bam\tnormal-panel\n"
+        )
+
+    def test_unknown_result_type_skipped(self):
+        with open(f"{self.test_file_prefix}/merge_gene_2.txt", "a") as handle:
+            handle.write("sample_3\t/path/3.bam\t\t\n")
+            handle.write("sample_5\t/path/5.bam\tfailed\t\n")
+        utils.SampleUtils.merge_sample_sheets(
+            [f"{self.test_file_prefix}/merge_gene_1.txt", f"{self.test_file_prefix}/merge_gene_2.txt"], self.output
+        )
+        with open(self.output) as handle:
+            merged = handle.read()
+        assert "sample_3\t/path/3.bam\tnormal-panel\n" in merged
+        assert "sample_5" not in merged
+
+    def test_path_mismatch(self):
+        with open(f"{self.test_file_prefix}/merge_gene_2.txt", "a") as handle:
+            handle.write("sample_3\t/other/3.bam\tnormal\t\n")
+        with pytest.raises(Exception):
+            utils.SampleUtils.merge_sample_sheets(
+                [f"{self.test_file_prefix}/merge_gene_1.txt", f"{self.test_file_prefix}/merge_gene_2.txt"],
+                self.output,
+            )
+
+
+class TestGetSampleSheetPath:
+    def test_gene(self):
+        path = utils.get_sample_sheet_path("ICR", "BRCA1")
+        assert path == f"{cnv_pat_dir}/input/ICR/sample-sheets/BRCA1.txt"
+
+    def test_capture_wide(self):
+        path = utils.get_sample_sheet_path("ICR", utils.CAPTURE_WIDE)
+        assert path == f"{cnv_pat_dir}/output/ICR/sample-sheets/capture-wide.txt"
+
+
+class TestBamUtils:
+    def setup(self):
+        self.test_file_prefix = f"{cnv_pat_dir}/tests/test_files/input/checks"
+        self.bam = f"{self.test_file_prefix}/indexed.bam"
+        shutil.copy(f"{cnv_pat_dir}/tests/test_files/input/bam_header.bam", self.bam)
+        for index in [f"{self.bam}.bai", f"{self.test_file_prefix}/indexed.bai"]:
+            if os.path.exists(index):
+                os.remove(index)
+
+    def test_read_header(self):
+        with open(f"{cnv_pat_dir}/tests/test_files/input/bam_header.sam", newline="") as handle:
+            expected_header = handle.read()
+        assert utils.BamUtils.read_header(self.bam) == expected_header
+
+    def test_not_bam(self):
+        with pytest.raises(Exception):
+            utils.BamUtils.read_header(f"{cnv_pat_dir}/tests/test_files/input/bam_header.sam")
+
+    def test_sample_name(self):
+        header = "@HD\tVN:1.3\n@RG\tID:18\tSM:12S13548\n@PG\tID:bwa\n"
+        assert utils.BamUtils.get_sample_name(header) == "12S13548"
+        assert utils.BamUtils.get_sample_name("@HD\tVN:1.3\n") is None
+
+    @pytest.mark.parametrize("index", ["indexed.bam.bai", "indexed.bai"])
+    def test_index(self, index):
+        pathlib.Path(f"{self.test_file_prefix}/{index}").touch()
+        utils.BamUtils.check_index(self.bam)
+
+    def test_missing_index(self):
+        with pytest.raises(Exception):
+            utils.BamUtils.check_index(self.bam)
+
+    def test_old_index(self):
+        pathlib.Path(f"{self.bam}.bai").touch()
+        bam_mtime = os.stat(self.bam).st_mtime
+        os.utime(f"{self.bam}.bai", (bam_mtime - 10, bam_mtime - 10))
+        with pytest.raises(Exception):
+            utils.BamUtils.check_index(self.bam)
+
+
+class TestBamHeaderCache:
+    def setup(self):
+        self.test_file_prefix = f"{cnv_pat_dir}/tests/test_files/input/checks"
+        self.bam = f"{self.test_file_prefix}/cached.bam"
+        shutil.copy(f"{cnv_pat_dir}/tests/test_files/input/bam_header.bam", self.bam)
+        db_path = f"{self.test_file_prefix}/bam-header-cache.sqlite"
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        self.cache = utils.BamHeaderCache(db_path)
+
+    def test_cached(self, monkeypatch):
+        header, sample_name = self.cache.get_header(self.bam)
+        assert sample_name == "12S13548"
+
+        def fail_read(path):
+            raise AssertionError("BAM should not be read again")
+
+        monkeypatch.setattr(utils.BamUtils, "read_header", fail_read)
+        assert self.cache.get_header(self.bam) == (header, sample_name)
+
+    def test_changed_bam(self, monkeypatch):
+        self.cache.get_header(self.bam)
+        bam_mtime = os.stat(self.bam).st_mtime
+        os.utime(self.bam, (bam_mtime + 10, bam_mtime + 10))
+        monkeypatch.setattr(utils.BamUtils, "read_header", lambda path: "@RG\tID:1\tSM:changed\n")
+        assert self.cache.get_header(self.bam) == ("@RG\tID:1\tSM:changed\n", "changed")
+
+    def test_corrupt_cache_recreated(self):
+        header, sample_name = self.cache.get_header(self.bam)
+        with open(self.cache.db_path, "wb") as handle:
+            handle.write(b"not a database" * 100)
+
+        assert self.cache.get_header(self.bam) == (header, sample_name)
+        assert utils.BamHeaderCache(self.cache.db_path).get_header(self.bam) == (header, sample_name)
+
+
+class TestCompletionManifest:
+    def setup(self):
+        self.test_file_prefix = f"{cnv_pat_dir}/tests/test_files/input/checks"
+        db_path = f"{self.test_file_prefix}/completion-manifest.sqlite"
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        self.manifest = utils.CompletionManifest(db_path)
+        self.settings_path = f"{self.test_file_prefix}/gene_1.toml"
+        with open(self.settings_path, "w") as handle:
+            handle.write('gene = "gene_1"\n')
+        self.manifest.record("capture", "DECoN", "gene_1", "abc", self.settings_path)
+
+    def teardown(self):
+        if os.path.exists(self.settings_path):
+            os.remove(self.settings_path)
+
+    def test_complete(self):
+        assert self.manifest.is_complete("capture", "DECoN", "gene_1", "abc")
+        assert not self.manifest.is_complete("capture", "DECoN", "gene_2", "abc")
+        assert not self.manifest.is_complete("capture", "XHMM", "gene_1", "abc")
+
+    def test_changed_fingerprint(self):
+        assert not self.manifest.is_complete("capture", "DECoN", "gene_1", "def")
+
+    def test_settings_removed(self):
+        os.remove(self.settings_path)
+        assert not self.manifest.is_complete("capture", "DECoN", "gene_1", "abc")
+
+    def test_settings_changed(self):
+        settings_mtime = os.stat(self.settings_path).st_mtime
+        os.utime(self.settings_path, (settings_mtime + 10, settings_mtime + 10))
+        assert not self.manifest.is_complete("capture", "DECoN", "gene_1", "abc")
+
+    def test_corrupt_manifest_recreated(self):
+        with open(self.manifest.db_path, "wb") as handle:
+            handle.write(b"not a database" * 100)
+        assert not self.manifest.is_complete("capture", "DECoN", "gene_1", "abc")
+
+        self.manifest.record("capture", "DECoN", "gene_1", "abc", self.settings_path)
+        assert utils.CompletionManifest(self.manifest.db_path).is_complete("capture", "DECoN", "gene_1", "abc")
+
+
+class TestMergeSampleSheetsUnchanged:
+    def test_not_rewritten(self):
+        input_dir = f"{cnv_pat_dir}/input/ICR_example/sample-sheets"
+        output_path = f"{cnv_pat_dir}/tests/test_files/input/checks/merged/unchanged.txt"
+        sample_sheets = [f"{input_dir}/BRCA1.txt", f"{input_dir}/BRCA2.txt"]
+        utils.SampleUtils.merge_sample_sheets(sample_sheets, output_path)
+        merged_mtime = os.stat(output_path).st_mtime_ns
+        utils.SampleUtils.merge_sample_sheets(sample_sheets, output_path)
+        assert os.stat(output_path).st_mtime_ns == merged_mtime
+        os.remove(output_path)
@@ -0,0 +1,40 @@
+import gzip
+import os
+import shutil
+
+from scripts import vcf
+
+
+class TestIterCnvs:
+    def setup(self):
+        self.vcf_path = "tests/test_files/output_parsing/vcf/15384-del_segments.vcf"
+        with open(self.vcf_path) as handle:
+            self.expected = list(vcf.iter_cnvs(handle, "15384"))
+
+    def test_gzipped(self):
+        gz_path = "tests/test_files/output_parsing/vcf/15384-del_segments.vcf.gz"
+        with open(self.vcf_path, "rb") as input_handle, gzip.open(gz_path, "wb") as output_handle:
+            shutil.copyfileobj(input_handle, output_handle)
+        try:
+            with vcf.open_vcf(gz_path) as handle:
+                assert list(vcf.iter_cnvs(handle, "15384")) == self.expected
+        finally:
+            os.remove(gz_path)
+
+    def test_reference_not_decoded(self):
+        # INFO isn't valid but the record is skipped before it is decoded
+        lines = ["chr1\t100\t.\tN\t<DEL>\t.\t.\tnot_valid\tGT:CN\t0/0:2\n"]
+        assert list(vcf.iter_cnvs(lines, "sample")) == []
+
+
+class TestIterSampleCnvs:
+    def test_multi_sample(self):
+        with vcf.open_vcf("tests/test_files/output_parsing/xhmm/DATA.vcf") as handle:
+            cnvs = list(vcf.iter_sample_cnvs(handle, ["sample_1", "sample_2", "missing"]))
+
+        assert [(cnv["sample_id"], cnv["alt"], cnv["start"], cnv["end"]) for cnv in cnvs] == [
+            ("sample_1", "DEL", "5700", "5750"),
+            ("sample_2", "DUP", "5700", "5750"),
+            ("sample_1", "DEL", "100", "4000"),
+            ("sample_2", "DUP", "100", "4000"),
+        ]
@@ -7,12 +7,10 @@ from scripts.base_classes import cnv_pat_dir
 from scripts.xhmm import XHMM
 
 
-@pytest.mark.usefixtures("db", "db_session", "cleanup_after_xhmm")
+@pytest.mark.usefixtures("db", "db_session")
 class TestParseOutputFile:
     def setup(self):
         self.caller = XHMM("capture", "gene_1", "time")
-        # because needs to load docker - use dummy direcetory for bam mount
-        self.caller.bam_mount = f"{cnv_pat_dir}/logs"
         self.caller.settings = {"chromosome_prefix": "chr"}
         self.output = f"{cnv_pat_dir}/tests/test_files/output_parsing/xhmm/DATA.vcf"
         self.del_expected_output = [